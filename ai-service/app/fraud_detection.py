@@ -10,10 +10,17 @@ X_train = np.array([
     [1050, 0.1, 0.95]
 ])
 
-# Train model (In real world, load pre-trained model)
-clf = IsolationForest(random_state=42).fit(X_train)
+# Train model lazily on first use (In real world, load pre-trained model)
+clf = None
+
+def _get_classifier():
+    global clf
+    if clf is None:
+        clf = IsolationForest(random_state=42).fit(X_train)
+    return clf
 
 def detect_invoice_anomaly(amount: float, location_risk: float, vendor_trust: float):
+    clf = _get_classifier()
     # -1 is anomaly, 1 is normal
     prediction = clf.predict([[amount, location_risk, vendor_trust]])
     score = clf.decision_function([[amount, location_risk, vendor_trust]])
@@ -1,16 +1,38 @@
-import pandas as pd
-import joblib
+import hashlib
 import os
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
-import shap
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import numpy as np
+from metrics import timed, set_model_loaded
+from forest_compiler import compile_forest
+from model_registry import model_registry
 
-MODEL_PATH = "behavior_risk_model.pkl"
+MODEL_PATH = "behavior_risk_model.pkl"  # pre-registry location, adopted on first load
+REGISTRY_NAME = "behavior_risk"
+# How long a prediction waits for its SHAP explanation before returning without it
+SHAP_BUDGET_MS = float(os.getenv("SHAP_BUDGET_MS", 25))
+SHAP_CACHE_SIZE = int(os.getenv("SHAP_CACHE_SIZE", 4096))
+HIGH_RISK_THRESHOLD = 0.7
+MEDIUM_RISK_THRESHOLD = 0.4
 
 class BehaviorRiskModel:
     def __init__(self):
         self.model = None
-        self.load_model()
+        self.model_version = None
+        self.forest = None
+        self.feature_names = []
+        self.top_factors = []
+        self.explainer = None
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        # explanation id -> explanation; ids hash the feature row, so equal rows share one entry
+        self._explanations = OrderedDict()
+        self._pending = {}  # explanation id -> Future
+        self._generation = 0  # bumped on every model (re)load so stale explanations are dropped
+        self._explain_lock = threading.Lock()
+        self._explain_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shap")
+        self.explain_stats = {"hits": 0, "computed": 0, "deferred": 0, "failed": 0}
 
     def train_model(self, data: list):
         """
@@ -18,6 +40,10 @@ class BehaviorRiskModel:
         Features: completionRate, avgDelayDays, fraudFlags, duplicateImageCount, anomalyCount, totalProjects, avgRiskScore, suspensionHistory
         Label: high_risk (1 or 0)
         """
+        import pandas as pd
+        from sklearn.ensemble import RandomForestClassifier
+        from sklearn.model_selection import train_test_split
+
         df = pd.DataFrame(data)
         
         # Define features and label
@@ -36,48 +62,201 @@ class BehaviorRiskModel:
         self.model = RandomForestClassifier(n_estimators=100, random_state=42)
         self.model.fit(X_train, y_train)
 
-        # Save
-        joblib.dump(self.model, MODEL_PATH)
-        print("Model trained and saved.")
-        
         # Basic Evaluation
         score = self.model.score(X_test, y_test)
         print(f"Model Accuracy: {score}")
 
-    def load_model(self):
-        if os.path.exists(MODEL_PATH):
-            self.model = joblib.load(MODEL_PATH)
+        # Publish; running workers pick the new version up from the registry
+        self.model_version = model_registry.publish(
+            REGISTRY_NAME, self.model, {"samples": len(df), "accuracy": float(score), "source": "train_model"}
+        )
+        self._compile()
+        print("Model trained and saved.")
+
+    def load_model(self) -> bool:
+        """Load once; callers arriving while the background loader runs wait for it."""
+        with self._load_lock:
+            if self._loaded:
+                return self.model is not None
+            try:
+                loaded = model_registry.load_current(REGISTRY_NAME, legacy_path=MODEL_PATH)
+                if loaded is not None:
+                    self.model, metadata = loaded
+                    self.model_version = metadata["version"]
+                    self._compile()
+                    model_registry.mark_loaded(REGISTRY_NAME, self.model_version)
+            finally:
+                # Only once the model and its compiled forest are in place (or the load failed)
+                self._loaded = True
+            set_model_loaded("behavior_risk", self.model is not None)
+            return self.model is not None
+
+    def set_model(self, model, version: str):
+        """Swap in a new model; requests already scoring keep the one they started with."""
+        with self._load_lock:
+            self.model = model
+            self.model_version = version
+            self._compile()
+            self._loaded = True
+        set_model_loaded("behavior_risk", model is not None)
+
+    def _compile(self):
+        # Build everything before publishing it, so a concurrent prediction sees old or new, not a mix
+        cache_dir = None
+        if self.model_version:
+            # Memory-mapped by every worker serving this version
+            cache_dir = os.path.join(model_registry.artifact_dir(REGISTRY_NAME, self.model_version), "compiled")
+        forest = compile_forest(self.model, cache_dir)
+        feature_names = list(self.model.feature_names_in_)
+        # Global importances do not depend on the input, so rank them once
+        order = np.argsort(-self.model.feature_importances_, kind="stable")
+        top_factors = [feature_names[i] for i in order[:3]]
+        explainer = self._build_explainer()
+        self.forest, self.feature_names, self.top_factors, self.explainer = forest, feature_names, top_factors, explainer
+        with self._explain_lock:
+            self._generation += 1
+            self._explanations.clear()
+            self._pending.clear()
+
+    def _build_explainer(self):
+        # shap is slow to import and optional; without it topFactors stays the global ranking
+        try:
+            import shap
+            return shap.TreeExplainer(self.model)
+        except Exception as e:
+            print(f"[BEHAVIOR] SHAP explainer unavailable: {e}")
+            return None
+
+    def _shap_explanation(self, row: np.ndarray) -> dict:
+        values = self.explainer.shap_values(row.astype(np.float64))
+        # Contributions to the high-risk probability; older shap returns one array per class
+        contributions = values[1][0] if isinstance(values, list) else values[0, :, 1]
+        base = np.ravel(self.explainer.expected_value)[-1]
+        order = np.argsort(-np.abs(contributions), kind="stable")
+        return {
+            "baseValue": round(float(base), 4),
+            "attributions": {self.feature_names[i]: round(float(contributions[i]), 4) for i in order},
+            "topFactors": [self.feature_names[i] for i in order[:3]],
+        }
+
+    def _compute_explanation(self, explanation_id: str, row: np.ndarray, generation: int) -> dict:
+        try:
+            explanation = self._shap_explanation(row)
+        except Exception:
+            with self._explain_lock:
+                if generation == self._generation:
+                    self._pending.pop(explanation_id, None)
+                self.explain_stats["failed"] += 1
+            raise
+        with self._explain_lock:
+            if generation != self._generation:
+                return explanation
+            self._explanations[explanation_id] = explanation
+            while len(self._explanations) > SHAP_CACHE_SIZE:
+                self._explanations.popitem(last=False)
+            self._pending.pop(explanation_id, None)
+            self.explain_stats["computed"] += 1
+        return explanation
+
+    def _explain(self, row: np.ndarray):
+        """(explanation id, explanation or None if it is still being computed)."""
+        explanation_id = hashlib.sha1(row.tobytes()).hexdigest()[:16]
+        with self._explain_lock:
+            explanation = self._explanations.get(explanation_id)
+            if explanation is not None:
+                self._explanations.move_to_end(explanation_id)
+                self.explain_stats["hits"] += 1
+                return explanation_id, explanation
+            future = self._pending.get(explanation_id)
+            if future is None:
+                future = self._explain_pool.submit(
+                    self._compute_explanation, explanation_id, row, self._generation)
+                self._pending[explanation_id] = future
+        try:
+            return explanation_id, future.result(timeout=SHAP_BUDGET_MS / 1000.0)
+        except FutureTimeout:
+            # Keeps running in the background; fetch it later with get_explanation()
+            with self._explain_lock:
+                self.explain_stats["deferred"] += 1
+            return explanation_id, None
+        except Exception as e:
+            print(f"[BEHAVIOR] SHAP explanation failed: {e}")
+            return explanation_id, None
+
+    def get_explanation(self, explanation_id: str):
+        """A previously requested explanation: its status plus, once ready, the attributions."""
+        with self._explain_lock:
+            explanation = self._explanations.get(explanation_id)
+            if explanation is not None:
+                return dict(explanation, explanationId=explanation_id, status="ready")
+            if explanation_id in self._pending:
+                return {"explanationId": explanation_id, "status": "pending"}
+        return None
+
+    def explanation_snapshot(self) -> dict:
+        with self._explain_lock:
+            return dict(self.explain_stats, cached=len(self._explanations), pending=len(self._pending),
+                        enabled=self.explainer is not None)
 
+    @timed("behavior_predict_risk")
     def predict_risk(self, features: dict):
+        if not self._loaded:
+            self.load_model()
         if not self.model:
             return {"error": "Model not trained yet"}
 
-        # Prepare input dataframe
-        input_data = pd.DataFrame([features])
-        
-        # Predict Probability
-        prob = self.model.predict_proba(input_data)[0][1] # Probability of class 1 (High Risk)
-        
+        # Row in the fitted feature order; the compiled forest matches predict_proba exactly
+        row = np.array([[features[name] for name in self.feature_names]], dtype=np.float32)
+        predictor = self.forest or self.model
+        prob = predictor.predict_proba(row)[0][1] # Probability of class 1 (High Risk)
+
         # Predict Level
         risk_level = "LOW"
-        if prob > 0.7:
+        if prob > HIGH_RISK_THRESHOLD:
             risk_level = "HIGH"
-        elif prob > 0.4:
+        elif prob > MEDIUM_RISK_THRESHOLD:
             risk_level = "MEDIUM"
 
-        # SHAP Explanation (Simplified for fast inference)
-        # For full SHAP in production, you might calculate this asynchronously or cache explainer
-        # Here we just return top factors based on feature importance from the tree for speed
-        feature_importances = pd.DataFrame(
-            self.model.feature_importances_,
-            index = input_data.columns,
-            columns=['importance']
-        ).sort_values('importance', ascending=False)
-        
-        top_factors = feature_importances.head(3).index.tolist()
-
-        return {
+        result = {
             "riskProbability": round(float(prob), 2),
             "riskLevel": risk_level,
-            "topFactors": top_factors
+            "topFactors": self.top_factors
+        }
+
+        # Per-contractor SHAP attributions, memoized per feature row and bounded by SHAP_BUDGET_MS
+        if self.explainer is not None:
+            explanation_id, explanation = self._explain(row)
+            result["explanationId"] = explanation_id
+            if explanation is not None:
+                result["topFactors"] = explanation["topFactors"]
+                result["attributions"] = explanation["attributions"]
+                result["explanationStatus"] = "ready"
+            else:
+                result["explanationStatus"] = "pending"
+        return result
+
+    @timed("behavior_predict_risk_batch")
+    def predict_risk_batch(self, records: list):
+        """
+        Score many feature dicts with one predict_proba call.
+        Per-row values match predict_risk; topFactors is the global ranking
+        (SHAP for a whole portfolio belongs offline, not in one request).
+        """
+        if not self._loaded:
+            self.load_model()
+        if not self.model:
+            return {"error": "Model not trained yet"}
+
+        X = np.array([[record[name] for name in self.feature_names] for record in records], dtype=np.float32)
+        predictor = self.forest or self.model
+        probs = predictor.predict_proba(X)[:, 1]
+        levels = np.select(
+            [probs > HIGH_RISK_THRESHOLD, probs > MEDIUM_RISK_THRESHOLD], ["HIGH", "MEDIUM"], default="LOW"
+        )
+        return {
+            "results": [
+                {"riskProbability": round(prob, 2), "riskLevel": level}
+                for prob, level in zip(probs.tolist(), levels.tolist())
+            ],
+            "topFactors": self.top_factors,
         }
@@ -0,0 +1,87 @@
+"""
+Parity and latency: sklearn RandomForestClassifier.predict_proba vs CompiledForest.
+
+Usage: python benchmarks/bench_forest.py [--repeat 20] [--sizes 1 10 100 1000 10000]
+
+Loads models/fraud_model.pkl and behavior_risk_model.pkl, draws random rows
+spread over each feature's split thresholds, and checks the compiled
+traversal is bit-identical (np.array_equal) to sklearn at every size before
+timing both paths. "compiled" is CompiledForest.predict_proba, which hands
+batches above FOREST_CROSSOVER_ROWS to sklearn.
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+from forest_compiler import compile_forest, FOREST_CROSSOVER_ROWS
+
+MODELS = ("models/fraud_model.pkl", "behavior_risk_model.pkl")
+
+
+def sample_rows(forest, n_features: int, n: int, rng) -> np.ndarray:
+    # Draw each feature around the thresholds the trees actually split on
+    X = np.empty((n, n_features))
+    internal = forest.is_internal
+    for f in range(n_features):
+        thresholds = forest.threshold[internal & (forest.feature == f)]
+        if thresholds.size:
+            X[:, f] = rng.choice(thresholds, n) + rng.normal(0, thresholds.std() / 10 + 1e-3, n)
+        else:
+            X[:, f] = rng.normal(size=n)
+    # Exact threshold values exercise the `<=` tie handling
+    ties = rng.random(X.shape) < 0.05
+    X[ties] = rng.choice(forest.threshold[internal], ties.sum())
+    return X
+
+
+def best_of(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000, 10000])
+    args = parser.parse_args()
+
+    import joblib
+    warnings.filterwarnings("ignore")  # pickles from older sklearn, fitted-with-feature-names notices
+    rng = np.random.default_rng(0)
+
+    for name in MODELS:
+        path = os.path.join(BASE_DIR, name)
+        if not os.path.exists(path):
+            print(f"{name}: not found, skipped")
+            continue
+        model = joblib.load(path)
+        forest = compile_forest(model)
+        print(f"\n{name}: {forest.n_trees} trees, {len(forest.feature)} nodes, max depth {forest.max_depth}")
+        print(f"{'rows':>6} {'parity':>7} {'sklearn ms':>11} {'compiled ms':>12} {'speedup':>8}"
+              f"  (crossover {FOREST_CROSSOVER_ROWS} rows)")
+        for n in args.sizes:
+            X = sample_rows(forest, model.n_features_in_, n, rng)
+            # Parity of the NumPy traversal itself, even where predict_proba would hand off to sklearn
+            X32 = X.astype(np.float32)
+            identical = np.array_equal(model.predict_proba(X), forest.predict_proba_compiled(X32))
+            t_sk = best_of(lambda: model.predict_proba(X), args.repeat)
+            t_cf = best_of(lambda: forest.predict_proba(X), args.repeat)
+            print(f"{n:>6} {'OK' if identical else 'DIFF':>7} {t_sk * 1000:11.3f} {t_cf * 1000:12.3f} "
+                  f"{t_sk / t_cf:7.1f}x")
+            if not identical:
+                sys.exit(f"{name}: compiled probabilities differ from sklearn at {n} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark: HashIndex radius query vs the old per-entry imagehash loop.
+
+Usage: python benchmarks/bench_hash_index.py [--entries 1000000] [--queries 200] [--threshold 5]
+
+The old linear scan is timed on a slice and extrapolated to the full size,
+since running it over 1M entries per query takes seconds.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hash_index import HashIndex, _HAS_BITWISE_COUNT
+
+
+def linear_scan(hashes, query_hex, threshold):
+    """The pre-index DuplicateDetector loop, kept for comparison."""
+    import imagehash
+    query = imagehash.hex_to_hash(query_hex)
+    matches = []
+    for stored_hex, stored_id in hashes:
+        dist = query - imagehash.hex_to_hash(stored_hex)
+        if dist < threshold:
+            matches.append((stored_id, dist))
+    return matches
+
+
+def near(code: int, rng, bits: int) -> int:
+    """Flip `bits` random bits of code."""
+    for b in rng.choice(64, size=bits, replace=False):
+        code ^= 1 << int(b)
+    return code
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--threshold", type=int, default=5)
+    parser.add_argument("--linear-sample", type=int, default=20_000,
+                        help="entries used to time the old Python loop")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    codes = rng.integers(0, 2**63, size=args.entries, dtype=np.uint64) | (
+        rng.integers(0, 2, size=args.entries, dtype=np.uint64) << np.uint64(63))
+    hexes = [f"{int(c):016x}" for c in codes]
+    ids = [f"receipt_{i}.jpg" for i in range(args.entries)]
+
+    start = time.perf_counter()
+    index = HashIndex(args.entries)
+    index.add_many(hexes, ids)
+    build = time.perf_counter() - start
+
+    # Half the queries are planted near-duplicates, half are random
+    targets = rng.integers(0, args.entries, size=args.queries)
+    queries = []
+    for q, t in enumerate(targets):
+        if q % 2 == 0:
+            queries.append(f"{near(int(codes[t]), rng, int(rng.integers(0, args.threshold))):016x}")
+        else:
+            queries.append(f"{int(rng.integers(0, 2**64, dtype=np.uint64)):016x}")
+
+    timings = []
+    found = 0
+    for qhex in queries:
+        t0 = time.perf_counter()
+        matches = index.query(qhex, args.threshold)
+        timings.append(time.perf_counter() - t0)
+        found += bool(matches)
+    timings = np.array(timings) * 1000
+
+    # Correctness against the reference loop on a prefix of the data
+    sample = list(zip(hexes[:args.linear_sample], ids[:args.linear_sample]))
+    prefix = HashIndex(len(sample))
+    prefix.add_many(hexes[:args.linear_sample], ids[:args.linear_sample])
+    mismatches = 0
+    linear_times = []
+    for qhex in queries[:10]:
+        t0 = time.perf_counter()
+        expected = linear_scan(sample, qhex, args.threshold)
+        linear_times.append(time.perf_counter() - t0)
+        if sorted(expected) != sorted(prefix.query(qhex, args.threshold)):
+            mismatches += 1
+    linear_ms = np.mean(linear_times) * 1000 * args.entries / max(1, len(sample))
+
+    print(f"entries={args.entries:,} threshold<{args.threshold} popcount="
+          f"{'np.bitwise_count' if _HAS_BITWISE_COUNT else 'byte LUT'}")
+    print(f"build:        {build:.2f}s ({index._codes.nbytes / 2**20:.1f} MiB of codes)")
+    print(f"index query:  p50={np.percentile(timings, 50):.2f}ms p95={np.percentile(timings, 95):.2f}ms "
+          f"max={timings.max():.2f}ms ({found}/{args.queries} queries matched)")
+    print(f"linear loop:  ~{linear_ms:.0f}ms per query (extrapolated from {len(sample):,} entries)")
+    print(f"speedup:      ~{linear_ms / np.percentile(timings, 50):.0f}x")
+    print(f"parity:       {'OK' if mismatches == 0 else f'{mismatches} mismatching queries'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Parity, throughput and memory: EasyOCR (PyTorch) vs the ONNX Runtime backend.
+
+Usage: python benchmarks/bench_ocr_backends.py [--limit 40] [--backends easyocr onnx]
+                                                [--min-similarity 0.95] [--min-field-agreement 0.95]
+
+Each backend runs in its own subprocess (OCR_BACKEND=<name>) over the sample
+receipts so RSS is measured in isolation. The reference is the first backend
+listed; the others are compared against its text and extracted fields.
+Export the ONNX models first with training/export_ocr_onnx.py.
+
+Parity is a gate, not just a report: the script exits non-zero when a backend
+fails to load, falls back to another one, or, against the reference, has a
+mean text similarity below --min-similarity or agrees on any of GATED_FIELDS
+for fewer than --min-field-agreement of the receipts.
+"""
+import argparse
+import csv
+import difflib
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+DATASET_DIR = os.path.join(BASE_DIR, "dataset")
+METADATA_FILE = os.path.join(DATASET_DIR, "metadata.csv")
+FIELDS = ("invoiceNumber", "amount", "date", "gstNumber", "vendorName")
+# The fields the fraud rules act on; a backend that changes them changes verdicts
+GATED_FIELDS = ("invoiceNumber", "amount", "gstNumber")
+
+
+def rss_mib() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def sample_paths(limit: int) -> list:
+    with open(METADATA_FILE, newline="") as f:
+        rows = list(csv.DictReader(f))
+    paths = [os.path.join(DATASET_DIR, "receipts", r["label"], r["filename"]) for r in rows]
+    paths = [p for p in paths if os.path.exists(p)]
+    return paths[:limit] if limit else paths
+
+
+def child(limit: int):
+    """Runs inside the subprocess: load the configured backend, OCR the samples, print JSON."""
+    baseline = rss_mib()
+    start = time.perf_counter()
+    from ocr_analyzer import ocr_analyzer, load_reader, get_reader
+    from document_image import DocumentImage
+    if not load_reader():
+        print(json.dumps({"error": "backend failed to load"}))
+        return
+    load_seconds = time.perf_counter() - start
+    after_load = rss_mib()
+
+    paths = sample_paths(limit)
+    ocr_analyzer.extract_text(DocumentImage.from_path(paths[0]), mode="full")  # warm-up
+
+    texts, latencies = {}, []
+    for path in paths:
+        doc = DocumentImage.from_path(path)
+        t0 = time.perf_counter()
+        texts[os.path.basename(path)] = ocr_analyzer.extract_text(doc, mode="full")
+        latencies.append(time.perf_counter() - t0)
+
+    print(json.dumps({
+        "backend": get_reader().name,
+        "loadSeconds": load_seconds,
+        "rssBaselineMiB": baseline,
+        "rssAfterLoadMiB": after_load,
+        "rssPeakMiB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "latencies": latencies,
+        "texts": texts,
+    }))
+
+
+def run_backend(name: str, limit: int) -> dict:
+    env = dict(os.environ, OCR_BACKEND=name)
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", "--limit", str(limit)],
+        env=env, cwd=BASE_DIR, capture_output=True, text=True, check=True,
+    ).stdout
+    # The JSON document is the last line; anything before it is pipeline logging
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--limit", type=int, default=40)
+    parser.add_argument("--backends", nargs="+", default=["easyocr", "onnx"])
+    parser.add_argument("--min-similarity", type=float, default=0.95,
+                        help="minimum mean text similarity to the reference (0-1)")
+    parser.add_argument("--min-field-agreement", type=float, default=0.95,
+                        help="minimum share of receipts whose gated fields match the reference (0-1)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.limit)
+        return
+
+    from ocr_analyzer import ocr_analyzer
+
+    runs = [run_backend(name, args.limit) for name in args.backends]
+    for requested, run in zip(args.backends, runs):
+        if "error" in run:
+            sys.exit(f"{requested}: {run['error']}")
+        if run["backend"] != requested:
+            sys.exit(f"{requested} fell back to {run['backend']}; check the exported models")
+
+    print(f"{'backend':>8} {'load s':>7} {'img/s':>7} {'p50 ms':>7} {'RSS load':>9} {'RSS peak':>9}")
+    for run in runs:
+        lat = sorted(run["latencies"])
+        print(f"{run['backend']:>8} {run['loadSeconds']:7.1f} {len(lat) / sum(lat):7.2f} "
+              f"{lat[len(lat) // 2] * 1000:7.0f} {run['rssAfterLoadMiB']:8.0f}M {run['rssPeakMiB']:8.0f}M")
+
+    reference = runs[0]
+    failures = []
+    for run in runs[1:]:
+        names = sorted(reference["texts"])
+        exact = sum(reference["texts"][n] == run["texts"].get(n) for n in names)
+        similarity = sum(
+            difflib.SequenceMatcher(None, reference["texts"][n], run["texts"].get(n, "")).ratio()
+            for n in names
+        ) / len(names)
+        agree = {k: 0 for k in FIELDS}
+        for n in names:
+            ref_fields = ocr_analyzer.extract_fields(reference["texts"][n])
+            fields = ocr_analyzer.extract_fields(run["texts"].get(n, ""))
+            for k in FIELDS:
+                agree[k] += ref_fields[k] == fields[k]
+        print(f"\nparity {run['backend']} vs {reference['backend']} on {len(names)} receipts:")
+        print(f"  identical text: {exact / len(names):.0%}   mean text similarity: {similarity:.3f}")
+        print("  field agreement: " + ", ".join(f"{k}={v / len(names):.0%}" for k, v in agree.items()))
+
+        if similarity < args.min_similarity:
+            failures.append(f"{run['backend']}: mean text similarity {similarity:.3f} < {args.min_similarity:g}")
+        for k in GATED_FIELDS:
+            rate = agree[k] / len(names)
+            if rate < args.min_field_agreement:
+                failures.append(f"{run['backend']}: {k} agreement {rate:.1%} < {args.min_field_agreement:.0%}")
+
+    if failures:
+        sys.exit("\nPARITY FAILED\n  " + "\n  ".join(failures))
+    print("\nparity OK")
+
+if __name__ == "__main__":
+    main()
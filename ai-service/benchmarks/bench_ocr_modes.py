@@ -0,0 +1,97 @@
+"""
+Benchmark: full-page OCR vs the ROI/DPI-adaptive mode on dataset/receipts.
+
+Usage: python benchmarks/bench_ocr_modes.py [--limit 50]
+
+For every receipt listed in dataset/metadata.csv both modes run on a fresh
+DocumentImage (so neither reuses the other's decoded arrays). Reports
+latency, how often roi mode fell back to the full page, amount accuracy
+against the labelled total_amount, and per-field agreement with full mode.
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+from document_image import DocumentImage
+from ocr_analyzer import ocr_analyzer, load_reader
+
+DATASET_DIR = os.path.join(BASE_DIR, "dataset")
+METADATA_FILE = os.path.join(DATASET_DIR, "metadata.csv")
+FIELDS = ("invoiceNumber", "amount", "date", "gstNumber", "vendorName")
+
+
+def run(path: str, mode: str):
+    doc = DocumentImage.from_path(path)
+    start = time.perf_counter()
+    text, used = ocr_analyzer.extract_text_with_mode(doc, mode)
+    elapsed = time.perf_counter() - start
+    return elapsed, used, ocr_analyzer.extract_fields(text)
+
+
+def amount_ok(fields: dict, expected: float) -> bool:
+    return fields.get("amount") is not None and abs(fields["amount"] - expected) < 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--limit", type=int, default=50, help="receipts to process (0 = all)")
+    args = parser.parse_args()
+
+    if not load_reader():
+        sys.exit("EasyOCR is not available")
+
+    with open(METADATA_FILE, newline="") as f:
+        rows = list(csv.DictReader(f))
+    if args.limit:
+        rows = rows[:args.limit]
+
+    # Warm the models so the first image does not carry the load time
+    first = os.path.join(DATASET_DIR, "receipts", rows[0]["label"], rows[0]["filename"])
+    run(first, "full")
+
+    stats = {m: {"latency": [], "amount": 0} for m in ("full", "roi")}
+    agree = {k: 0 for k in FIELDS}
+    modes_used = {}
+    processed = 0
+
+    for row in rows:
+        path = os.path.join(DATASET_DIR, "receipts", row["label"], row["filename"])
+        if not os.path.exists(path):
+            continue
+        expected = float(row["total_amount"])
+
+        full_t, _, full_fields = run(path, "full")
+        roi_t, used, roi_fields = run(path, "roi")
+
+        stats["full"]["latency"].append(full_t)
+        stats["roi"]["latency"].append(roi_t)
+        stats["full"]["amount"] += amount_ok(full_fields, expected)
+        stats["roi"]["amount"] += amount_ok(roi_fields, expected)
+        modes_used[used] = modes_used.get(used, 0) + 1
+        for k in FIELDS:
+            agree[k] += full_fields.get(k) == roi_fields.get(k)
+        processed += 1
+
+    if not processed:
+        sys.exit("No receipts found")
+
+    print(f"receipts: {processed}")
+    for mode, s in stats.items():
+        lat = np.array(s["latency"]) * 1000
+        print(f"{mode:>5}: p50={np.percentile(lat, 50):.0f}ms p95={np.percentile(lat, 95):.0f}ms "
+              f"mean={lat.mean():.0f}ms  amount accuracy={s['amount'] / processed:.1%}")
+    speedup = np.mean(stats["full"]["latency"]) / np.mean(stats["roi"]["latency"])
+    print(f"roi speedup (mean): {speedup:.2f}x")
+    print("roi modes used: " + ", ".join(f"{m}={n}" for m, n in sorted(modes_used.items())))
+    print("field agreement with full mode: " + ", ".join(f"{k}={v / processed:.0%}" for k, v in agree.items()))
+
+
+if __name__ == "__main__":
+    main()
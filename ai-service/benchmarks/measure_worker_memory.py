@@ -0,0 +1,157 @@
+"""
+Per-worker memory with N workers: plain uvicorn vs gunicorn with preloaded models.
+
+Usage: python benchmarks/measure_worker_memory.py [--workers 4] [--modes uvicorn gunicorn] [--requests 20]
+
+Starts the service in each mode, waits for /ready, sends a few /predict-risk
+requests so every worker has touched the models, then reads
+/proc/<pid>/smaps_rollup for the master and all its descendants:
+  RSS  resident pages, shared ones counted in full by every process
+  PSS  resident pages with shared ones split between the processes using them
+  USS  pages private to the process (Private_Clean + Private_Dirty)
+Sum of PSS is the real footprint of the deployment; USS is what one more
+worker would add.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RISK_FORM = {
+    "completionRate": "0.8", "avgDelayDays": "4", "fraudFlags": "0", "duplicateImageCount": "0",
+    "anomalyCount": "1", "totalProjects": "12", "avgRiskScore": "30", "suspensionHistory": "0",
+}
+
+
+def command(mode: str, workers: int, port: int) -> list:
+    if mode == "gunicorn":
+        return [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+                "-w", str(workers), "-b", f"127.0.0.1:{port}", "main:app"]
+    return [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+            "--port", str(port), "--workers", str(workers)]
+
+
+def descendants(root: int) -> list:
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # comm may contain spaces; the fields after its closing paren are fixed
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    found, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        found.append(pid)
+        stack.extend(children.get(pid, []))
+    return found
+
+
+def smaps_rollup(pid: int) -> dict:
+    """kB values from /proc/<pid>/smaps_rollup (kernel 4.14+)."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1])
+    return values
+
+
+def describe(pid: int, root: int) -> str:
+    if pid == root:
+        return "master"
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            cmdline = f.read().replace(b"\0", b" ").decode(errors="replace")
+    except OSError:
+        return "?"
+    return "tracker" if "resource_tracker" in cmdline else "worker"
+
+
+def get(url: str, timeout: float = 2.0) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as resp:
+            return resp.status
+    except Exception:
+        return 0
+
+
+def wait_until_ready(port: int, workers: int, root: int, timeout: float):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        workers_up = sum(describe(pid, root) == "worker" for pid in descendants(root))
+        if workers_up >= workers and get(f"http://127.0.0.1:{port}/ready") == 200:
+            return
+        time.sleep(1)
+    raise TimeoutError(f"service on port {port} not ready after {timeout:.0f}s")
+
+
+def warm_up(port: int, requests: int):
+    body = urllib.parse.urlencode(RISK_FORM).encode()
+    for _ in range(requests):
+        # Each worker loads anything not preloaded on first use; spread requests over all of them
+        urllib.request.urlopen(f"http://127.0.0.1:{port}/predict-risk", data=body, timeout=60).read()
+
+
+def measure(mode: str, workers: int, port: int, requests: int, timeout: float) -> list:
+    proc = subprocess.Popen(command(mode, workers, port), cwd=BASE_DIR,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    try:
+        wait_until_ready(port, workers, proc.pid, timeout)
+        warm_up(port, requests)
+        # Let the per-worker background loaders finish
+        time.sleep(3)
+        wait_until_ready(port, workers, proc.pid, timeout)
+        rows = []
+        for pid in descendants(proc.pid):
+            try:
+                rollup = smaps_rollup(pid)
+            except OSError:
+                continue
+            uss = rollup.get("Private_Clean", 0) + rollup.get("Private_Dirty", 0)
+            rows.append((describe(pid, proc.pid), pid, rollup.get("Rss", 0), rollup.get("Pss", 0), uss))
+        return rows
+    finally:
+        os.killpg(proc.pid, signal.SIGTERM)
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--modes", nargs="+", default=["uvicorn", "gunicorn"], choices=["uvicorn", "gunicorn"])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--requests", type=int, default=20, help="warm-up /predict-risk calls")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for /ready")
+    args = parser.parse_args()
+
+    for mode in args.modes:
+        rows = measure(mode, args.workers, args.port, args.requests, args.timeout)
+        print(f"\n{mode} with {args.workers} workers")
+        print(f"{'process':>8} {'pid':>7} {'RSS MiB':>9} {'PSS MiB':>9} {'USS MiB':>9}")
+        for role, pid, rss, pss, uss in sorted(rows, key=lambda r: (r[0] != "master", r[1])):
+            print(f"{role:>8} {pid:>7} {rss / 1024:9.1f} {pss / 1024:9.1f} {uss / 1024:9.1f}")
+        worker_rows = [r for r in rows if r[0] == "worker"]
+        total_pss = sum(r[3] for r in rows) / 1024
+        mean_uss = sum(r[4] for r in worker_rows) / max(len(worker_rows), 1) / 1024
+        print(f"{'total':>8} {'':>7} {sum(r[2] for r in rows) / 1024:9.1f} {total_pss:9.1f} "
+              f"{sum(r[4] for r in rows) / 1024:9.1f}")
+        print(f"  footprint (sum PSS): {total_pss:.1f} MiB; each extra worker adds ~{mean_uss:.1f} MiB (mean USS)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Decode-once document image shared by every stage of the analysis pipeline.
+Holds the raw upload bytes and lazily computes (and caches) the decoded
+forms each check needs, so one request never decodes the same file twice.
+"""
+import base64
+import hashlib
+import os
+import threading
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+DOWNSCALE_MAX_SIDE = int(os.getenv("DOWNSCALE_MAX_SIDE", 1600))
+
+
+class DocumentImage:
+    """Upload bytes plus lazily decoded, cached views of the same image."""
+
+    def __init__(self, data: bytes, name: str = "upload.png", content_hash: str = None):
+        if not data:
+            raise ValueError("Empty image data")
+        self.data = data
+        self.name = name
+        self._cache = {}
+        self._lock = threading.RLock()
+        if content_hash:
+            self._cache["content_hash"] = content_hash
+
+    @classmethod
+    def from_bytes(cls, data: bytes, name: str = "upload.png", content_hash: str = None):
+        return cls(data, name=name, content_hash=content_hash)
+
+    @classmethod
+    def from_base64(cls, b64_string: str, name: str = "upload.png"):
+        """Decode a (possibly data-URI prefixed) base64 string."""
+        if "," in b64_string:
+            b64_string = b64_string.split(",", 1)[1]
+        return cls(base64.b64decode(b64_string), name=name)
+
+    @classmethod
+    def from_path(cls, image_path: str):
+        with open(image_path, "rb") as f:
+            return cls(f.read(), name=os.path.basename(image_path))
+
+    def cached(self, key, compute):
+        """Return the cached value for key, computing it once on first use."""
+        if key in self._cache:
+            return self._cache[key]
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = compute()
+            return self._cache[key]
+
+    @property
+    def content_hash(self) -> str:
+        """SHA-256 of the raw upload bytes."""
+        return self.cached("content_hash", lambda: hashlib.sha256(self.data).hexdigest())
+
+    @property
+    def bgr(self):
+        """Decoded BGR ndarray (OpenCV layout), or None if undecodable."""
+        def decode():
+            buf = np.frombuffer(self.data, dtype=np.uint8)
+            return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+        return self.cached("bgr", decode)
+
+    @property
+    def rgb(self):
+        """RGB ndarray derived from the BGR view (EasyOCR detector layout)."""
+        def convert():
+            img = self.bgr
+            return None if img is None else cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        return self.cached("rgb", convert)
+
+    @property
+    def gray(self):
+        """Grayscale ndarray derived from the BGR view."""
+        def convert():
+            img = self.bgr
+            return None if img is None else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        return self.cached("gray", convert)
+
+    @property
+    def pil(self):
+        """PIL view of the original bytes (format and info preserved)."""
+        def open_pil():
+            img = Image.open(BytesIO(self.data))
+            img.load()
+            return img
+        return self.cached("pil", open_pil)
+
+    @property
+    def pil_rgb(self):
+        """PIL view converted to RGB."""
+        return self.cached("pil_rgb", lambda: self.pil.convert("RGB"))
+
+    def downscaled(self, max_side: int = DOWNSCALE_MAX_SIDE):
+        """BGR copy whose longest side is at most max_side (original if already smaller)."""
+        def resize():
+            img = self.bgr
+            if img is None:
+                return None
+            h, w = img.shape[:2]
+            scale = max_side / float(max(h, w))
+            if scale >= 1.0:
+                return img
+            return cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        return self.cached(("downscaled", max_side), resize)
+
+    @property
+    def exif_tags(self) -> dict:
+        """EXIF tags parsed with exifread from the in-memory bytes."""
+        def parse():
+            import exifread
+            return exifread.process_file(BytesIO(self.data), details=False)
+        return self.cached("exif_tags", parse)
+
+    @property
+    def dpi(self):
+        """Horizontal DPI from the file header, or None when the image does not declare one."""
+        def read():
+            try:
+                value = Image.open(BytesIO(self.data)).info.get("dpi")
+                return float(value[0]) if value and value[0] else None
+            except Exception:
+                return None
+        return self.cached("dpi", read)
+
+    @property
+    def shape(self):
+        img = self.bgr
+        return None if img is None else img.shape
+
+    def __getstate__(self):
+        # Only the bytes cross process boundaries; decoded views are rebuilt lazily
+        return {"data": self.data, "name": self.name, "content_hash": self._cache.get("content_hash")}
+
+    def __setstate__(self, state):
+        self.__init__(state["data"], name=state["name"], content_hash=state["content_hash"])
+
+    def __repr__(self):
+        return f"DocumentImage(name={self.name!r}, bytes={len(self.data)})"
+
+
+def as_document(image) -> DocumentImage:
+    """Accept a DocumentImage, raw bytes, or a filesystem path."""
+    if isinstance(image, DocumentImage):
+        return image
+    if isinstance(image, (bytes, bytearray)):
+        return DocumentImage(bytes(image))
+    return DocumentImage.from_path(image)
@@ -1,63 +1,80 @@
-from PIL import Image
 import imagehash
-import os
-import json
-
-HASH_DB_FILE = "image_hashes.json"
+import threading
+from document_image import DocumentImage
+from metrics import timed, HASH_DB_SIZE
+from hash_index import HashIndex, hash_to_int
+from hash_store import HashStore
 
 class DuplicateDetector:
     def __init__(self):
-        self.hashes = [] # List of (hash_str, filename_or_id)
-        self.load_hashes()
+        self.store = None   # HashStore, opened (and JSON-migrated) on first load
+        self.index = HashIndex()
+        self._last_id = 0   # last store row mirrored into the index
+        self._loaded = False
+        self._lock = threading.Lock()
 
-    def load_hashes(self):
-        if os.path.exists(HASH_DB_FILE):
-            try:
-                with open(HASH_DB_FILE, 'r') as f:
-                    self.hashes = json.load(f)
-            except Exception:
-                self.hashes = []
+    def load_hashes(self) -> bool:
+        with self._lock:
+            if self._loaded:
+                return True
+            self.store = HashStore()
+            last_id, codes, ids = self.store.load_since(0)
+            self.index = HashIndex(len(ids))
+            self.index.add_codes(codes, ids)
+            self._last_id = last_id
+            self.store.start_compaction()
+            self._loaded = True
+            HASH_DB_SIZE.set(len(self.index))
+            return True
 
-    def save_hashes(self):
-        try:
-            with open(HASH_DB_FILE, 'w') as f:
-                json.dump(self.hashes, f)
-        except Exception as e:
-            print(f"Failed to save image hashes: {e}")
+    def _refresh(self, conn=None):
+        """Mirror rows appended by other workers since the last read."""
+        with self._lock:
+            last_id, codes, ids = self.store.load_since(self._last_id, conn)
+            if ids:
+                self.index.add_codes(codes, ids)
+                self._last_id = last_id
 
-    def check_duplicate(self, image_path: str, threshold: int = 5):
+    @timed("duplicate_phash_lookup")
+    def check_duplicate(self, doc: DocumentImage, threshold: int = 5):
         """
         Generates perceptual hash and compares with DB.
-        Returns dict with is_duplicate, etc.
+        Returns dict with is_duplicate, etc.; "matches" lists every stored
+        image within the threshold, nearest first.
         """
-        if not os.path.exists(image_path):
-             return {"is_duplicate": False, "error": "File not found"}
-
+        if not self._loaded:
+            self.load_hashes()
         try:
-            img = Image.open(image_path)
+            img = doc.pil
             # perceptual hash (pHash) is good for robust matching (resizing/minor edits)
             img_hash = imagehash.phash(img)
             img_hash_str = str(img_hash)
 
-            # Compare against existing
-            for stored_hash_str, stored_id in self.hashes:
-                stored_hash = imagehash.hex_to_hash(stored_hash_str)
-                dist = img_hash - stored_hash
-                
-                if dist < threshold:
+            # The write transaction makes refresh + compare + insert atomic across workers
+            with self.store.transaction() as conn:
+                self._refresh(conn)
+
+                # Compare against existing (vectorized Hamming radius query)
+                matches = self.index.query(img_hash_str, threshold)
+                if matches:
+                    best_id, best_dist = matches[0]
                     return {
                         "is_duplicate": True,
                         "hash": img_hash_str,
-                        "similarity_score": dist,
-                        "matched_with": stored_id
+                        "similarity_score": best_dist,
+                        "matched_with": best_id,
+                        "matches": [{"id": i, "distance": d} for i, d in matches]
                     }
 
-            # If not duplicate, store it
-            # In a real app, we'd want to store some ID (invoice number) with it.
-            # For now, just using filename or a placeholder.
-            self.hashes.append((img_hash_str, os.path.basename(image_path)))
-            self.save_hashes()
-            
+                # If not duplicate, store it
+                # In a real app, we'd want to store some ID (invoice number) with it.
+                # For now, just using filename or a placeholder.
+                self.store.append(conn, hash_to_int(img_hash_str), doc.name)
+
+            # Committed; pick the new row up through the normal incremental path
+            self._refresh()
+            HASH_DB_SIZE.set(len(self.index))
+
             return {
                 "is_duplicate": False,
                 "hash": img_hash_str,
@@ -70,6 +87,9 @@ class DuplicateDetector:
 # Singleton instance
 _detector = DuplicateDetector()
 
+def load_hash_db():
+    return _detector.load_hashes()
+
 # Function alias for simple import as requested
-def check_duplicate(image_path):
-    return _detector.check_duplicate(image_path)
+def check_duplicate(doc):
+    return _detector.check_duplicate(doc)
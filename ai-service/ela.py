@@ -0,0 +1,46 @@
+"""
+Error Level Analysis shared by VisualForensics and TamperDetector.
+The JPEG resave happens in memory (cv2.imencode/imdecode) and the diff is
+computed once per document and quality, then cached on the DocumentImage,
+so concurrent requests never touch the filesystem.
+"""
+import cv2
+import numpy as np
+from document_image import DocumentImage
+from metrics import timed
+
+
+class ELAResult:
+    """Absolute difference between an image and its JPEG resave, with summary stats."""
+
+    def __init__(self, diff):
+        self.diff = diff                                         # per-channel BGR diff, uint8
+        self.gray = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)       # luminance diff for region checks
+        self.mean = float(np.mean(diff))                         # mean over all channels
+        self.max_channel = int(diff.max()) if diff.size else 0
+        self.gray_mean = float(np.mean(self.gray))
+
+    def region_mean(self, y0: float, y1: float, x0: float, x1: float):
+        """Mean luminance diff of a region given as fractions of height/width, or None if empty."""
+        h, w = self.gray.shape
+        roi = self.gray[int(h * y0):int(h * y1), int(w * x0):int(w * x1)]
+        return float(np.mean(roi)) if roi.size > 0 else None
+
+
+@timed("ela_compute")
+def _compute(img, quality: int) -> ELAResult:
+    ok, encoded = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("JPEG encode failed")
+    resaved = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+    return ELAResult(cv2.absdiff(img, resaved))
+
+
+def error_levels(doc: DocumentImage, quality: int = 90) -> ELAResult:
+    """ELA of the document at the given JPEG quality, computed once per document."""
+    def compute():
+        img = doc.bgr
+        if img is None:
+            raise ValueError("Failed to load image")
+        return _compute(img, quality)
+    return doc.cached(("ela", quality), compute)
@@ -0,0 +1,180 @@
+"""
+Bounded execution layer for the CPU-heavy analysis stages.
+OCR, OpenCV and sklearn calls are submitted to worker pools instead of
+running on the asyncio event loop, so one slow request cannot stall the
+health check or other requests on the same uvicorn worker.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+THREAD_WORKERS = int(os.getenv("ANALYSIS_THREAD_WORKERS", min(8, os.cpu_count() or 4)))
+PROCESS_WORKERS = int(os.getenv("ANALYSIS_PROCESS_WORKERS", 0))  # 0 disables the process pool
+MAX_QUEUE = int(os.getenv("ANALYSIS_MAX_QUEUE", 32))
+QUEUE_TIMEOUT = float(os.getenv("ANALYSIS_QUEUE_TIMEOUT", 30))
+# Pool that runs /analyze-image: "thread" (default) or "process"
+IMAGE_ANALYSIS_POOL = os.getenv("IMAGE_ANALYSIS_POOL", "thread")
+
+
+class PoolOverloadedError(Exception):
+    """Raised when a pool cannot accept or start work in time."""
+    status_code = 503
+
+
+class QueueFullError(PoolOverloadedError):
+    status_code = 429
+
+
+class QueueTimeoutError(PoolOverloadedError):
+    status_code = 503
+
+
+def _timed_call(fn, args, kwargs, submitted_at, queue_timeout):
+    """Runs inside the worker; reports when it started so the caller can measure queue wait."""
+    started_at = time.time()
+    if queue_timeout and started_at - submitted_at > queue_timeout:
+        raise QueueTimeoutError(f"Request waited {started_at - submitted_at:.1f}s in queue")
+    return started_at, fn(*args, **kwargs)
+
+
+class WorkerPool:
+    """A thread or process pool with a bounded queue and wait-time stats."""
+
+    def __init__(self, name: str, kind: str, workers: int, max_queue: int = MAX_QUEUE,
+                 queue_timeout: float = QUEUE_TIMEOUT):
+        self.name = name
+        self.kind = kind
+        self.workers = workers
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=1000)
+        self.stats = {
+            "inFlight": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "timedOut": 0,
+            "cancelled": 0,
+            "waitSecondsTotal": 0.0,
+            "waitSecondsMax": 0.0,
+        }
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.kind == "process":
+                        ctx = multiprocessing.get_context("spawn")
+                        self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+                    else:
+                        self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                            thread_name_prefix=f"pool-{self.name}")
+        return self._executor
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn in the pool and await its result, rejecting when the queue is full."""
+        with self._lock:
+            if self.stats["inFlight"] >= self.workers + self.max_queue:
+                self.stats["rejected"] += 1
+                raise QueueFullError(f"Pool '{self.name}' queue is full")
+            self.stats["inFlight"] += 1
+
+        submitted_at = time.time()
+        try:
+            future = self._get_executor().submit(
+                _timed_call, fn, args, kwargs, submitted_at, self.queue_timeout
+            )
+        except BaseException:
+            self._finish("failed")
+            raise
+        # Counted out when the work itself ends, not when the caller stops waiting: a client
+        # disconnect cancels the await, but a task already running keeps its worker until it returns
+        future.add_done_callback(lambda f: self._on_done(f, submitted_at))
+        _, result = await asyncio.wrap_future(future)
+        return result
+
+    def _on_done(self, future, submitted_at: float):
+        if future.cancelled():
+            # Cancelled before it started (the caller went away while it was queued)
+            self._finish("cancelled")
+            return
+        error = future.exception()
+        if error is None:
+            started_at, _ = future.result()
+            self._finish("completed", max(0.0, started_at - submitted_at))
+        else:
+            self._finish("timedOut" if isinstance(error, QueueTimeoutError) else "failed")
+
+    def _finish(self, outcome: str, wait: float = None):
+        with self._lock:
+            self.stats["inFlight"] -= 1
+            self.stats[outcome] += 1
+            if wait is not None:
+                self._waits.append(wait)
+                self.stats["waitSecondsTotal"] += wait
+                self.stats["waitSecondsMax"] = max(self.stats["waitSecondsMax"], wait)
+
+    def backlogged(self) -> bool:
+        """True when tasks are queued behind busy workers (read without the lock; a hint)."""
+        return self.stats["inFlight"] > self.workers
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            stats = dict(self.stats)
+        done = stats["completed"]
+        # FIFO pool: the first `workers` in-flight tasks are running, the rest wait
+        running = min(stats["inFlight"], self.workers)
+        stats.update({
+            "kind": self.kind,
+            "workers": self.workers,
+            "maxQueue": self.max_queue,
+            "running": running,
+            "queueDepth": stats["inFlight"] - running,
+            "waitSecondsAvg": round(stats["waitSecondsTotal"] / done, 4) if done else 0.0,
+            "waitSecondsP50": round(waits[len(waits) // 2], 4) if waits else 0.0,
+            "waitSecondsP95": round(waits[int(len(waits) * 0.95) - 1], 4) if waits else 0.0,
+        })
+        return stats
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class AnalysisExecutor:
+    """Registry of named worker pools used by the API endpoints."""
+
+    def __init__(self):
+        self.pools = {
+            "thread": WorkerPool("thread", "thread", THREAD_WORKERS),
+        }
+        if PROCESS_WORKERS > 0:
+            self.pools["process"] = WorkerPool("process", "process", PROCESS_WORKERS)
+
+    def pool(self, name: str) -> WorkerPool:
+        # Fall back to the thread pool when the process pool is not configured
+        return self.pools.get(name) or self.pools["thread"]
+
+    async def run(self, pool_name: str, fn, *args, **kwargs):
+        return await self.pool(pool_name).run(fn, *args, **kwargs)
+
+    def stats(self) -> dict:
+        return {name: pool.snapshot() for name, pool in self.pools.items()}
+
+    def backlogged(self) -> bool:
+        return any(pool.backlogged() for pool in self.pools.values())
+
+    def shutdown(self):
+        for pool in self.pools.values():
+            pool.shutdown()
+
+# Singleton
+analysis_executor = AnalysisExecutor()
@@ -0,0 +1,171 @@
+"""
+Persistent cache of the expensive per-image analysis outputs: OCR text,
+extracted fields, visual forensics and the FeatureExtractor vector.
+Keyed by image content hash and a version string covering the feature
+extractor, OCR mode and OCR backend, so bumping any of them simply misses.
+Shared by the live pipeline and training/train_models.py: an image OCR'd
+once, in either place, is never OCR'd again while its entry is kept.
+Entries hold invoice contents, so they expire after FEATURE_CACHE_MAX_AGE_DAYS
+and the table is capped at FEATURE_CACHE_MAX_ROWS (newest kept); writes prune
+at most once per FEATURE_CACHE_PRUNE_SECONDS.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+import numpy as np
+
+FEATURE_CACHE_PATH = os.getenv("FEATURE_CACHE_PATH", "feature_cache.db")  # empty disables the cache
+FEATURE_CACHE_MAX_AGE_DAYS = float(os.getenv("FEATURE_CACHE_MAX_AGE_DAYS", 30))  # 0 keeps entries forever
+FEATURE_CACHE_MAX_ROWS = int(os.getenv("FEATURE_CACHE_MAX_ROWS", 100000))  # 0 disables the cap
+FEATURE_CACHE_PRUNE_SECONDS = float(os.getenv("FEATURE_CACHE_PRUNE_SECONDS", 600))
+# Bump when OCR post-processing, field extraction or visual forensics change
+ANALYSIS_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS image_features (
+    content_hash TEXT NOT NULL,
+    version TEXT NOT NULL,
+    stored_at REAL NOT NULL,
+    text TEXT NOT NULL,
+    ocr_mode TEXT,
+    fields TEXT,
+    visual TEXT,
+    features BLOB,
+    PRIMARY KEY (content_hash, version)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS image_features_stored_at ON image_features (stored_at);
+"""
+
+
+def current_version() -> str:
+    from ocr_analyzer import OCR_MODE
+    from ocr_backends import OCR_BACKEND
+    from ml.feature_extractor import FeatureExtractor
+    return f"a{ANALYSIS_VERSION}.fx{FeatureExtractor.VERSION}|ocr:{OCR_MODE}:{OCR_BACKEND}"
+
+
+class FeatureCache:
+    def __init__(self, db_path: str = FEATURE_CACHE_PATH, max_age_days: float = FEATURE_CACHE_MAX_AGE_DAYS,
+                 max_rows: int = FEATURE_CACHE_MAX_ROWS, prune_seconds: float = FEATURE_CACHE_PRUNE_SECONDS):
+        self.db_path = db_path
+        self.max_age = max_age_days * 86400
+        self.max_rows = max_rows
+        self.prune_seconds = prune_seconds
+        self._version = None
+        self._init_lock = threading.Lock()
+        self._ready = False
+        self._next_prune = 0.0
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "pruned": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.db_path)
+
+    @property
+    def version(self) -> str:
+        if self._version is None:
+            self._version = current_version()
+        return self._version
+
+    def _db(self):
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    directory = os.path.dirname(self.db_path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    with closing(sqlite3.connect(self.db_path, timeout=30, isolation_level=None)) as conn:
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.executescript(SCHEMA)
+                    self._ready = True
+        return closing(sqlite3.connect(self.db_path, timeout=30, isolation_level=None))
+
+    def get(self, content_hash: str):
+        """{"text", "ocrMode", "fields", "visual", "features"} or None; features may be None."""
+        if not self.enabled:
+            return None
+        try:
+            with self._db() as conn:
+                row = conn.execute(
+                    "SELECT text, ocr_mode, fields, visual, features FROM image_features "
+                    "WHERE content_hash = ? AND version = ? AND stored_at >= ?",
+                    (content_hash, self.version, self._cutoff()),
+                ).fetchone()
+        except Exception as e:
+            print(f"[FEATURES] Cache read failed: {e}")
+            return None
+        if row is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return {
+            "text": row[0],
+            "ocrMode": row[1],
+            "fields": json.loads(row[2]) if row[2] else {},
+            "visual": json.loads(row[3]) if row[3] else {},
+            "features": np.frombuffer(row[4], dtype=np.float32).copy() if row[4] is not None else None,
+        }
+
+    def put(self, content_hash: str, text: str, ocr_mode: str, fields: dict, visual: dict, features=None):
+        """Store an analysis; empty OCR text is not cached (the reader may just be unavailable)."""
+        if not self.enabled or not text:
+            return
+        blob = np.asarray(features, dtype=np.float32).tobytes() if features is not None else None
+        try:
+            with self._db() as conn:
+                # An entry written without features never erases a vector stored earlier
+                conn.execute(
+                    "INSERT INTO image_features "
+                    "(content_hash, version, stored_at, text, ocr_mode, fields, visual, features) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (content_hash, version) DO UPDATE SET stored_at = excluded.stored_at, "
+                    "text = excluded.text, ocr_mode = excluded.ocr_mode, fields = excluded.fields, "
+                    "visual = excluded.visual, features = COALESCE(excluded.features, image_features.features)",
+                    (content_hash, self.version, time.time(), text, ocr_mode,
+                     json.dumps(fields, default=str), json.dumps(visual, default=str), blob),
+                )
+            self.stats["writes"] += 1
+        except Exception as e:
+            print(f"[FEATURES] Cache write failed: {e}")
+            return
+        if time.time() >= self._next_prune:
+            self.prune()
+
+    def _cutoff(self) -> float:
+        return time.time() - self.max_age if self.max_age > 0 else 0.0
+
+    def prune(self) -> int:
+        """Delete expired entries, then the oldest beyond max_rows; returns the rows removed."""
+        if not self.enabled:
+            return 0
+        self._next_prune = time.time() + self.prune_seconds
+        removed = 0
+        try:
+            with self._db() as conn:
+                if self.max_age > 0:
+                    removed += conn.execute(
+                        "DELETE FROM image_features WHERE stored_at < ?", (self._cutoff(),)
+                    ).rowcount
+                if self.max_rows > 0:
+                    removed += conn.execute(
+                        "DELETE FROM image_features WHERE (content_hash, version) IN ("
+                        "SELECT content_hash, version FROM image_features "
+                        "ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                        (self.max_rows,),
+                    ).rowcount
+        except Exception as e:
+            print(f"[FEATURES] Cache prune failed: {e}")
+            return 0
+        self.stats["pruned"] += removed
+        return removed
+
+    def snapshot(self) -> dict:
+        return dict(self.stats, enabled=self.enabled)
+
+
+# Singleton
+feature_cache = FeatureCache()
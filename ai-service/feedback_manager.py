@@ -29,6 +29,9 @@ class FeedbackManager:
         except:
              return {"status": "ERROR", "message": "Invalid Base64"}
              
+        return self.save_feedback_bytes(img_bytes, original_status, correct_status, notes)
+
+    def save_feedback_bytes(self, img_bytes, original_status, correct_status, notes=""):
         # Generate ID
         fid = str(uuid.uuid4())
         timestamp = datetime.now().isoformat()
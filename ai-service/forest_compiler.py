@@ -0,0 +1,199 @@
+"""
+Compiles a fitted sklearn RandomForestClassifier into flat NumPy node arrays
+and evaluates it with a vectorized traversal: all (row, tree) pairs still on
+an internal node step one level per iteration, so a single row costs a few
+dozen small array ops instead of sklearn's input validation, pandas frame
+and 100 per-estimator calls. Past FOREST_CROSSOVER_ROWS rows the per-element
+NumPy cost overtakes that fixed overhead and the batch goes to sklearn.
+
+Probabilities are bit-identical to RandomForestClassifier.predict_proba:
+inputs are cast to float32 and compared `<=` against the float64 thresholds
+as sklearn's Cython traversal does, leaf values are normalized the same
+way, and per-tree probabilities are summed in estimator order (cumsum is
+strictly sequential) before dividing by the number of trees.
+
+The arrays can be saved as .npy files and memory-mapped back, so every
+worker process serving the same model version shares one copy through the
+page cache instead of holding its own.
+"""
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+_TREE_LEAF = -1
+# Rows traversed together; larger chunks stop fitting in cache
+CHUNK_ROWS = 1024
+# Above this many rows sklearn's Cython traversal wins over the NumPy one (benchmarks/bench_forest.py)
+FOREST_CROSSOVER_ROWS = int(os.getenv("FOREST_CROSSOVER_ROWS", 512))
+# Bump when the saved array layout changes; older saved copies are recompiled
+FORMAT_VERSION = 1
+ARRAYS = ("feature", "threshold", "left", "right", "leaf_proba", "roots", "classes_", "is_internal")
+
+
+class CompiledForest:
+    def __init__(self, feature, threshold, left, right, leaf_proba, roots, max_depth, classes,
+                 feature_names=None, estimator=None, is_internal=None):
+        self.feature = feature          # int64 [n_nodes]; 0 for leaves
+        self.threshold = threshold      # float64 [n_nodes]
+        self.left = left                # int64 [n_nodes]; global node ids, leaves point to themselves
+        self.right = right              # int64 [n_nodes]
+        self.leaf_proba = leaf_proba    # float64 [n_nodes, n_classes], normalized like DecisionTreeClassifier
+        self.roots = roots              # int64 [n_trees]
+        self.max_depth = int(max_depth)
+        self.classes_ = classes
+        self.feature_names = feature_names
+        self.estimator = estimator  # the sklearn forest, used for large batches
+        self.n_trees = len(roots)
+        self.is_internal = left != np.arange(len(left)) if is_internal is None else is_internal
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """Flatten every estimator of a fitted RandomForestClassifier."""
+        if getattr(model, "n_outputs_", 1) != 1:
+            raise ValueError("Only single-output forests can be compiled")
+        n_classes = int(model.n_classes_)
+
+        features, thresholds, lefts, rights, probas, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            n = tree.node_count
+            is_leaf = tree.children_left == _TREE_LEAF
+            own = np.arange(offset, offset + n, dtype=np.int64)
+
+            features.append(np.where(is_leaf, 0, tree.feature).astype(np.int64))
+            thresholds.append(tree.threshold.astype(np.float64))
+            # Leaves point at themselves, which is how is_internal recognizes them
+            lefts.append(np.where(is_leaf, own, tree.children_left + offset).astype(np.int64))
+            rights.append(np.where(is_leaf, own, tree.children_right + offset).astype(np.int64))
+
+            # Same steps as DecisionTreeClassifier.predict_proba
+            proba = tree.value[:, 0, :n_classes].astype(np.float64)
+            normalizer = proba.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+            probas.append(proba / normalizer)
+
+            roots.append(offset)
+            max_depth = max(max_depth, tree.max_depth)
+            offset += n
+
+        return cls(
+            feature=np.concatenate(features),
+            threshold=np.concatenate(thresholds),
+            left=np.concatenate(lefts),
+            right=np.concatenate(rights),
+            leaf_proba=np.concatenate(probas),
+            roots=np.asarray(roots, dtype=np.int64),
+            max_depth=max_depth,
+            classes=np.asarray(model.classes_),
+            feature_names=list(getattr(model, "feature_names_in_", [])) or None,
+            estimator=model,
+        )
+
+    def save(self, directory: str):
+        """Write the node arrays as .npy files; the directory appears complete or not at all."""
+        parent = os.path.dirname(os.path.abspath(directory))
+        staging = tempfile.mkdtemp(dir=parent, prefix=".compiling-")
+        try:
+            for name in ARRAYS:
+                np.save(os.path.join(staging, f"{name}.npy"), np.asarray(getattr(self, name)), allow_pickle=False)
+            meta = {"format": FORMAT_VERSION, "maxDepth": self.max_depth, "featureNames": self.feature_names}
+            with open(os.path.join(staging, "forest.json"), "w") as f:
+                json.dump(meta, f)
+            os.chmod(staging, 0o755)
+            os.rename(staging, directory)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory: str, estimator=None, mmap_mode: str = "r"):
+        """Arrays written by save(), memory-mapped read-only by default."""
+        with open(os.path.join(directory, "forest.json")) as f:
+            meta = json.load(f)
+        if meta.get("format") != FORMAT_VERSION:
+            raise ValueError(f"compiled forest format {meta.get('format')} != {FORMAT_VERSION}")
+        # Plain ndarray views of the maps: np.memmap's subclass hooks cost more than the traversal
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode).view(np.ndarray)
+            for name in ARRAYS
+        }
+        return cls(
+            feature=arrays["feature"], threshold=arrays["threshold"], left=arrays["left"],
+            right=arrays["right"], leaf_proba=arrays["leaf_proba"], roots=arrays["roots"],
+            max_depth=meta["maxDepth"], classes=arrays["classes_"], feature_names=meta["featureNames"],
+            estimator=estimator, is_internal=arrays["is_internal"],
+        )
+
+    def apply(self, X: np.ndarray) -> np.ndarray:
+        """Global leaf id reached by each row in each tree: int64 [n_rows, n_trees]."""
+        n_rows, n_features = X.shape
+        leaves = np.empty((n_rows, self.n_trees), dtype=np.int64)
+        for start in range(0, n_rows, CHUNK_ROWS):
+            chunk = X[start:start + CHUNK_ROWS]
+            leaves[start:start + len(chunk)] = self._apply_chunk(chunk, n_features)
+        return leaves
+
+    def _apply_chunk(self, X: np.ndarray, n_features: int) -> np.ndarray:
+        # (row, tree) pairs flattened row-major; only pairs still on an internal node are stepped
+        idx = np.tile(self.roots, len(X))
+        row_offset = np.repeat(np.arange(len(X), dtype=np.int64) * n_features, self.n_trees)
+        X_flat = X.reshape(-1)
+        active = np.flatnonzero(self.is_internal[idx])
+        while active.size:
+            nodes = idx[active]
+            # float32 feature vs float64 threshold, as in sklearn's tree traversal
+            go_left = X_flat[row_offset[active] + self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+            idx[active] = nodes
+            active = active[self.is_internal[nodes]]
+        return idx.reshape(len(X), self.n_trees)
+
+    def predict_proba(self, X) -> np.ndarray:
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if self.estimator is not None and len(X) > FOREST_CROSSOVER_ROWS:
+            # Plain ndarray: no pandas, and identical to the compiled result
+            return self.estimator.predict_proba(X)
+        return self.predict_proba_compiled(X)
+
+    def predict_proba_compiled(self, X: np.ndarray) -> np.ndarray:
+        """predict_proba through the node arrays only, whatever the batch size."""
+        leaves = self.apply(X)
+        per_tree = self.leaf_proba[leaves]  # [n_rows, n_trees, n_classes]
+        total = np.cumsum(per_tree, axis=1)[:, -1, :]
+        total /= self.n_trees
+        return total
+
+
+def compile_forest(model, cache_dir: str = None):
+    """
+    CompiledForest for a fitted RandomForestClassifier, or None if it cannot be compiled.
+    With cache_dir, the arrays are memory-mapped from there, compiled and saved on first use.
+    """
+    if cache_dir:
+        try:
+            return CompiledForest.load(cache_dir, estimator=model)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[FOREST] Recompiling {cache_dir}: {e}")
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    try:
+        forest = CompiledForest.from_sklearn(model)
+    except Exception as e:
+        print(f"[FOREST] Could not compile {type(model).__name__}: {e}")
+        return None
+    if cache_dir:
+        try:
+            if not os.path.exists(cache_dir):
+                forest.save(cache_dir)
+            return CompiledForest.load(cache_dir, estimator=model)
+        except Exception as e:
+            # Another worker may be saving the same version; the in-memory copy is just as correct
+            print(f"[FOREST] Serving {cache_dir} from memory: {e}")
+    return forest
@@ -1,154 +1,303 @@
+"""
+Rule-based fraud scoring for /analyze submissions.
+
+Every check is a Rule declaring its cost class and the most it can add to
+the risk score. Rules run cheapest class first; the score is capped at 100,
+so once it reaches the cap the remaining rules cannot change the outcome and
+are skipped, except stateful ones (invoice and image-hash registration),
+which still run so later submissions are checked against this one. Expensive
+stateful rules are deferred to a background thread instead of delaying the
+response. full_evaluation (or FRAUD_FULL_EVALUATION) runs every rule, for
+audits. Reasons are reported in rule declaration order whatever order the
+rules ran in, and "rules" lists each rule's status, score and time.
+The model and image rules are independent of each other and run
+concurrently as a stage graph, each with its own timeout; the graph stops
+waiting on them once the finished ones settle the outcome, except on the
+stateful duplicate_image rule.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
 from ml_model import detect_anomaly
 from tamper_detector import tamper_detector
 from duplicate_detector import check_duplicate
+from document_image import DocumentImage
+from image_validator import image_validator
+from invoice_registry import get_registry
+from stage_graph import Stage, StageGraph
+
+FRAUD_FULL_EVALUATION = os.getenv("FRAUD_FULL_EVALUATION", "false").lower() == "true"
+
+MAX_RISK_SCORE = 100
+RED_THRESHOLD = 50
+
+# Run order; "lookup" is a SQLite round trip, "image" decodes or hashes the upload
+COST_CLASSES = ("cheap", "lookup", "model", "image")
+# Deferred once the outcome is settled, otherwise run concurrently
+EXPENSIVE_COSTS = ("model", "image")
+
+
+class Rule:
+    """
+    One fraud check. check(ctx) returns [(reason, points), ...]; points are
+    capped at max_score. requires_image: True runs only with an uploaded
+    image, False only without one, None either way.
+    """
+
+    def __init__(self, name: str, cost: str, max_score: int, check, requires_image: bool = None,
+                 stateful: bool = False):
+        if cost not in COST_CLASSES:
+            raise ValueError(f"Unknown cost class {cost!r}")
+        self.name = name
+        self.cost = cost
+        self.max_score = max_score
+        self.check = check
+        self.requires_image = requires_image
+        self.stateful = stateful
+
+    def applies(self, ctx: dict) -> bool:
+        return self.requires_image is None or self.requires_image == (ctx["doc"] is not None)
+
+    def points(self, hits: list) -> int:
+        return min(self.max_score, sum(p for _, p in hits))
+
+
 
 class FraudEngine:
     def __init__(self):
         # --- 1. Redlists & Config ---
         self.supplier_redlist = ["Suspicious Supplies Ltd", "Blacklisted Corp"]
         self.registered_suppliers = ["Good Supplies Inc", "Trusted Vendors LLC", "Alpha Construction"] # Mock DB
-        self.seen_invoices = set() # Mock duplicate check DB
 
-    def _check_image_metadata(self, image_path):
+        # --- 2. Rules, in the order their reasons are reported ---
+        self.rules = [
+            Rule("invoice_amount", "cheap", 50, self._rule_invoice_amount),
+            Rule("supplier_redlist", "cheap", 100, self._rule_supplier_redlist),
+            Rule("supplier_registration", "cheap", 40, self._rule_supplier_registration),
+            Rule("duplicate_invoice", "lookup", 100, self._rule_duplicate_invoice, stateful=True),
+            Rule("image_metadata", "image", 40, self._rule_image_metadata, requires_image=True),
+            Rule("image_flags", "cheap", 40, self._rule_image_flags, requires_image=False),
+            Rule("amount_anomaly", "model", 30, self._rule_amount_anomaly),
+            Rule("gps_location", "image", 40, self._rule_gps_location),
+            Rule("tamper_detection", "image", 35, self._rule_tamper_detection, requires_image=True),
+            Rule("duplicate_image", "image", 30, self._rule_duplicate_image, requires_image=True, stateful=True),
+        ]
+        # Stable sort: declaration order within a cost class
+        self._run_order = sorted(self.rules, key=lambda rule: COST_CLASSES.index(rule.cost))
+        self._deferred_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fraud-deferred")
+
+    def _check_image_metadata(self, doc: DocumentImage):
         """Checks for GPS data and date in image metadata"""
-        if not image_path or not os.path.exists(image_path):
+        if doc is None:
             return ["Image file missing or not found"]
 
         reasons = []
         try:
-            with open(image_path, 'rb') as f:
-                tags = exifread.process_file(f)
-                
-                # Check GPS
-                if 'GPS GPSLatitude' not in tags or 'GPS GPSLongitude' not in tags:
-                    reasons.append("Image metadata missing GPS coordinates")
-                
-                # Check Date
-                date_taken = tags.get('Image DateTime')
-                if date_taken:
-                    # Parse EXIF date format: 'YYYY:MM:DD HH:MM:SS'
-                    try:
-                        dt_obj = datetime.strptime(str(date_taken), '%Y:%m:%d %H:%M:%S')
-                        # Simple check: if older than 365 days (mock rule)
-                        if (datetime.now() - dt_obj).days > 365:
-                            reasons.append("Image is older than 1 year")
-                    except ValueError:
-                        pass # Date format error, skip
-                else:
-                    reasons.append("Image metadata missing capture date")
+            tags = doc.exif_tags
+            
+            # Check GPS
+            if 'GPS GPSLatitude' not in tags or 'GPS GPSLongitude' not in tags:
+                reasons.append("Image metadata missing GPS coordinates")
+            
+            # Check Date
+            date_taken = tags.get('Image DateTime')
+            if date_taken:
+                # Parse EXIF date format: 'YYYY:MM:DD HH:MM:SS'
+                try:
+                    dt_obj = datetime.strptime(str(date_taken), '%Y:%m:%d %H:%M:%S')
+                    # Simple check: if older than 365 days (mock rule)
+                    if (datetime.now() - dt_obj).days > 365:
+                        reasons.append("Image is older than 1 year")
+                except ValueError:
+                    pass # Date format error, skip
+            else:
+                reasons.append("Image metadata missing capture date")
 
         except Exception as e:
             reasons.append(f"Failed to read image metadata: {str(e)}")
         
         return reasons
 
-    def analyze_submission(self, data: dict, image_path: str = None):
+    # -- rules --------------------------------------------------------------
+
+    def _rule_invoice_amount(self, ctx: dict):
+        amount, project_budget = ctx["amount"], ctx["projectBudget"]
+        if amount > project_budget:
+            return [(f"Invoice amount ({amount}) exceeds project budget ({project_budget})", 50)]
+        if amount > (project_budget * 0.8):
+            return [(f"Invoice amount ({amount}) is >80% of project budget", 30)]
+        return []
+
+    def _rule_supplier_redlist(self, ctx: dict):
+        # Internal Check OR External Flag
+        supplier = ctx["supplier"]
+        if ctx["data"].get('supplierRedlisted', False) or supplier in self.supplier_redlist:
+            return [(f"Supplier '{supplier}' is REDLISTED", 100)]
+        return []
+
+    def _rule_supplier_registration(self, ctx: dict):
+        # If explicitly redlisted, the redlist rule already caught it
+        supplier = ctx["supplier"]
+        if supplier not in self.registered_suppliers and not ctx["data"].get('supplierRedlisted'):
+            return [(f"Supplier '{supplier}' is not a registered vendor", 40)]
+        return []
+
+    def _rule_duplicate_invoice(self, ctx: dict):
+        # Registers the invoice number, so it runs even when the outcome is settled
+        invoice_number = ctx["invoiceNumber"]
+        if ctx["data"].get('duplicateInvoice', False) or \
+                get_registry().check_and_register(invoice_number, ctx["supplier"], source="submission"):
+            return [(f"Duplicate Invoice Number: {invoice_number}", 100)]
+        return []
+
+    def _rule_image_metadata(self, ctx: dict):
+        return [(issue, 20) for issue in self._check_image_metadata(ctx["doc"])]
+
+    def _rule_image_flags(self, ctx: dict):
+        # Flags checked by the caller when no image was uploaded
+        data, reasons = ctx["data"], []
+        if not data.get('imageHasGPS', True):
+            reasons.append(("Image metadata missing GPS coordinates", 20))
+        if not data.get('imageDateValid', True):
+            reasons.append(("Image date is invalid or too old", 20))
+        return reasons
+
+    def _rule_amount_anomaly(self, ctx: dict):
+        ctx["mlResult"] = detect_anomaly(ctx["amount"])
+        if ctx["mlResult"]['is_anomaly']:
+            return [("Invoice amount anomaly detected", 30)]
+        return []
+
+    def _rule_gps_location(self, ctx: dict):
+        data, doc = ctx["data"], ctx["doc"]
+        project_lat, project_lon = data.get("projectLat"), data.get("projectLon")
+        gps_valid, reason = data.get("gps_valid"), data.get("gps_mismatch_reason")
+        # Validate against the project location when the image and coordinates are both present
+        if doc is not None and project_lat is not None and project_lon is not None:
+            gps_result = image_validator.validate_image_location(doc, float(project_lat), float(project_lon))
+            ctx["gpsResult"] = gps_result
+            gps_valid = gps_result["gps_valid"]
+            if not gps_valid and gps_result["distance_meters"] != -1:
+                reason = gps_result.get("reason", "Location mismatch")
+        # gps_valid False means it was checked and failed
+        if gps_valid is False:
+            return [(reason or "Image location mismatch", 40)]
+        return []
+
+    def _rule_tamper_detection(self, ctx: dict):
+        ctx["tamperResult"] = tamper_detector.detect_tampering(ctx["doc"])
+        if ctx["tamperResult"]["tampered"]:
+            return [("Image manipulation suspected", 35)]
+        return []
+
+    def _rule_duplicate_image(self, ctx: dict):
+        # Stores the image hash; deferred rather than skipped once the outcome is settled
+        ctx["dupResult"] = check_duplicate(ctx["doc"])
+        if ctx["dupResult"]["is_duplicate"]:
+            return [("Duplicate or reused image detected", 30)]
+        return []
+
+    # -- evaluation ---------------------------------------------------------
+
+    def _run_deferred(self, rule: Rule, ctx: dict):
+        try:
+            rule.check(ctx)
+        except Exception as e:
+            print(f"[FRAUD] Deferred rule {rule.name} failed: {e}")
+
+    def analyze_submission(self, data: dict, doc: DocumentImage = None, full_evaluation: bool = None):
         """
         Comprehensive fraud analysis
         """
-        reasons = []
-        risk_score = 0
-        
+        if full_evaluation is None:
+            full_evaluation = FRAUD_FULL_EVALUATION
+
         # Extract fields matching the User's requested JSON structure
-        invoice_number = data.get('invoiceNumber') or data.get('invoice_id', 'Unknown')
-        amount = data.get('amount', 0)
-        project_budget = data.get('projectBudget') or data.get('project_budget', float('inf'))
-        supplier = data.get('supplier') or data.get('supplier_name', 'Unknown')
-        
-        # Explicit Flags (if provided in JSON)
-        supplier_redlisted = data.get('supplierRedlisted', False)
-        duplicate_invoice = data.get('duplicateInvoice', False)
-        image_has_gps = data.get('imageHasGPS', True) # Default to True if not provided/checked externally
-        image_date_valid = data.get('imageDateValid', True)
+        ctx = {
+            "data": data,
+            "doc": doc,
+            "invoiceNumber": data.get('invoiceNumber') or data.get('invoice_id', 'Unknown'),
+            "amount": data.get('amount', 0),
+            "projectBudget": data.get('projectBudget') or data.get('project_budget', float('inf')),
+            "supplier": data.get('supplier') or data.get('supplier_name', 'Unknown'),
+        }
 
-        # 1. Invoice amount checks
-        if amount > project_budget:
-            reasons.append(f"Invoice amount ({amount}) exceeds project budget ({project_budget})")
-            risk_score += 50
-        elif amount > (project_budget * 0.8):
-             reasons.append(f"Invoice amount ({amount}) is >80% of project budget")
-             risk_score += 30
-
-        # 2. Supplier Redlist (Internal Check OR External Flag)
-        if supplier_redlisted or supplier in self.supplier_redlist:
-            reasons.append(f"Supplier '{supplier}' is REDLISTED")
-            risk_score += 100
-
-        # 3. Supplier Registration (Internal Check Only for now, unless flag added)
-        if supplier not in self.registered_suppliers and not data.get('supplierRedlisted'):
-             # If explicitly redlisted, we already caught it. If not, check registration.
-             reasons.append(f"Supplier '{supplier}' is not a registered vendor")
-             risk_score += 40
-
-        # 4. Duplicate Invoice (Internal Check OR External Flag)
-        if duplicate_invoice or invoice_number in self.seen_invoices:
-             reasons.append(f"Duplicate Invoice Number: {invoice_number}")
-             risk_score += 100
-        else:
-            self.seen_invoices.add(invoice_number)
-
-        # 5 & 6. Image Checks (External Flags OR Internal Path Check)
-        if image_path:
-            # Internal File Check
-            meta_issues = self._check_image_metadata(image_path)
-            if meta_issues:
-                reasons.extend(meta_issues)
-                risk_score += (20 * len(meta_issues))
-        else:
-            # External Flags Check
-            if not image_has_gps:
-                reasons.append("Image metadata missing GPS coordinates")
-                risk_score += 20
-            if not image_date_valid:
-                reasons.append("Image date is invalid or too old")
-                risk_score += 20
+        risk_score = 0
+        found = {}  # rule name -> [(reason, points)]
+        report = []
+        concurrent = []  # (rule, report entry) for the stage graph
+        for rule in self._run_order:
+            if not rule.applies(ctx):
+                continue
+            entry = {"name": rule.name, "cost": rule.cost, "maxScore": rule.max_score}
+            settled = risk_score >= MAX_RISK_SCORE and not full_evaluation
+            if settled and not rule.stateful:
+                entry.update(status="skipped", score=0, ms=0.0)
+            elif settled and rule.cost in EXPENSIVE_COSTS:
+                # The score cannot change, but the registration it does must still happen
+                self._deferred_pool.submit(self._run_deferred, rule, dict(ctx))
+                entry.update(status="deferred", score=0, ms=0.0)
+            elif rule.cost in EXPENSIVE_COSTS:
+                concurrent.append((rule, entry))
+            else:
+                start = time.perf_counter()
+                hits = rule.check(ctx)
+                elapsed = time.perf_counter() - start
+                points = rule.points(hits)
+                found[rule.name] = hits
+                risk_score += points
+                entry.update(status="ran", score=points, ms=round(elapsed * 1000, 3))
+            report.append(entry)
 
-        # 7. AI Analysis (using ml_model)
-        ml_result = detect_anomaly(amount)
-        
-        if ml_result['is_anomaly']:
-            reasons.append("Invoice amount anomaly detected")
-            risk_score += 30
-
-        # 8. GPS Mismatch (Passed from Main)
-        # If gps_valid is explicitly False, it means we checked and it failed.
-        if data.get("gps_valid") is False:
-             reason = data.get("gps_mismatch_reason", "Image location mismatch")
-             reasons.append(reason)
-             risk_score += 40
-
-        # 9. Tamper Detection (Internal Check)
-        tamper_result = {"tampered": False, "ela_score": 0.0}
-        if image_path:
-            tamper_result = tamper_detector.detect_tampering(image_path)
-            if tamper_result["tampered"]:
-                reasons.append("Image manipulation suspected")
-                risk_score += 35
-
-
-
-        # 10. Duplicate Detection (Internal Check)
-        dup_result = {"is_duplicate": False, "similarity_score": 0}
-        if image_path:
-            dup_result = check_duplicate(image_path)
-            if dup_result["is_duplicate"]:
-                riskScore += 30
-                reasons.append("Duplicate or reused image detected")
+        if concurrent:
+            # Running concurrently loses run order's short-circuit between these rules, so the graph
+            # stops waiting on them once the finished ones reach the cap; stateful ones always run
+            base_score = risk_score
+
+            def settled(outcomes: dict) -> bool:
+                finished = sum(rule.points(outcomes[rule.name]) for rule, _ in concurrent if rule.name in outcomes)
+                return base_score + finished >= MAX_RISK_SCORE
+
+            graph = StageGraph([Stage(rule.name, partial(rule.check, ctx), default=[], stoppable=not rule.stateful)
+                                for rule, _ in concurrent])
+            outcomes = graph.run(stop_when=None if full_evaluation else settled)
+            for rule, entry in concurrent:
+                hits = outcomes.get(rule.name, [])
+                points = rule.points(hits)
+                found[rule.name] = hits
+                risk_score += points
+                elapsed = graph.timings.get(rule.name)
+                entry.update(status="ran" if graph.status[rule.name] == "ok" else graph.status[rule.name],
+                             score=points, ms=round(elapsed * 1000, 3) if elapsed is not None else None)
+
+        reasons = [reason for rule in self.rules for reason, _ in found.get(rule.name, [])]
 
         # Clamp Status
-        total_risk = min(100, risk_score)
-        status = "RED" if total_risk >= 50 else "GREEN"
+        total_risk = min(MAX_RISK_SCORE, risk_score)
+        status = "RED" if total_risk >= RED_THRESHOLD else "GREEN"
+
+        ml_result = ctx.get("mlResult", {"is_anomaly": False})
+        tamper_result = ctx.get("tamperResult", {"tampered": False, "ela_score": 0.0})
+        dup_result = ctx.get("dupResult", {"is_duplicate": False, "similarity_score": 0})
+        gps_result = ctx.get("gpsResult")
 
-        return {
+        result = {
             "status": status,
             "riskScore": total_risk,
             "mlAnomaly": ml_result['is_anomaly'],
-            "gpsValid": data.get("gps_valid", True),
+            "gpsValid": gps_result["gps_valid"] if gps_result else data.get("gps_valid", True),
             "tampered": tamper_result["tampered"],
             "elaScore": tamper_result["ela_score"],
             "duplicateImage": dup_result["is_duplicate"],
-            "reasons": reasons
+            "reasons": reasons,
+            "fullEvaluation": full_evaluation,
+            "rules": report,
         }
+        if gps_result:
+            result["distanceMeters"] = gps_result["distance_meters"]
+        return result
 
 # Singleton instance
 fraud_engine = FraudEngine()
@@ -0,0 +1,42 @@
+"""
+Gunicorn deployment with models shared between workers.
+
+    gunicorn -c gunicorn.conf.py main:app
+
+The master imports the app and loads the read-only models (PRELOAD_COMPONENTS)
+before forking, so workers share those pages copy-on-write instead of each
+loading its own copy. gc.freeze() then moves everything allocated so far out
+of the collector's reach, so a collection in a worker does not write to (and
+un-share) the preloaded objects. Mutable state (the image-hash index, job
+workers, the registry watcher) is still set up per worker at startup.
+"""
+import gc
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 8000)}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "uvicorn.workers.UvicornWorker")
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+preload_app = True
+
+# The hash index grows per worker, so it is not worth sharing and loads after fork
+PRELOAD_COMPONENTS = [
+    name.strip()
+    for name in os.getenv("PRELOAD_COMPONENTS", "amount_anomaly,behavior_risk,fraud_random_forest,easyocr").split(",")
+    if name.strip()
+]
+
+# Collections during preload would only churn objects that are about to be frozen
+gc.disable()
+
+
+def when_ready(server):
+    # Runs in the master after the app is imported and before the first worker is forked
+    from model_loader import model_loader
+    model_loader.load_all(PRELOAD_COMPONENTS)
+    gc.freeze()
+    server.log.info("Preloaded %s; %d objects frozen", ", ".join(PRELOAD_COMPONENTS), gc.get_freeze_count())
+
+
+def post_fork(server, worker):
+    gc.enable()
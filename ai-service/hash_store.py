@@ -0,0 +1,196 @@
+"""
+Persistent, append-only store for perceptual image hashes.
+SQLite in WAL mode: inserts append one row instead of rewriting a JSON file,
+several processes can write safely, and each process picks up rows added by
+the others with an incremental read keyed by row id. Replaces image_hashes.json,
+which is migrated on first start.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+HASH_DB_PATH = os.getenv("HASH_DB_PATH", "image_hashes.db")
+LEGACY_JSON_PATH = "image_hashes.json"
+COMPACT_INTERVAL = float(os.getenv("HASH_STORE_COMPACT_SECONDS", 3600))
+
+# AUTOINCREMENT: ids are never reused after a delete, so readers that have
+# seen up to id N (load_since) cannot miss a later row that got an old id
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS image_hashes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    phash INTEGER NOT NULL,
+    item_id TEXT,
+    created_at REAL NOT NULL
+);
+"""
+
+
+def _to_signed(code: int) -> int:
+    # SQLite integers are signed 64-bit; store the pHash bit pattern as such
+    return code - (1 << 64) if code >= (1 << 63) else code
+
+
+class HashStore:
+    def __init__(self, db_path: str = HASH_DB_PATH, legacy_json: str = LEGACY_JSON_PATH):
+        self.db_path = db_path
+        self._compactor = None
+        self._stop = threading.Event()
+        self._init_db()
+        if legacy_json:
+            self._migrate_json(legacy_json)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    @contextmanager
+    def _db(self):
+        conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._db() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+        self._migrate_autoincrement()
+
+    def _migrate_autoincrement(self):
+        """Rebuild a table created before ids were AUTOINCREMENT, keeping every id."""
+        def table_sql(conn):
+            row = conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'image_hashes'"
+            ).fetchone()
+            return row[0] if row else ""
+
+        with self._db() as conn:
+            if "AUTOINCREMENT" in table_sql(conn).upper():
+                return
+        with self.transaction() as conn:
+            # Another worker may have migrated first
+            if "AUTOINCREMENT" in table_sql(conn).upper():
+                return
+            conn.execute("ALTER TABLE image_hashes RENAME TO image_hashes_old")
+            conn.execute(SCHEMA.replace("IF NOT EXISTS ", ""))
+            # Explicit ids also seed sqlite_sequence with the current maximum
+            conn.execute(
+                "INSERT INTO image_hashes (id, phash, item_id, created_at) "
+                "SELECT id, phash, item_id, created_at FROM image_hashes_old"
+            )
+            conn.execute("DROP TABLE image_hashes_old")
+            print("[HASHES] Migrated image_hashes to AUTOINCREMENT ids")
+
+    def _migrate_json(self, json_path: str):
+        """One-time import of the old JSON list of [hash_hex, id] pairs."""
+        if not os.path.exists(json_path):
+            return
+        try:
+            with open(json_path, "r") as f:
+                entries = json.load(f)
+        except Exception as e:
+            print(f"[HASHES] Could not read {json_path} for migration: {e}")
+            return
+
+        # The JSON store could hold repeats; import each pair once, in first-seen order
+        pairs = list(dict.fromkeys((_to_signed(int(h, 16)), item_id) for h, item_id in entries))
+        with self.transaction() as conn:
+            # Another worker may have migrated while we were reading the file
+            if conn.execute("SELECT COUNT(*) FROM image_hashes").fetchone()[0] == 0:
+                now = time.time()
+                conn.executemany(
+                    "INSERT INTO image_hashes (phash, item_id, created_at) VALUES (?, ?, ?)",
+                    [(code, item_id, now) for code, item_id in pairs],
+                )
+                print(f"[HASHES] Migrated {len(pairs)} hashes from {json_path} "
+                      f"({len(entries) - len(pairs)} duplicates dropped)")
+        try:
+            os.replace(json_path, json_path + ".migrated")
+        except OSError:
+            pass
+
+    @contextmanager
+    def transaction(self):
+        """
+        Write transaction (BEGIN IMMEDIATE): serializes check-then-insert
+        across threads and processes. Commits on success, rolls back on error.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def load_since(self, after_id: int = 0, conn=None):
+        """Rows appended after after_id: (last_id, uint64 codes, ids)."""
+        def read(c):
+            return c.execute(
+                "SELECT id, phash, item_id FROM image_hashes WHERE id > ? ORDER BY id",
+                (after_id,),
+            ).fetchall()
+
+        if conn is not None:
+            rows = read(conn)
+        else:
+            with self._db() as c:
+                rows = read(c)
+        if not rows:
+            return after_id, np.zeros(0, dtype=np.uint64), []
+        codes = np.array([r[1] for r in rows], dtype=np.int64).view(np.uint64)
+        return rows[-1][0], codes, [r[2] for r in rows]
+
+    def append(self, conn, code: int, item_id: str) -> int:
+        """Append one hash inside a transaction(); returns its row id."""
+        cur = conn.execute(
+            "INSERT INTO image_hashes (phash, item_id, created_at) VALUES (?, ?, ?)",
+            (_to_signed(code), item_id, time.time()),
+        )
+        return cur.lastrowid
+
+    def count(self) -> int:
+        with self._db() as conn:
+            return conn.execute("SELECT COUNT(*) FROM image_hashes").fetchone()[0]
+
+    # --- Compaction ---
+
+    def compact(self):
+        """
+        Fold the WAL back into the main file. Rows are never deleted: check_duplicate
+        only appends a hash that matched nothing, inside the same BEGIN IMMEDIATE
+        transaction, so the table holds no duplicates to drop, and each worker's
+        HashIndex could not mirror a delete anyway.
+        """
+        with self._db() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def start_compaction(self, interval: float = COMPACT_INTERVAL):
+        if self._compactor is not None or interval <= 0:
+            return
+        self._compactor = threading.Thread(
+            target=self._compact_loop, args=(interval,), name="hash-store-compactor", daemon=True
+        )
+        self._compactor.start()
+
+    def _compact_loop(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"[HASHES] Compaction failed: {e}")
+
+    def stop(self):
+        self._stop.set()
@@ -1,7 +1,6 @@
-import exifread
 from datetime import datetime
 from geopy.distance import geodesic
-import os
+from document_image import DocumentImage
 
 class ImageValidator:
     def _get_start_decimal(self, dms, ref):
@@ -17,40 +16,31 @@ class ImageValidator:
 
         return degrees + minutes + seconds
 
-    def get_image_gps(self, image_path):
+    def get_image_gps(self, doc: DocumentImage):
         """Extracts text GPS data from image"""
         try:
-            with open(image_path, 'rb') as f:
-                tags = exifread.process_file(f)
+            tags = doc.exif_tags
+            
+            if 'GPS GPSLatitude' in tags and 'GPS GPSLongitude' in tags:
+                lat_dms = tags['GPS GPSLatitude'].values
+                lat_ref = tags['GPS GPSLatitudeRef'].values
+                lon_dms = tags['GPS GPSLongitude'].values
+                lon_ref = tags['GPS GPSLongitudeRef'].values
                 
-                if 'GPS GPSLatitude' in tags and 'GPS GPSLongitude' in tags:
-                    lat_dms = tags['GPS GPSLatitude'].values
-                    lat_ref = tags['GPS GPSLatitudeRef'].values
-                    lon_dms = tags['GPS GPSLongitude'].values
-                    lon_ref = tags['GPS GPSLongitudeRef'].values
-                    
-                    lat = self._get_start_decimal(lat_dms, lat_ref)
-                    lon = self._get_start_decimal(lon_dms, lon_ref)
-                    
-                    return lat, lon
+                lat = self._get_start_decimal(lat_dms, lat_ref)
+                lon = self._get_start_decimal(lon_dms, lon_ref)
+                
+                return lat, lon
         except Exception:
             pass
         return None, None
 
-    def validate_image_location(self, image_path: str, project_lat: float, project_lon: float):
+    def validate_image_location(self, doc: DocumentImage, project_lat: float, project_lon: float):
         """
         Validates if image was taken near the project location.
         Threshold: 200 meters.
         """
-        if not os.path.exists(image_path):
-             return {
-                "gps_valid": False,
-                "distance_meters": -1,
-                "timestamp_valid": False,
-                "error": "File not found"
-            }
-
-        image_lat, image_lon = self.get_image_gps(image_path)
+        image_lat, image_lon = self.get_image_gps(doc)
         
         if image_lat is None or image_lon is None:
              return {
@@ -76,10 +66,8 @@ class ImageValidator:
         # Validate Timestamp (Mock: check if present)
         timestamp_valid = False
         try:
-            with open(image_path, 'rb') as f:
-                tags = exifread.process_file(f, stop_tag='DateTimeOriginal')
-                if 'EXIF DateTimeOriginal' in tags:
-                    timestamp_valid = True # logic to check date range can be added here
+            if 'EXIF DateTimeOriginal' in doc.exif_tags:
+                timestamp_valid = True # logic to check date range can be added here
         except:
             pass
 
@@ -0,0 +1,135 @@
+"""
+Persistent registry of invoice numbers for duplicate detection.
+One SQLite (WAL) table shared by every worker process and by both the
+submission (FraudEngine) and document (OCRAnalyzer) paths. Numbers are
+normalized and scoped by supplier; a number counts as a duplicate when the
+same supplier used it within the time window. Registration is a single
+atomic upsert, and an in-process LRU of recently seen numbers answers
+repeat lookups without touching disk.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import closing
+
+INVOICE_DB_PATH = os.getenv("INVOICE_DB_PATH", "invoices.db")
+INVOICE_WINDOW_DAYS = float(os.getenv("INVOICE_WINDOW_DAYS", 365))  # 0 keeps numbers forever
+INVOICE_CACHE_SIZE = int(os.getenv("INVOICE_CACHE_SIZE", 100000))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoices (
+    supplier TEXT NOT NULL,
+    number TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    source TEXT,
+    PRIMARY KEY (supplier, number)
+) WITHOUT ROWID;
+"""
+
+_NON_ALNUM = re.compile(r"[^0-9A-Z]")
+
+
+def normalize_number(number) -> str:
+    """'inv - 001', 'INV–001' and 'Inv001' all map to 'INV001'."""
+    return _NON_ALNUM.sub("", unicodedata.normalize("NFKC", str(number)).upper())
+
+
+def normalize_supplier(supplier) -> str:
+    return " ".join(str(supplier or "").casefold().split())
+
+
+class InvoiceRegistry:
+    def __init__(self, db_path: str = INVOICE_DB_PATH, window_days: float = INVOICE_WINDOW_DAYS,
+                 cache_size: int = INVOICE_CACHE_SIZE):
+        self.db_path = db_path
+        self.window = window_days * 86400 if window_days > 0 else None
+        self.cache_size = cache_size
+        self._recent = OrderedDict()  # (supplier, number) -> first_seen
+        self._lock = threading.Lock()
+        self.stats = {"cacheHits": 0, "diskLookups": 0, "duplicates": 0}
+        self._init_db()
+
+    def _db(self):
+        return closing(sqlite3.connect(self.db_path, timeout=30, isolation_level=None))
+
+    def _init_db(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._db() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _within_window(self, first_seen: float, now: float) -> bool:
+        return self.window is None or now - first_seen <= self.window
+
+    def check_and_register(self, number, supplier=None, source: str = None) -> bool:
+        """
+        True when this supplier already used the (normalized) number within
+        the window; otherwise records it and returns False. Empty numbers
+        are never duplicates.
+        """
+        number = normalize_number(number) if number else ""
+        if not number:
+            return False
+        key = (normalize_supplier(supplier), number)
+        now = time.time()
+
+        # A cached first_seen only changes once it has expired, so a fresh one is authoritative
+        with self._lock:
+            first_seen = self._recent.get(key)
+            if first_seen is not None and self._within_window(first_seen, now):
+                self._recent.move_to_end(key)
+                self.stats["cacheHits"] += 1
+                self.stats["duplicates"] += 1
+                return True
+            self.stats["diskLookups"] += 1
+
+        cutoff = now - self.window if self.window is not None else 0.0
+        with self._db() as conn:
+            # Inserts a new number or re-registers an expired one; a live duplicate changes nothing
+            registered = conn.execute(
+                "INSERT INTO invoices (supplier, number, first_seen, source) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (supplier, number) DO UPDATE SET first_seen = excluded.first_seen, "
+                "source = excluded.source WHERE invoices.first_seen < ?",
+                (key[0], key[1], now, source, cutoff),
+            ).rowcount
+            if not registered:
+                first_seen = conn.execute(
+                    "SELECT first_seen FROM invoices WHERE supplier = ? AND number = ?", key
+                ).fetchone()[0]
+            else:
+                first_seen = now
+
+        with self._lock:
+            self._recent[key] = first_seen
+            self._recent.move_to_end(key)
+            while len(self._recent) > self.cache_size:
+                self._recent.popitem(last=False)
+            if not registered:
+                self.stats["duplicates"] += 1
+        return not registered
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["cachedNumbers"] = len(self._recent)
+        return stats
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> InvoiceRegistry:
+    """Process-wide registry, opened on first use."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = InvoiceRegistry()
+    return _registry
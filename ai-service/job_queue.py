@@ -0,0 +1,332 @@
+"""
+Durable, SQLite-backed job queue for long-running document analyses.
+Jobs are persisted before they are acknowledged, drained by a small pool
+of worker threads, and picked up again after a process restart.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+from executor import QueueFullError
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", 500))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", 72))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", 900))
+CALLBACK_TIMEOUT = float(os.getenv("JOB_CALLBACK_TIMEOUT", 10))
+# Hosts callbacks may be POSTed to; ".example.com" also allows its subdomains. Empty disables callbacks.
+CALLBACK_ALLOWED_HOSTS = [
+    host.strip().lower() for host in os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()
+]
+
+
+class CallbackURLError(ValueError):
+    """callbackUrl is not an http(s) URL on an allowed host."""
+
+
+def validate_callback_url(url: str, allowed_hosts: list = None) -> str:
+    """Return url if the service may POST to it, else raise CallbackURLError."""
+    allowed_hosts = CALLBACK_ALLOWED_HOSTS if allowed_hosts is None else allowed_hosts
+    try:
+        parsed = urllib.parse.urlsplit(url)
+        host = (parsed.hostname or "").lower()
+        parsed.port  # raises ValueError on a malformed port
+    except ValueError:
+        raise CallbackURLError("callbackUrl is not a valid URL")
+    if parsed.scheme not in ("http", "https") or not host:
+        raise CallbackURLError("callbackUrl must be an http or https URL")
+    if parsed.username or parsed.password:
+        raise CallbackURLError("callbackUrl must not contain credentials")
+    if not any(host == allowed or (allowed.startswith(".") and host.endswith(allowed))
+               for allowed in allowed_hosts):
+        raise CallbackURLError(f"callbackUrl host {host!r} is not in JOB_CALLBACK_ALLOWED_HOSTS")
+    return url
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # A redirect could point the callback at a host outside the allowlist
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_callback_opener = urllib.request.build_opener(_NoRedirect)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    payload BLOB,
+    params TEXT,
+    callback_url TEXT,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at);
+"""
+
+
+class JobQueue:
+    """Bounded persistent queue; handler(payload: bytes, params: dict) -> dict does the work."""
+
+    def __init__(self, db_path: str = JOB_DB_PATH, workers: int = JOB_WORKERS,
+                 max_pending: int = JOB_MAX_PENDING):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_pending = max_pending
+        self.handler = None
+        self._threads = []
+        self._stop = threading.Event()
+        self._wakeup = threading.Condition()
+        self._finished = deque(maxlen=10000)  # (finished_at, run_seconds) for throughput stats
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def _db(self):
+        conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._db() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    # --- API side ---
+
+    def submit(self, payload: bytes, params: dict = None, callback_url: str = None) -> str:
+        """
+        Persist a job and wake a worker. Raises QueueFullError when the queue is at
+        capacity and CallbackURLError when callback_url is not allowed.
+        """
+        if callback_url:
+            validate_callback_url(callback_url)
+        job_id = str(uuid.uuid4())
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            pending = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()[0]
+            if pending >= self.max_pending:
+                conn.execute("ROLLBACK")
+                raise QueueFullError(f"Job queue is full ({pending} pending)")
+            conn.execute(
+                "INSERT INTO jobs (id, status, created_at, payload, params, callback_url) "
+                "VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, time.time(), payload, json.dumps(params or {}), callback_url),
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id: str) -> dict:
+        with self._db() as conn:
+            row = conn.execute(
+                "SELECT id, status, created_at, started_at, finished_at, attempts, result, error "
+                "FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job = {
+            "jobId": row["id"],
+            "status": row["status"],
+            "createdAt": row["created_at"],
+            "startedAt": row["started_at"],
+            "finishedAt": row["finished_at"],
+            "attempts": row["attempts"],
+        }
+        if row["result"]:
+            job["result"] = json.loads(row["result"])
+        if row["error"]:
+            job["error"] = row["error"]
+        return job
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._db() as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            oldest = conn.execute(
+                "SELECT MIN(created_at) FROM jobs WHERE status = 'queued'"
+            ).fetchone()[0]
+        recent = [run for finished_at, run in list(self._finished) if now - finished_at <= 300]
+        return {
+            "depth": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "maxPending": self.max_pending,
+            "workers": self.workers,
+            "oldestQueuedAgeSeconds": round(now - oldest, 2) if oldest else 0.0,
+            "throughputPerMinute": round(len(recent) / 5.0, 2),
+            "avgRunSeconds": round(sum(recent) / len(recent), 3) if recent else 0.0,
+        }
+
+    # --- Worker side ---
+
+    def start(self, handler):
+        """Recover jobs interrupted by a restart and start the worker threads."""
+        self.handler = handler
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._recover(startup=True)
+
+        self._stop.clear()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        print(f"[JOBS] Started {self.workers} worker(s) on {self.db_path}")
+
+    def stop(self):
+        self._stop.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for t in self._threads:
+            t.join(timeout=5)
+        self._threads = []
+
+    def _recover(self, startup: bool = False):
+        """Re-queue running jobs whose worker process is gone or whose lease expired."""
+        host = socket.gethostname()
+        stale = []
+        with self._db() as conn:
+            rows = conn.execute(
+                "SELECT id, owner, started_at FROM jobs WHERE status = 'running'"
+            ).fetchall()
+            for row in rows:
+                owner_host, _, owner_pid = (row["owner"] or "").rpartition(":")
+                expired = (row["started_at"] or 0) < time.time() - JOB_LEASE_SECONDS
+                dead = owner_host == host and not _pid_alive(owner_pid)
+                # A restarted container can reuse our pid; at startup nothing of ours is running yet
+                dead = dead or (startup and row["owner"] == self.owner)
+                if expired or dead:
+                    stale.append(row["id"])
+            for job_id in stale:
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued', started_at = NULL, owner = NULL "
+                    "WHERE id = ? AND status = 'running'",
+                    (job_id,),
+                )
+        if stale:
+            print(f"[JOBS] Re-queued {len(stale)} interrupted job(s)")
+
+    def _claim(self):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, payload, params, callback_url, attempts FROM jobs "
+                "WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, owner = ?, attempts = attempts + 1 "
+                "WHERE id = ?",
+                (time.time(), self.owner, row["id"]),
+            )
+            conn.execute("COMMIT")
+            return dict(row)
+        finally:
+            conn.close()
+
+    def _worker_loop(self):
+        last_purge = 0.0
+        while not self._stop.is_set():
+            job = self._claim()
+            if job is None:
+                if time.time() - last_purge > 3600:
+                    self._recover()
+                    self._purge()
+                    last_purge = time.time()
+                with self._wakeup:
+                    self._wakeup.wait(timeout=1.0)
+                continue
+            self._run(job)
+
+    def _run(self, job: dict):
+        started = time.time()
+        try:
+            result = self.handler(job["payload"], json.loads(job["params"] or "{}"))
+            self._complete(job["id"], "done", result=result)
+        except Exception as e:
+            print(f"[JOBS] Job {job['id']} failed (attempt {job['attempts'] + 1}): {e}")
+            if job["attempts"] + 1 < JOB_MAX_ATTEMPTS:
+                with self._db() as conn:
+                    conn.execute("UPDATE jobs SET status = 'queued' WHERE id = ?", (job["id"],))
+                return
+            self._complete(job["id"], "failed", error=str(e))
+        finally:
+            self._finished.append((time.time(), time.time() - started))
+
+        if job["callback_url"]:
+            self._send_callback(job["callback_url"], self.get(job["id"]))
+
+    def _complete(self, job_id: str, status: str, result: dict = None, error: str = None):
+        # The image payload is no longer needed once the job is settled
+        with self._db() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ?, payload = NULL WHERE id = ?",
+                (status, time.time(), json.dumps(result) if result is not None else None, error, job_id),
+            )
+
+    def _send_callback(self, url: str, job: dict):
+        try:
+            # Checked again: the allowlist may have changed since the job was queued
+            validate_callback_url(url)
+            req = urllib.request.Request(
+                url, data=json.dumps(job).encode(), headers={"Content-Type": "application/json"}
+            )
+            _callback_opener.open(req, timeout=CALLBACK_TIMEOUT).close()
+        except Exception as e:
+            print(f"[JOBS] Callback to {url} failed: {e}")
+
+    def _purge(self):
+        cutoff = time.time() - JOB_RETENTION_HOURS * 3600
+        with self._db() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (cutoff,)
+            )
+
+def _pid_alive(pid: str) -> bool:
+    try:
+        os.kill(int(pid), 0)
+        return True
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True
+
+# Singleton
+job_queue = JobQueue()
@@ -1,30 +1,75 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, Request, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 import uvicorn
 import os
 from dotenv import load_dotenv
 load_dotenv()
 from datetime import datetime
-import shutil
 import json
+import numpy as np
 from pydantic import BaseModel, Json
-from typing import Optional
+from typing import Optional, List
 from fraud_engine import FraudEngine # Changed from fraud_engine
-from image_validator import ImageValidator # Changed from image_validator
-from tamper_detector import TamperDetector # New import
 from behavior_model import BehaviorRiskModel # New import
-from ml_fraud_engine import ml_engine # ML-enhanced pipeline
+from ml_fraud_engine import ml_engine, analyze_document, analyze_documents # ML-enhanced pipeline
+from document_image import DocumentImage
+from executor import analysis_executor, PoolOverloadedError, IMAGE_ANALYSIS_POOL
+from job_queue import job_queue, validate_callback_url, CallbackURLError
+from uploads import read_upload, parse_json_field, UploadTooLargeError, UploadFormatError
+import metrics
+import ml_model
+from ocr_analyzer import load_reader
+from ocr_batcher import batcher_stats
+from duplicate_detector import load_hash_db
+from model_loader import model_loader
+from result_cache import result_cache
+from invoice_registry import get_registry
+from feature_cache import feature_cache
+from model_registry import model_registry
+from shadow_eval import shadow_evaluator
+import stage_graph
 
 app = FastAPI(title="Government Contractor AI Service", version="1.0.0")
 
 # Initialize Engines
 fraud_engine = FraudEngine()
-image_validator = ImageValidator()
 behavior_model = BehaviorRiskModel()
 
+BATCH_MAX_DOCUMENTS = int(os.getenv("BATCH_MAX_DOCUMENTS", 200))
+SCORE_BATCH_MAX_CONTRACTORS = int(os.getenv("SCORE_BATCH_MAX_CONTRACTORS", 100000))
+
+# Models load in the background after the port is bound, cheapest first
+model_loader.register("amount_anomaly", ml_model.load_model)
+model_loader.register("behavior_risk", behavior_model.load_model)
+model_loader.register("fraud_random_forest", ml_engine.load)
+model_loader.register("image_hash_db", load_hash_db)
+model_loader.register("easyocr", load_reader)
+
+# Newly published model versions are swapped into this worker without a restart
+model_registry.watch("amount_anomaly", lambda model, meta: ml_model.set_model(model, meta["version"]))
+model_registry.watch("behavior_risk", lambda model, meta: behavior_model.set_model(model, meta["version"]))
+if ml_engine.enabled:
+    model_registry.watch("fraud_random_forest", lambda model, meta: ml_engine.set_model(model, meta["version"]))
+    model_registry.watch("fraud_random_forest", ml_engine.set_candidate, candidate=True)
+
+# Shadow scoring is dropped while requests are queueing for a worker
+shadow_evaluator.set_pressure_check(analysis_executor.backlogged)
+
 # Ensure temp directory exists
 os.makedirs("temp", exist_ok=True)
 
+app.middleware("http")(metrics.metrics_middleware)
+metrics.register_stats_source("executor", analysis_executor.stats)
+metrics.register_stats_source("jobs", lambda: {"jobs": job_queue.stats()})
+metrics.register_stats_source("result_cache", lambda: {"results": result_cache.snapshot()})
+metrics.register_stats_source("invoice_registry", lambda: {"invoices": get_registry().snapshot()})
+metrics.register_stats_source("ocr_batcher", batcher_stats)
+metrics.register_stats_source("feature_cache", lambda: {"features": feature_cache.snapshot()})
+metrics.register_stats_source("behavior_explanations", lambda: {"shap": behavior_model.explanation_snapshot()})
+metrics.register_stats_source("stages", lambda: {"stages": stage_graph.stage_stats()})
+metrics.register_stats_source("shadow", lambda: {"fraud_random_forest": shadow_evaluator.snapshot()})
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -33,10 +78,70 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(PoolOverloadedError)
+async def pool_overloaded_handler(request: Request, exc: PoolOverloadedError):
+    """429 when the analysis queue is full, 503 when queued work went stale."""
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc)},
+        headers={"Retry-After": "1"},
+    )
+
+@app.on_event("startup")
+def start_background_loading():
+    model_loader.start_background()
+
+@app.on_event("startup")
+def start_model_watcher():
+    model_registry.start_watcher()
+
+@app.on_event("startup")
+def start_job_workers():
+    job_queue.start(_run_job)
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    model_registry.stop()
+    shadow_evaluator.stop()
+    job_queue.stop()
+    analysis_executor.shutdown()
+    stage_graph.shutdown()
+
 @app.get("/")
 def read_root():
     return {"status": "AI Service Operational", "version": "1.0.0"}
 
+@app.get("/ready")
+def readiness():
+    """Readiness probe: 503 until every model has finished loading (or failed to)."""
+    status = model_loader.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.get("/models")
+def model_versions():
+    """Published vs loaded version of every hot-swappable model in this worker."""
+    return model_registry.snapshot()
+
+@app.get("/models/shadow")
+def shadow_stats():
+    """Candidate vs serving model agreement in this worker; per-document records are in SHADOW_LOG_PATH."""
+    return shadow_evaluator.snapshot()
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus scrape endpoint."""
+    body, content_type = metrics.render_latest()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/executor/stats")
+def executor_stats():
+    """Per-pool queue depth, in-flight work and queue wait times, plus the stage fan-out pool."""
+    return {**analysis_executor.stats(), "stages": stage_graph.stage_stats()}
+
+def _run_submission(data: dict, doc: DocumentImage = None, full_evaluation: bool = None):
+    """Blocking part of /analyze: the fraud engine's rules, GPS validation included."""
+    return fraud_engine.analyze_submission(data, doc=doc, full_evaluation=full_evaluation)
+
 @app.post("/analyze")
 async def analyze_submission(
     invoiceNumber: str = Form(...),
@@ -47,9 +152,9 @@ async def analyze_submission(
     projectLon: Optional[float] = Form(None),
     supplierRedlisted: bool = Form(False),
     duplicateInvoice: bool = Form(False),
+    fullEvaluation: Optional[bool] = Form(None),
     image: Optional[UploadFile] = File(None)
 ):
-    temp_file = None
     try:
         # Construct data dict
         data = {
@@ -64,44 +169,17 @@ async def analyze_submission(
         }
 
         # Process Image if exists
-        image_path = None
-        gps_result = None
-
+        doc = None
         if image:
-            temp_file = f"temp_{image.filename}"
-            with open(temp_file, "wb") as buffer:
-                shutil.copyfileobj(image.file, buffer)
-            image_path = temp_file
-            
-            # If Project GPS provided, validate location
-            if projectLat is not None and projectLon is not None:
-                gps_result = image_validator.validate_image_location(
-                    temp_file, 
-                    float(projectLat), 
-                    float(projectLon)
-                )
-                # Inject GPS results into data for fraud engine or merge results later
-                data["gps_valid"] = gps_result["gps_valid"]
-                data["distance_meters"] = gps_result["distance_meters"]
-                if not gps_result["gps_valid"] and gps_result["distance_meters"] != -1:
-                     data["gps_mismatch_reason"] = gps_result.get("reason", "Location mismatch")
-
-        # Run Analysis
-        result = fraud_engine.analyze_submission(data, image_path=image_path)
-        
-        # Merge GPS detailed stats if available
-        if gps_result:
-            result["gpsValid"] = gps_result["gps_valid"]
-            result["distanceMeters"] = gps_result["distance_meters"]
+            doc = DocumentImage.from_bytes(await image.read(), name=image.filename or "upload.png")
 
-        return result
+        # fullEvaluation runs every rule even once the score is capped (audits)
+        return await analysis_executor.run("thread", _run_submission, data, doc, fullEvaluation)
 
+    except PoolOverloadedError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        # Cleanup
-        if temp_file and os.path.exists(temp_file):
-            os.remove(temp_file)
 
 @app.post("/predict-risk")
 async def predict_risk(
@@ -126,7 +204,7 @@ async def predict_risk(
             'suspensionHistory': suspensionHistory
         }
         
-        result = behavior_model.predict_risk(features)
+        result = await analysis_executor.run("thread", behavior_model.predict_risk, features)
         
         if "error" in result:
              # If model not trained, return neutral default
@@ -138,21 +216,120 @@ async def predict_risk(
             
         return result
 
+    except PoolOverloadedError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/predict-risk/explanations/{explanation_id}")
+def get_risk_explanation(explanation_id: str):
+    """
+    SHAP attributions for a /predict-risk call that returned explanationStatus "pending".
+    """
+    explanation = behavior_model.get_explanation(explanation_id)
+    if explanation is None:
+        raise HTTPException(status_code=404, detail="Explanation not found")
+    return explanation
+
+def _credibility_scores(completion_rate, delay_days, fraud_flags, quality_avg):
+    """Credibility formula on scalars or NumPy arrays (same operations, same order)."""
+    # Base weighted score
+    score = (completion_rate * 100 * 0.30) + ((quality_avg / 5.0) * 100 * 0.40)
+    score = score - (delay_days * 2)
+    score = score - (fraud_flags * 20)
+    return np.clip(score, 0, 100)
+
 @app.post("/calculate-score")
 def calculate_score(completion_rate: float, delay_days: int, fraud_flags: int, quality_avg: float):
     """
     Calculate contractor credibility score based on performance metrics.
     """
-    # Base weighted score
-    score = (completion_rate * 100 * 0.30) + ((quality_avg / 5.0) * 100 * 0.40)
-    score -= (delay_days * 2)
-    score -= (fraud_flags * 20)
-    
-    final_score = max(0, min(100, score))
-    return {"score": round(final_score, 2)}
+    final_score = _credibility_scores(completion_rate, delay_days, fraud_flags, quality_avg)
+    return {"score": round(float(final_score), 2)}
+
+
+class ContractorRiskRecord(BaseModel):
+    contractorId: str
+    completionRate: float
+    avgDelayDays: float
+    fraudFlags: int
+    duplicateImageCount: int
+    anomalyCount: int
+    totalProjects: int
+    avgRiskScore: float
+    suspensionHistory: int
+
+
+class RiskBatchRequest(BaseModel):
+    contractors: List[ContractorRiskRecord]
+
+
+class ContractorScoreRecord(BaseModel):
+    contractorId: str
+    completion_rate: float
+    delay_days: int
+    fraud_flags: int
+    quality_avg: float
+
+
+class ScoreBatchRequest(BaseModel):
+    contractors: List[ContractorScoreRecord]
+
+
+def _check_contractor_batch(contractors: list) -> list:
+    """Contractor ids in input order; 400/413 for empty, oversized or ambiguous batches."""
+    if not contractors:
+        raise HTTPException(status_code=400, detail="contractors must not be empty")
+    if len(contractors) > SCORE_BATCH_MAX_CONTRACTORS:
+        raise HTTPException(status_code=413, detail=f"At most {SCORE_BATCH_MAX_CONTRACTORS} contractors per batch")
+    ids = [item.contractorId for item in contractors]
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=400, detail="contractorId values must be unique")
+    return ids
+
+
+@app.post("/predict-risk/batch")
+async def predict_risk_batch(req: RiskBatchRequest):
+    """
+    Behavior risk for many contractors in one predict_proba call, keyed by contractorId.
+    """
+    try:
+        ids = _check_contractor_batch(req.contractors)
+        records = [dict(item) for item in req.contractors]
+        scored = await analysis_executor.run("thread", behavior_model.predict_risk_batch, records)
+
+        if "error" in scored:
+            # Same neutral default as /predict-risk when the model is not trained
+            neutral = {"riskProbability": 0.0, "riskLevel": "UNKNOWN"}
+            return JSONResponse({"count": len(ids), "results": {cid: neutral for cid in ids},
+                                 "message": "Model not trained yet"})
+
+        # Plain JSONResponse: skips re-encoding 100k small dicts through jsonable_encoder
+        return JSONResponse({
+            "count": len(ids),
+            "results": dict(zip(ids, scored["results"])),
+            "topFactors": scored["topFactors"],
+        })
+
+    except (HTTPException, PoolOverloadedError):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/calculate-score/batch")
+def calculate_score_batch(req: ScoreBatchRequest):
+    """
+    Credibility scores for many contractors with one pass of NumPy arithmetic, keyed by contractorId.
+    """
+    ids = _check_contractor_batch(req.contractors)
+    columns = zip(*[(c.completion_rate, c.delay_days, c.fraud_flags, c.quality_avg) for c in req.contractors])
+    completion_rate, delay_days, fraud_flags, quality_avg = (np.array(col, dtype=np.float64) for col in columns)
+    scores = _credibility_scores(completion_rate, delay_days, fraud_flags, quality_avg)
+    return JSONResponse({
+        "count": len(ids),
+        "results": {cid: {"score": round(score, 2)} for cid, score in zip(ids, scores.tolist())},
+    })
 
 
 class ImageAnalysisRequest(BaseModel):
@@ -174,29 +351,15 @@ async def analyze_image(req: ImageAnalysisRequest):
             raise HTTPException(status_code=400, detail="image_base64 is required")
 
         vendor_ctx = req.vendorContext or {}
-        result = ml_engine.analyze_base64(req.image_base64, vendor_ctx, req.query)
+        try:
+            doc = DocumentImage.from_base64(req.image_base64)
+        except ValueError:
+            doc = None
 
-        # Also run tamper detection if we can save the temp image
-        if result.get("status") != "ERROR":
-            try:
-                import base64 as b64
-                from io import BytesIO as BIO
-                raw_b64 = req.image_base64
-                if "," in raw_b64:
-                    raw_b64 = raw_b64.split(",", 1)[1]
-                img_bytes = b64.b64decode(raw_b64)
-                tamper_path = f"temp/tamper_{datetime.now().strftime('%Y%m%d%H%M%S')}.png"
-                with open(tamper_path, "wb") as f:
-                    f.write(img_bytes)
-                tamper_result = tamper_detector.detect_tampering(tamper_path)
-                if tamper_result.get("tampered"):
-                    result["fraudSignals"].append("Image manipulation/tampering suspected")
-                    result["riskScore"] = min(100, result["riskScore"] + 20)
-                result["tamperDetection"] = tamper_result
-                if os.path.exists(tamper_path):
-                    os.remove(tamper_path)
-            except Exception as te:
-                print(f"[TAMPER] Skipped: {te}")
+        if doc is None:
+            result = {"status": "ERROR", "message": "Invalid Base64"}
+        else:
+            result = await analysis_executor.run(IMAGE_ANALYSIS_POOL, analyze_document, doc, vendor_ctx, req.query)
 
         result["vendorId"] = req.vendorId
         result["timestamp"] = datetime.now().isoformat()
@@ -204,11 +367,148 @@ async def analyze_image(req: ImageAnalysisRequest):
 
         return result
 
-    except HTTPException:
+    except (HTTPException, PoolOverloadedError):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/analyze-image/upload")
+async def analyze_image_upload(request: Request):
+    """
+    Binary variant of /analyze-image.
+    Send the image as the 'image' part of multipart/form-data (other fields:
+    vendorId, query, vendorContext as JSON), or as a raw
+    application/octet-stream body with those fields as query parameters.
+    """
+    try:
+        data, content_hash, name, fields = await read_upload(request)
+        vendor_ctx = parse_json_field(fields.get("vendorContext"), {})
+        if not isinstance(vendor_ctx, dict):
+            # The JSON routes get this from the Optional[dict] model field
+            raise UploadFormatError("vendorContext must be a JSON object")
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        doc = DocumentImage.from_bytes(data, name=name, content_hash=content_hash)
+        result = await analysis_executor.run(
+            IMAGE_ANALYSIS_POOL, analyze_document, doc, vendor_ctx, fields.get("query", "")
+        )
+
+        result["vendorId"] = fields.get("vendorId", "")
+        result["timestamp"] = datetime.now().isoformat()
+        result["type"] = "invoice_analysis"
+
+        return result
+
+    except PoolOverloadedError:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+class BatchImageAnalysisRequest(BaseModel):
+    documents: List[ImageAnalysisRequest]
+
+
+def _run_batch(docs: list, contexts: list) -> list:
+    """Blocking part of /analyze-images/batch; decode failures keep their slot."""
+    valid = [i for i, doc in enumerate(docs) if doc is not None]
+    analyzed = analyze_documents([docs[i] for i in valid], [contexts[i] for i in valid])
+    results = [{"status": "ERROR", "message": "Invalid Base64"} for _ in docs]
+    for i, result in zip(valid, analyzed):
+        results[i] = result
+    return results
+
+
+@app.post("/analyze-images/batch")
+async def analyze_images_batch(req: BatchImageAnalysisRequest):
+    """
+    Batch OCR + Fraud Analysis.
+    Every stage runs once over the whole batch (batched OCR detection, one
+    model call on the stacked features); results are returned in input order.
+    """
+    try:
+        if not req.documents:
+            raise HTTPException(status_code=400, detail="documents must not be empty")
+        if len(req.documents) > BATCH_MAX_DOCUMENTS:
+            raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_DOCUMENTS} documents per batch")
+
+        docs = []
+        for item in req.documents:
+            try:
+                docs.append(DocumentImage.from_base64(item.image_base64))
+            except ValueError:
+                docs.append(None)
+        contexts = [item.vendorContext or {} for item in req.documents]
+
+        results = await analysis_executor.run("thread", _run_batch, docs, contexts)
+
+        timestamp = datetime.now().isoformat()
+        for index, (item, result) in enumerate(zip(req.documents, results)):
+            result["index"] = index
+            result["vendorId"] = item.vendorId
+            result["timestamp"] = timestamp
+            result["type"] = "invoice_analysis"
+
+        return {"count": len(results), "results": results}
+
+    except (HTTPException, PoolOverloadedError):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+class JobRequest(ImageAnalysisRequest):
+    callbackUrl: Optional[str] = None
+
+
+def _run_job(payload: bytes, params: dict) -> dict:
+    """Job worker handler: same pipeline as /analyze-image."""
+    doc = DocumentImage.from_bytes(payload)
+    result = analyze_document(doc, params.get("vendorContext") or {}, params.get("query", ""))
+    result["vendorId"] = params.get("vendorId", "")
+    result["timestamp"] = datetime.now().isoformat()
+    result["type"] = "invoice_analysis"
+    return result
+
+
+@app.post("/jobs", status_code=202)
+def submit_job(req: JobRequest):
+    """
+    Queue an /analyze-image run and return immediately.
+    Poll GET /jobs/{id}, or pass callbackUrl to have the finished job POSTed back.
+    """
+    if req.callbackUrl:
+        # Only http(s) to JOB_CALLBACK_ALLOWED_HOSTS, so callbacks cannot reach internal services
+        try:
+            validate_callback_url(req.callbackUrl)
+        except CallbackURLError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    try:
+        doc = DocumentImage.from_base64(req.image_base64)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Base64")
+
+    params = {"vendorId": req.vendorId, "query": req.query, "vendorContext": req.vendorContext or {}}
+    job_id = job_queue.submit(doc.data, params, callback_url=req.callbackUrl)
+    return {"jobId": job_id, "status": "queued", "statusUrl": f"/jobs/{job_id}"}
+
+
+@app.get("/jobs/stats")
+def job_stats():
+    """Queue depth, oldest queued job age and throughput."""
+    return job_queue.stats()
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 from feedback_manager import feedback_manager
 
 class FeedbackRequest(BaseModel):
@@ -228,6 +528,33 @@ def submit_feedback(req: FeedbackRequest):
     except Exception as e:
          raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/feedback/upload")
+async def submit_feedback_upload(request: Request):
+    """
+    Binary variant of /feedback: image as the 'image' multipart part (or an
+    octet-stream body) with original_status, correct_status and notes as
+    form fields (or query parameters).
+    """
+    try:
+        data, _, _, fields = await read_upload(request)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not fields.get("original_status") or not fields.get("correct_status"):
+        raise HTTPException(status_code=400, detail="original_status and correct_status are required")
+
+    try:
+        return await analysis_executor.run(
+            "thread", feedback_manager.save_feedback_bytes,
+            data, fields["original_status"], fields["correct_status"], fields.get("notes", "")
+        )
+    except PoolOverloadedError:
+        raise
+    except Exception as e:
+         raise HTTPException(status_code=500, detail=str(e))
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8000))
     uvicorn.run(app, host="0.0.0.0", port=port)
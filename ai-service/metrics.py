@@ -0,0 +1,147 @@
+"""
+Prometheus metrics for the AI service.
+Request counts/latency per route, latency histograms per analysis stage,
+and gauges for model load state, hash-DB size and worker pools.
+Falls back to no-op metrics when prometheus_client is not installed.
+"""
+import time
+from functools import wraps
+
+try:
+    from prometheus_client import Counter, Histogram, Gauge, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+    from prometheus_client.core import GaugeMetricFamily
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+    print("[METRICS] prometheus_client not available, metrics disabled")
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+if PROMETHEUS_AVAILABLE:
+    REQUESTS = Counter(
+        "ai_http_requests_total", "HTTP requests by route, method and status",
+        ["route", "method", "status"],
+    )
+    REQUEST_LATENCY = Histogram(
+        "ai_http_request_duration_seconds", "HTTP request latency by route",
+        ["route", "method"], buckets=STAGE_BUCKETS,
+    )
+    STAGE_LATENCY = Histogram(
+        "ai_stage_duration_seconds", "Latency of individual analysis stages",
+        ["stage"], buckets=STAGE_BUCKETS,
+    )
+    STAGE_ERRORS = Counter(
+        "ai_stage_errors_total", "Exceptions raised by analysis stages",
+        ["stage"],
+    )
+    MODEL_LOADED = Gauge(
+        "ai_model_loaded", "1 when the model is loaded and serving, 0 otherwise",
+        ["model"],
+    )
+    HASH_DB_SIZE = Gauge(
+        "ai_image_hash_db_entries", "Perceptual hashes held by the duplicate detector",
+    )
+    OCR_BATCH_FILL = Histogram(
+        "ai_ocr_batch_fill_ratio", "Text crops per recognizer batch as a fraction of the max batch size",
+        buckets=(0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0, 2.0),
+    )
+    OCR_BATCH_QUEUE_DELAY = Histogram(
+        "ai_ocr_batch_queue_delay_seconds", "Time a request's crops waited for their recognizer batch",
+        buckets=STAGE_BUCKETS,
+    )
+else:
+    REGISTRY = None
+    REQUESTS = REQUEST_LATENCY = STAGE_LATENCY = STAGE_ERRORS = _NoopMetric()
+    MODEL_LOADED = HASH_DB_SIZE = _NoopMetric()
+    OCR_BATCH_FILL = OCR_BATCH_QUEUE_DELAY = _NoopMetric()
+
+
+def timed(stage: str):
+    """Decorator recording the wrapped call's latency under ai_stage_duration_seconds{stage}."""
+    # Resolve label children once so the hot path is two perf_counter calls and an observe
+    histogram = STAGE_LATENCY.labels(stage)
+    errors = STAGE_ERRORS.labels(stage)
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def set_model_loaded(model: str, loaded: bool):
+    MODEL_LOADED.labels(model).set(1 if loaded else 0)
+
+
+def register_stats_source(name: str, source):
+    """
+    Export a stats() dict-of-dicts (e.g. worker pools) as gauges at scrape time:
+    ai_<name>_<key>{pool="..."} for every numeric value.
+    """
+    if not PROMETHEUS_AVAILABLE:
+        return
+
+    class _StatsCollector:
+        def collect(self):
+            families = {}
+            for label, stats in source().items():
+                for key, value in stats.items():
+                    if isinstance(value, bool) or not isinstance(value, (int, float)):
+                        continue
+                    metric = f"ai_{name}_{_snake(key)}"
+                    if metric not in families:
+                        families[metric] = GaugeMetricFamily(metric, f"{name} {key}", labels=["pool"])
+                    families[metric].add_metric([label], value)
+            return list(families.values())
+
+    REGISTRY.register(_StatsCollector())
+
+
+def _snake(key: str) -> str:
+    return "".join("_" + c.lower() if c.isupper() else c for c in key)
+
+
+async def metrics_middleware(request, call_next):
+    """Starlette HTTP middleware counting requests per route template and status."""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        REQUESTS.labels(path, request.method, str(status)).inc()
+        REQUEST_LATENCY.labels(path, request.method).observe(time.perf_counter() - start)
+
+
+def render_latest():
+    """Returns (body, content_type) for the /metrics endpoint."""
+    if not PROMETHEUS_AVAILABLE:
+        return b"# prometheus_client not installed\n", CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
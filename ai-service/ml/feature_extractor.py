@@ -7,9 +7,14 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from ocr_analyzer import ocr_analyzer
 from visual_forensics import visual_forensics
+from document_image import DocumentImage
+from feature_cache import feature_cache
 
 class FeatureExtractor:
-    def extract_features(self, image_path, ocr_data=None):
+    # Bump whenever the feature layout or any feature's definition changes
+    VERSION = 1
+
+    def extract_features(self, doc: DocumentImage, ocr_data=None):
         """
         Extract numerical features from receipt image.
         Returns a numpy array of features:
@@ -25,11 +30,16 @@ class FeatureExtractor:
         ]
         """
         if not ocr_data:
-            # Run pipeline if data not provided
-            ocr_text = ocr_analyzer.extract_text(image_path)
-            fields = ocr_analyzer.extract_fields(ocr_text)
-            signals = ocr_analyzer.run_anomaly_checks(fields) 
-            vis = visual_forensics.analyze(image_path)
+            # Run pipeline if data not provided (or reuse a cached run of it)
+            cached = feature_cache.get(doc.content_hash)
+            if cached is not None:
+                ocr_text, fields, vis = cached["text"], cached["fields"], cached["visual"]
+            else:
+                ocr_text, ocr_mode = ocr_analyzer.extract_text_with_mode(doc)
+                fields = ocr_analyzer.extract_fields(ocr_text)
+                vis = visual_forensics.analyze(doc)
+                feature_cache.put(doc.content_hash, ocr_text, ocr_mode, fields, vis)
+            signals = ocr_analyzer.run_anomaly_checks(fields, check_duplicates=False)
         else:
             ocr_text = ocr_data.get("text", "")
             fields = ocr_data.get("fields", {})
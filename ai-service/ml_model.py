@@ -1,11 +1,13 @@
-import pandas as pd
-from sklearn.ensemble import IsolationForest
-import joblib
-import os
+import threading
 import numpy as np
+from metrics import timed, set_model_loaded
+from model_registry import model_registry
 
-MODEL_FILE = "model.joblib"
+MODEL_FILE = "model.joblib"  # pre-registry location, adopted on first load
+REGISTRY_NAME = "amount_anomaly"
 _model = None
+_model_version = None
+_load_lock = threading.Lock()
 
 def train_model(dataframe):
     """
@@ -13,6 +15,7 @@ def train_model(dataframe):
     :param dataframe: pandas DataFrame containing an 'amount' column
     """
     global _model
+    from sklearn.ensemble import IsolationForest
     
     # Train only on invoice amounts
     # reshape(-1, 1) if it's a single feature
@@ -27,21 +30,39 @@ def train_model(dataframe):
     )
     _model.fit(X)
     
-    joblib.dump(_model, MODEL_FILE)
-    print(f"Model trained and saved to {MODEL_FILE}")
+    version = model_registry.publish(REGISTRY_NAME, _model, {"samples": len(X), "source": "ml_model.train_model"})
+    print(f"Model trained and published as {REGISTRY_NAME} {version}")
 
 def load_model():
     """
     Loads the model if it exists.
     """
-    global _model
-    if os.path.exists(MODEL_FILE):
-        _model = joblib.load(MODEL_FILE)
-        print("Model loaded successfully.")
-        return True
-    print("Model file not found.")
-    return False
+    global _model, _model_version
+    with _load_lock:
+        if _model is not None:
+            return True
+        loaded = model_registry.load_current(REGISTRY_NAME, legacy_path=MODEL_FILE)
+        if loaded is not None:
+            _model, metadata = loaded
+            _model_version = metadata["version"]
+            model_registry.mark_loaded(REGISTRY_NAME, _model_version)
+            print(f"Model {_model_version} loaded successfully.")
+            set_model_loaded("amount_anomaly", True)
+            return True
+        print("Model file not found.")
+        set_model_loaded("amount_anomaly", False)
+        return False
 
+def set_model(model, version: str):
+    """
+    Swaps in a new model; calls already running keep the one they started with.
+    """
+    global _model, _model_version
+    with _load_lock:
+        _model, _model_version = model, version
+    set_model_loaded("amount_anomaly", model is not None)
+
+@timed("amount_anomaly")
 def detect_anomaly(amount):
     """
     Detects anomaly for a specific amount.
@@ -63,19 +84,48 @@ def detect_anomaly(amount):
 
     # Predict requires 2D array
     X = np.array([[amount]])
+    model = _model  # one model for both calls, even if a new version is swapped in meanwhile
     
     # -1 for anomaly, 1 for normal
-    prediction = _model.predict(X)
+    prediction = model.predict(X)
     
     # decision_function: average anomaly score of X of the base classifiers.
     # The anomaly score of an input sample is computed as the mean anomaly score of the trees in the forest.
     # For IsolationForest, lower values indicate anomaly.
-    score = _model.decision_function(X)[0]
+    score = model.decision_function(X)[0]
     
     return {
         "is_anomaly": bool(prediction[0] == -1),
         "anomaly_score": float(score)
     }
 
-# Initialization: Try to load model on import
-load_model()
+@timed("amount_anomaly_batch")
+def detect_anomalies(amounts):
+    """
+    Vectorized detect_anomaly: one predict/decision_function call for many amounts.
+    Returns a list of dictionaries in input order.
+    """
+    global _model
+
+    if len(amounts) == 0:
+        return []
+
+    if _model is None:
+        if not load_model():
+            return [{
+                "is_anomaly": False,
+                "anomaly_score": 0.0,
+                "error": "Model not loaded"
+            } for _ in amounts]
+
+    X = np.asarray(amounts, dtype=float).reshape(-1, 1)
+    model = _model
+    predictions = model.predict(X)
+    scores = model.decision_function(X)
+
+    return [
+        {"is_anomaly": bool(p == -1), "anomaly_score": float(sc)}
+        for p, sc in zip(predictions, scores)
+    ]
+
+# The model is loaded by the background loader (model_loader) or on first use
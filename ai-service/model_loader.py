@@ -0,0 +1,67 @@
+"""
+Background model loading.
+The API binds its port immediately; models are loaded afterwards on a
+background thread in registration order, with per-component timings.
+Every component can still load itself on first use, so a request that
+arrives early is served (slowly) rather than failed.
+"""
+import threading
+import time
+
+PENDING, LOADING, READY, UNAVAILABLE, FAILED = "pending", "loading", "ready", "unavailable", "failed"
+
+
+class ModelLoader:
+    def __init__(self):
+        self._components = []  # (name, load_fn) in load order
+        self._state = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, name: str, load_fn):
+        """load_fn() -> bool: True when the model is serving, False when it is not available."""
+        self._components.append((name, load_fn))
+        self._state[name] = {"state": PENDING, "seconds": None}
+
+    def _load_one(self, name: str, load_fn):
+        with self._lock:
+            self._state[name] = {"state": LOADING, "seconds": None}
+        start = time.perf_counter()
+        try:
+            ok = load_fn()
+            state = {"state": READY if ok else UNAVAILABLE}
+        except Exception as e:
+            state = {"state": FAILED, "error": str(e)}
+        state["seconds"] = round(time.perf_counter() - start, 3)
+        with self._lock:
+            self._state[name] = state
+        print(f"[LOADER] {name}: {state['state']} in {state['seconds']}s")
+
+    def load_all(self, names=None):
+        """
+        Load components in order on the calling thread (all, or only those in names).
+        Components already READY, e.g. preloaded by a gunicorn master before fork, are skipped.
+        """
+        start = time.perf_counter()
+        for name, load_fn in self._components:
+            if names is not None and name not in names:
+                continue
+            with self._lock:
+                if self._state[name]["state"] == READY:
+                    continue
+            self._load_one(name, load_fn)
+        print(f"[LOADER] All components processed in {time.perf_counter() - start:.2f}s")
+
+    def start_background(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.load_all, name="model-loader", daemon=True)
+            self._thread.start()
+
+    def status(self) -> dict:
+        with self._lock:
+            components = {name: dict(state) for name, state in self._state.items()}
+        ready = all(c["state"] not in (PENDING, LOADING) for c in components.values())
+        return {"ready": ready, "components": components}
+
+# Singleton
+model_loader = ModelLoader()
@@ -0,0 +1,353 @@
+"""
+Versioned model artifacts with checksums, atomic publishing and hot swap.
+
+Layout under MODEL_REGISTRY_DIR:
+    <name>/<version>/model.joblib     the artifact
+    <name>/<version>/metadata.json    sha256, size, createdAt, plus whatever the trainer adds
+    <name>/CURRENT                    the serving version, replaced with os.replace
+    <name>/CANDIDATE                  optional version under shadow/canary evaluation
+
+A version directory is complete before CURRENT points at it, and every load
+verifies the checksum, so a half-written or corrupt artifact is rejected
+instead of crashing a worker. Running workers poll CURRENT and swap the new
+model in; in-flight requests keep the model object they already hold.
+The hard-coded model files from before the registry are adopted as the
+first version on first load.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import joblib
+
+MODEL_REGISTRY_DIR = os.getenv(
+    "MODEL_REGISTRY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "registry")
+)
+MODEL_REGISTRY_POLL_SECONDS = float(os.getenv("MODEL_REGISTRY_POLL_SECONDS", 10))  # 0 disables hot swap
+MODEL_REGISTRY_KEEP = int(os.getenv("MODEL_REGISTRY_KEEP", 5))
+# joblib mmap_mode for artifacts; numpy arrays in the pickle map the file instead of being copied
+MODEL_MMAP_MODE = os.getenv("MODEL_MMAP_MODE", "r") or None
+
+ARTIFACT_FILE = "model.joblib"
+METADATA_FILE = "metadata.json"
+POINTER_FILE = "CURRENT"
+CANDIDATE_FILE = "CANDIDATE"
+
+
+class ModelIntegrityError(Exception):
+    """The artifact on disk does not match the checksum recorded when it was published."""
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _atomic_write(path: str, data: bytes):
+    """Write to a temp file in the same directory, fsync, then rename over path."""
+    directory = os.path.dirname(path) or "."
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o644)  # mkstemp creates 0600
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def atomic_dump(obj, path: str):
+    """joblib.dump that never leaves a partially written file at path."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    os.close(fd)
+    try:
+        joblib.dump(obj, tmp)
+        with open(tmp, "rb") as f:
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+class ModelRegistry:
+    def __init__(self, root: str = MODEL_REGISTRY_DIR, poll_seconds: float = MODEL_REGISTRY_POLL_SECONDS,
+                 keep: int = MODEL_REGISTRY_KEEP):
+        self.root = root
+        self.poll_seconds = poll_seconds
+        self.keep = keep
+        self._watches = {}  # name or "name:candidate" -> {"name", "candidate", "callback", "version", "error"}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _dir(self, name: str, version: str = None) -> str:
+        return os.path.join(self.root, name, version) if version else os.path.join(self.root, name)
+
+    def artifact_dir(self, name: str, version: str) -> str:
+        """Directory of a published version; derived artifacts (e.g. compiled forests) live beside it."""
+        return self._dir(name, version)
+
+    # -- publishing ---------------------------------------------------------
+
+    def publish(self, name: str, model, metadata: dict = None, candidate: bool = False) -> str:
+        """
+        Store a fitted model as a new version and make it current (or, with
+        candidate=True, the candidate evaluated against current). Returns the version.
+        """
+        os.makedirs(self._dir(name), exist_ok=True)
+        staging = tempfile.mkdtemp(dir=self._dir(name), prefix=".staging-")
+        try:
+            artifact = os.path.join(staging, ARTIFACT_FILE)
+            atomic_dump(model, artifact)
+            return self._commit(name, staging, artifact, metadata or {}, time.time(), candidate)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def publish_file(self, name: str, path: str, metadata: dict = None) -> str:
+        """Publish an existing joblib file (e.g. one written by an older trainer)."""
+        os.makedirs(self._dir(name), exist_ok=True)
+        staging = tempfile.mkdtemp(dir=self._dir(name), prefix=".staging-")
+        try:
+            artifact = os.path.join(staging, ARTIFACT_FILE)
+            shutil.copyfile(path, artifact)
+            return self._commit(name, staging, artifact, metadata or {}, os.stat(path).st_mtime)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def _commit(self, name: str, staging: str, artifact: str, metadata: dict, created_at: float,
+                candidate: bool = False) -> str:
+        sha = _sha256(artifact)
+        # Same content and timestamp -> same version, so concurrent adopters agree
+        version = time.strftime("%Y%m%dT%H%M%S", time.gmtime(created_at)) + f"-{sha[:8]}"
+        metadata = dict(metadata, name=name, version=version, sha256=sha,
+                        size=os.path.getsize(artifact), createdAt=created_at)
+        _atomic_write(os.path.join(staging, METADATA_FILE), json.dumps(metadata, indent=2, default=str).encode())
+        os.chmod(artifact, 0o644)
+        os.chmod(staging, 0o755)  # mkdtemp creates 0700
+
+        target = self._dir(name, version)
+        try:
+            os.rename(staging, target)
+        except OSError:
+            if not os.path.exists(os.path.join(target, METADATA_FILE)):
+                raise
+            # Already published by another process
+        if candidate:
+            self.set_candidate(name, version)
+        else:
+            self.set_current(name, version)
+        self._prune(name)
+        print(f"[REGISTRY] Published {name} {version}{' as candidate' if candidate else ''}")
+        return version
+
+    def set_current(self, name: str, version: str):
+        """Point name at an existing version (also used for rollback)."""
+        self._set_pointer(name, POINTER_FILE, version)
+
+    def set_candidate(self, name: str, version: str):
+        """Evaluate an existing version in shadow (and canary) against the current one."""
+        self._set_pointer(name, CANDIDATE_FILE, version)
+
+    def clear_candidate(self, name: str):
+        try:
+            os.unlink(os.path.join(self._dir(name), CANDIDATE_FILE))
+        except FileNotFoundError:
+            pass
+
+    def promote_candidate(self, name: str) -> str:
+        """Make the candidate the serving version and end its evaluation."""
+        version = self.candidate_version(name)
+        if version is None:
+            raise FileNotFoundError(f"{name} has no candidate")
+        self.set_current(name, version)
+        self.clear_candidate(name)
+        return version
+
+    def _set_pointer(self, name: str, pointer: str, version: str):
+        if not os.path.exists(os.path.join(self._dir(name, version), METADATA_FILE)):
+            raise FileNotFoundError(f"{name} has no version {version}")
+        _atomic_write(os.path.join(self._dir(name), pointer), version.encode())
+
+    def _prune(self, name: str):
+        if self.keep <= 0:
+            return
+        pinned = {self.current_version(name), self.candidate_version(name)}
+        versions = self.versions(name)
+        for meta in versions[:-self.keep]:
+            if meta["version"] not in pinned:
+                shutil.rmtree(self._dir(name, meta["version"]), ignore_errors=True)
+
+    # -- reading ------------------------------------------------------------
+
+    def _read_pointer(self, name: str, pointer: str):
+        try:
+            with open(os.path.join(self._dir(name), pointer)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def current_version(self, name: str):
+        return self._read_pointer(name, POINTER_FILE)
+
+    def candidate_version(self, name: str):
+        return self._read_pointer(name, CANDIDATE_FILE)
+
+    def metadata(self, name: str, version: str) -> dict:
+        with open(os.path.join(self._dir(name, version), METADATA_FILE)) as f:
+            return json.load(f)
+
+    def versions(self, name: str) -> list:
+        """Metadata of every complete version, oldest first."""
+        found = []
+        try:
+            entries = os.listdir(self._dir(name))
+        except FileNotFoundError:
+            return []
+        for entry in entries:
+            if entry.startswith(".") or entry in (POINTER_FILE, CANDIDATE_FILE):
+                continue
+            try:
+                found.append(self.metadata(name, entry))
+            except (OSError, ValueError):
+                continue
+        return sorted(found, key=lambda m: (m.get("createdAt", 0), m["version"]))
+
+    def load(self, name: str, version: str = None, mmap_mode: str = MODEL_MMAP_MODE):
+        """(model, metadata) for a version (default: current); verifies the checksum first."""
+        version = version or self.current_version(name)
+        if version is None:
+            raise FileNotFoundError(f"No published version of {name}")
+        metadata = self.metadata(name, version)
+        artifact = os.path.join(self._dir(name, version), ARTIFACT_FILE)
+        if _sha256(artifact) != metadata["sha256"]:
+            raise ModelIntegrityError(f"{name} {version}: checksum mismatch")
+        return joblib.load(artifact, mmap_mode=mmap_mode), metadata
+
+    def load_current(self, name: str, legacy_path: str = None):
+        """
+        (model, metadata) for the serving version, or None when there is none.
+        A pre-registry file at legacy_path is adopted as the first version.
+        """
+        if self.current_version(name) is None:
+            if not legacy_path or not os.path.exists(legacy_path):
+                return None
+            self.publish_file(name, legacy_path, {"source": f"legacy:{legacy_path}"})
+        return self.load(name)
+
+    # -- hot swap -----------------------------------------------------------
+
+    def watch(self, name: str, callback, version: str = None, candidate: bool = False):
+        """
+        Call callback(model, metadata) whenever CURRENT for name moves off version.
+        Pass the version the caller already serves so it is not reloaded.
+        With candidate=True the CANDIDATE pointer is followed instead, and
+        callback(None, None) is called when it is cleared.
+        """
+        key = f"{name}:candidate" if candidate else name
+        with self._lock:
+            self._watches[key] = {"name": name, "candidate": candidate, "callback": callback,
+                                  "version": version, "error": None}
+
+    def mark_loaded(self, name: str, version: str, candidate: bool = False):
+        """Record a version a component loaded itself, so the watcher does not load it again."""
+        key = f"{name}:candidate" if candidate else name
+        with self._lock:
+            if key in self._watches:
+                self._watches[key]["version"] = version
+
+    def poll(self):
+        """One pass over the watched models; swaps any whose CURRENT changed."""
+        with self._lock:
+            watches = list(self._watches.items())
+        for key, watch in watches:
+            name = watch["name"]
+            version = self.candidate_version(name) if watch["candidate"] else self.current_version(name)
+            if version == watch["version"] or (version is None and not watch["candidate"]):
+                watch["error"] = None
+                continue
+            try:
+                if version is None:
+                    watch["callback"](None, None)
+                else:
+                    model, metadata = self.load(name, version)
+                    watch["callback"](model, metadata)
+                with self._lock:
+                    watch["version"], watch["error"] = version, None
+                print(f"[REGISTRY] Swapped {key} to {version}")
+            except Exception as e:
+                # Keep serving the current model; retry on the next poll
+                if watch["error"] != str(e):
+                    print(f"[REGISTRY] Could not swap {key} to {version}: {e}")
+                with self._lock:
+                    watch["error"] = str(e)
+
+    def _loop(self):
+        while not self._stop.wait(self.poll_seconds):
+            self.poll()
+
+    def start_watcher(self):
+        if self.poll_seconds <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="model-registry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            watches = {name: dict(w) for name, w in self._watches.items()}
+        return {
+            key: {
+                "current": self.candidate_version(w["name"]) if w["candidate"] else self.current_version(w["name"]),
+                "loaded": w["version"],
+                "error": w["error"],
+            }
+            for key, w in watches.items()
+        }
+
+
+# Singleton
+model_registry = ModelRegistry()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect and move model registry pointers.")
+    parser.add_argument("action", choices=["list", "promote", "clear-candidate", "set-current", "set-candidate"])
+    parser.add_argument("name")
+    parser.add_argument("version", nargs="?", help="for set-current (rollback) and set-candidate")
+    args = parser.parse_args()
+
+    if args.action == "list":
+        current, candidate = model_registry.current_version(args.name), model_registry.candidate_version(args.name)
+        for meta in model_registry.versions(args.name):
+            mark = "current" if meta["version"] == current else "candidate" if meta["version"] == candidate else ""
+            print(f"{meta['version']}  {mark}")
+    elif args.action == "promote":
+        print(f"{args.name}: {model_registry.promote_candidate(args.name)} is now current")
+    elif args.action == "clear-candidate":
+        model_registry.clear_candidate(args.name)
+    elif not args.version:
+        parser.error(f"{args.action} needs a version")
+    elif args.action == "set-current":
+        model_registry.set_current(args.name, args.version)
+    else:
+        model_registry.set_candidate(args.name, args.version)
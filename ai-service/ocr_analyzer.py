@@ -4,23 +4,65 @@ Extracts text from receipt/invoice images and runs anomaly checks.
 """
 import re
 import os
-import base64
-from io import BytesIO
-from datetime import datetime
+import threading
+from functools import partial
+import cv2
+import numpy as np
 from visual_forensics import visual_forensics
+from document_image import DocumentImage, DOWNSCALE_MAX_SIDE
+from metrics import timed, set_model_loaded
+from invoice_registry import get_registry
+from ocr_backends import create_backend, OCR_BACKEND
+from ocr_batcher import get_batcher
+from feature_cache import feature_cache
+from stage_graph import Stage, run_stages
+
+# "full" recognizes every text box at full resolution; "roi" recognizes the
+# header and totals bands of a DPI-normalized copy, falling back to the rest
+# of the page when a targeted field is missing
+OCR_MODE = os.getenv("OCR_MODE", "full").lower()
+OCR_TARGET_DPI = float(os.getenv("OCR_TARGET_DPI", 200))
+# Fractions of the page height: boxes centred above the first or below the
+# second are read in roi mode (invoice no./date/vendor/GSTIN and totals)
+ROI_HEADER_BAND = 0.3
+ROI_TOTALS_BAND = 0.6
+
+# The OCR backend (EasyOCR/torch or ONNX Runtime) is imported on first use, not at module import
+READER = None
+_reader_attempted = False
+_reader_lock = threading.Lock()
+
+
+def load_reader() -> bool:
+    """Build the OCR backend once (OCR_BACKEND, falling back to EasyOCR); thread-safe."""
+    global READER, _reader_attempted
+    with _reader_lock:
+        if not _reader_attempted:
+            _reader_attempted = True
+            for name in dict.fromkeys([OCR_BACKEND, "easyocr"]):
+                try:
+                    READER = create_backend(name)
+                    print(f"[OCR] {name} backend initialized successfully")
+                    break
+                except Exception as e:
+                    READER = None
+                    print(f"[OCR] {name} backend not available: {e}")
+            set_model_loaded("easyocr", READER is not None)
+    return READER is not None
+
 
-try:
-    import easyocr
-    READER = easyocr.Reader(['en'], gpu=False, verbose=False)
-    print("[OCR] EasyOCR initialized successfully")
-except Exception as e:
-    READER = None
-    print(f"[OCR] EasyOCR not available: {e}")
+def get_reader():
+    if not _reader_attempted:
+        load_reader()
+    return READER
 
-try:
-    from PIL import Image
-except ImportError:
-    Image = None
+
+def _visual_or_none(doc: DocumentImage):
+    # A failure here is left for analyze_image to hit again and report for this image only
+    try:
+        return visual_forensics.analyze(doc)
+    except Exception:
+        return None
 
 
 class OCRAnalyzer:
@@ -33,22 +75,144 @@ class OCRAnalyzer:
     DATE_PATTERN = re.compile(r'(\d{1,2}[\-/\.]\d{1,2}[\-/\.]\d{2,4})')
     VENDOR_PATTERN = re.compile(r'(?:from|vendor|supplier|company|firm|m/s)[\s:]*([A-Za-z\s&.]+)', re.IGNORECASE)
 
-    def __init__(self):
-        self.seen_invoices = set()
-
-    def extract_text(self, image_path: str) -> str:
+    def extract_text(self, doc: DocumentImage, mode: str = None) -> str:
         """Extract text from image using EasyOCR."""
-        if READER is None:
+        return self.extract_text_with_mode(doc, mode)[0]
+
+    def extract_text_with_mode(self, doc: DocumentImage, mode: str = None):
+        """Returns (text, mode used): "full", "roi", or "roi+full" when roi fell back."""
+        if (mode or OCR_MODE) == "roi":
+            return self._extract_roi(doc)
+        return self._extract_full(doc), "full"
+
+    @timed("ocr_extract_text")
+    def _extract_full(self, doc: DocumentImage) -> str:
+        reader = get_reader()
+        if reader is None or doc.bgr is None:
             return ""
         try:
-            results = READER.readtext(image_path, detail=0)
+            # Same steps as reader.readtext, fed the already-decoded arrays
+            horizontal_list, free_list = reader.detect(doc.rgb)
+            results = self._recognize(reader, doc.gray, horizontal_list[0], free_list[0], detail=0)
             text = "\n".join(results)
-            print(f"[OCR] Extracted {len(text)} chars from {os.path.basename(image_path)}")
+            print(f"[OCR] Extracted {len(text)} chars from {doc.name}")
             return text
         except Exception as e:
             print(f"[OCR] Extraction error: {e}")
             return ""
 
+    def _roi_max_side(self, doc: DocumentImage) -> int:
+        """Longest side after normalizing to OCR_TARGET_DPI (capped at DOWNSCALE_MAX_SIDE)."""
+        h, w = doc.shape[:2]
+        max_side = DOWNSCALE_MAX_SIDE
+        if doc.dpi and doc.dpi > OCR_TARGET_DPI:
+            max_side = min(max_side, int(max(h, w) * OCR_TARGET_DPI / doc.dpi))
+        return max_side
+
+    def _roi_complete(self, text: str) -> bool:
+        """True when the targeted fields were all found in the ROI text."""
+        return all(p.search(text) for p in (self.INVOICE_PATTERN, self.AMOUNT_PATTERN, self.DATE_PATTERN))
+
+    @timed("ocr_extract_roi")
+    def _extract_roi(self, doc: DocumentImage):
+        reader = get_reader()
+        if reader is None or doc.bgr is None:
+            return "", "roi"
+        try:
+            img = doc.downscaled(self._roi_max_side(doc))
+            rgb = np.ascontiguousarray(img[:, :, ::-1])
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+            # Detect once; boxes are [x_min, x_max, y_min, y_max] / 4-point polygons
+            horizontal_list, free_list = reader.detect(rgb)
+            horizontal, free = horizontal_list[0], free_list[0]
+            height = img.shape[0]
+
+            def in_roi(y_center):
+                return y_center <= height * ROI_HEADER_BAND or y_center >= height * ROI_TOTALS_BAND
+
+            roi_h = [b for b in horizontal if in_roi((b[2] + b[3]) / 2)]
+            roi_f = [b for b in free if in_roi(sum(p[1] for p in b) / 4)]
+            results = self._recognize(reader, gray, roi_h, roi_f)
+            text = self._join_reading_order(results)
+            mode = "roi"
+
+            if not self._roi_complete(text):
+                # Fall back to the rest of the page, reusing the detection
+                rest_h = [b for b in horizontal if not in_roi((b[2] + b[3]) / 2)]
+                rest_f = [b for b in free if not in_roi(sum(p[1] for p in b) / 4)]
+                results += self._recognize(reader, gray, rest_h, rest_f)
+                text = self._join_reading_order(results)
+                mode = "roi+full"
+
+            print(f"[OCR] Extracted {len(text)} chars from {doc.name} ({mode}, {len(results)}/"
+                  f"{len(horizontal) + len(free)} boxes, {img.shape[1]}x{height})")
+            return text, mode
+        except Exception as e:
+            print(f"[OCR] ROI extraction error: {e}")
+            return "", "roi"
+
+    @staticmethod
+    def _recognize(reader, gray, horizontal: list, free: list, detail: int = 1) -> list:
+        """reader.recognize, routed through the cross-request batcher when it is enabled."""
+        if not horizontal and not free:
+            return []
+        batcher = get_batcher(reader)
+        if batcher is not None:
+            try:
+                return batcher.recognize(gray, horizontal, free, detail=detail)
+            except Exception as e:
+                print(f"[OCR] Batched recognition failed, recognizing directly: {e}")
+        return reader.recognize(gray, horizontal, free, detail=detail)
+
+    @staticmethod
+    def _join_reading_order(results: list) -> str:
+        # (box, text, confidence); order top-to-bottom, then left-to-right
+        ordered = sorted(results, key=lambda r: (min(p[1] for p in r[0]), min(p[0] for p in r[0])))
+        return "\n".join(r[1] for r in ordered)
+
+    def extract_text_batch(self, docs: list) -> list:
+        """Extract text from many images; see extract_text_batch_with_modes."""
+        return [text for text, _ in self.extract_text_batch_with_modes(docs)]
+
+    def extract_text_batch_with_modes(self, docs: list) -> list:
+        """[(text, mode used), ...] in input order."""
+        if OCR_MODE == "roi":
+            # Each page gets its own DPI-normalized size, so there is no shared detector batch
+            return [self._extract_roi(doc) for doc in docs]
+        return [(text, "full") for text in self._extract_full_batch(docs)]
+
+    @timed("ocr_extract_text_batch")
+    def _extract_full_batch(self, docs: list) -> list:
+        """
+        Run the detector once per group of same-sized images (the same steps
+        as reader.readtext_batched).
+        """
+        texts = [""] * len(docs)
+        reader = get_reader()
+        if reader is None:
+            return texts
+
+        groups = {}
+        for i, doc in enumerate(docs):
+            if doc.bgr is not None:
+                groups.setdefault(doc.shape, []).append(i)
+
+        for indices in groups.values():
+            try:
+                batch = np.stack([docs[i].rgb for i in indices])
+                horizontal_agg, free_agg = reader.detect(batch, reformat=False)
+                for i, horizontal_list, free_list in zip(indices, horizontal_agg, free_agg):
+                    results = self._recognize(reader, docs[i].gray, horizontal_list, free_list, detail=0)
+                    texts[i] = "\n".join(results)
+            except Exception as e:
+                print(f"[OCR] Batch extraction error, falling back to per-image OCR: {e}")
+                for i in indices:
+                    texts[i] = self._extract_full(docs[i])
+
+        print(f"[OCR] Batch extracted text from {len(docs)} images in {len(groups)} detector batches")
+        return texts
+
     def extract_fields(self, text: str) -> dict:
         """Parse structured fields from OCR text."""
         fields = {
@@ -104,8 +268,12 @@ class OCRAnalyzer:
 
         return fields
 
-    def run_anomaly_checks(self, fields: dict, vendor_context: dict = None) -> list:
-        """Run fraud anomaly checks on extracted fields."""
+    def run_anomaly_checks(self, fields: dict, vendor_context: dict = None, check_duplicates: bool = True) -> list:
+        """
+        Run fraud anomaly checks on extracted fields.
+        check_duplicates=False skips the stateful duplicate-invoice check so the
+        result can be cached; apply_duplicate_check() runs it separately.
+        """
         signals = []
         vendor_context = vendor_context or {}
 
@@ -122,11 +290,8 @@ class OCRAnalyzer:
 
         # 2. Duplicate invoice number
         inv_num = fields.get("invoiceNumber")
-        if inv_num:
-            if inv_num in self.seen_invoices:
-                signals.append(f"Duplicate invoice ID detected: {inv_num}")
-            else:
-                self.seen_invoices.add(inv_num)
+        if check_duplicates and self.is_duplicate_invoice(inv_num, fields, vendor_context):
+            signals.append(f"Duplicate invoice ID detected: {inv_num}")
 
         # 3. Invalid GST format
         gst = fields.get("gstNumber")
@@ -165,14 +330,68 @@ class OCRAnalyzer:
         return signals
 
 
-    def analyze_image(self, image_path: str, vendor_context: dict = None, query: str = "") -> dict:
-        """Full pipeline: OCR → extract → anomaly check → visual forensics → structured result."""
+    def is_duplicate_invoice(self, inv_num, fields: dict = None, vendor_context: dict = None) -> bool:
+        """
+        Check the invoice number against the shared invoice registry, registering
+        it if new. Scoped by the expected vendor, else the name read off the document.
+        """
+        supplier = (vendor_context or {}).get("name") or (fields or {}).get("vendorName")
+        return get_registry().check_and_register(inv_num, supplier, source="document")
+
+    def apply_duplicate_check(self, result: dict, vendor_context: dict = None) -> dict:
+        """
+        Run the stateful duplicate-invoice check on a finished (possibly cached)
+        result. Heuristic scores get the same +15 the inline check would add;
+        ML-scored results only gain the signal, as before.
+        """
+        if result.get("status") == "ERROR":
+            return result
+        fields = result.get("extractedFields") or {}
+        inv_num = fields.get("invoiceNumber")
+        if not self.is_duplicate_invoice(inv_num, fields, vendor_context):
+            return result
+
+        result["fraudSignals"].insert(0, f"Duplicate invoice ID detected: {inv_num}")
+        if not (result.get("modelMetadata") or {}).get("used"):
+            result["riskScore"] = min(100, result["riskScore"] + 15)
+            result["status"], result["confidence"] = self._status_for(result["riskScore"])
+        return result
+
+    @staticmethod
+    def _status_for(risk_score: int):
+        if risk_score >= 60:
+            return "FLAGGED", "High"
+        if risk_score >= 30:
+            return "REVIEW", "Medium"
+        return "SAFE", "High"
+
+    def analyze_image(self, doc: DocumentImage, vendor_context: dict = None, query: str = "",
+                      text: str = None, check_duplicates: bool = True, ocr_mode: str = None,
+                      cached: dict = None, visual: dict = None) -> dict:
+        """
+        Full pipeline: OCR → extract → anomaly check → visual forensics → structured result.
+        OCR text, fields and visual results come from the feature cache when this
+        image was analyzed before (cached= passes an entry the caller already fetched).
+        Visual forensics and OCR run concurrently on the stage pool.
+        """
         try:
-            # Step 1: Visual Forensics (Parallelizable)
-            vf_result = visual_forensics.analyze(image_path)
-            
-            # Step 2: OCR
-            text = self.extract_text(image_path)
+            if cached is None:
+                cached = feature_cache.get(doc.content_hash)
+            if cached is not None:
+                vf_result, text, ocr_mode = cached["visual"], cached["text"], cached["ocrMode"]
+            else:
+                # Steps 1 & 2: Visual Forensics and OCR are independent, so they run side by side
+                # (either is skipped when the caller already computed it)
+                stages = []
+                if visual is None:
+                    stages.append(Stage("visual", lambda: visual_forensics.analyze(doc)))
+                if text is None:
+                    # No timeout: slow scans and the first call's lazy EasyOCR load must still finish
+                    stages.append(Stage("ocr", lambda: self.extract_text_with_mode(doc), timeout=0))
+                outcome = run_stages(stages)
+                vf_result = outcome["visual"] if visual is None else visual
+                if text is None:
+                    text, ocr_mode = outcome["ocr"]
             if not text:
                 return {
                     "status": "ERROR",
@@ -181,14 +400,19 @@ class OCRAnalyzer:
                     "extractedFields": {},
                     "visualForensics": vf_result,
                     "confidence": "Low",
+                    "ocrMode": ocr_mode,
                     "message": "Unable to process image. The image may be too blurry or not a document."
                 }
 
             # Step 3: Extract fields
-            fields = self.extract_fields(text)
+            if cached is not None:
+                fields = cached["fields"]
+            else:
+                fields = self.extract_fields(text)
+                feature_cache.put(doc.content_hash, text, ocr_mode, fields, vf_result)
 
             # Step 4: Run textual anomaly checks
-            signals = self.run_anomaly_checks(fields, vendor_context)
+            signals = self.run_anomaly_checks(fields, vendor_context, check_duplicates)
 
             # Step 5: Merge Visual Signals & Scoring
             risk_score = min(100, len(signals) * 15)
@@ -220,15 +444,7 @@ class OCRAnalyzer:
 
             # Determine status
             risk_score = min(100, risk_score)
-            if risk_score >= 60:
-                status = "FLAGGED"
-                confidence = "High"
-            elif risk_score >= 30:
-                status = "REVIEW"
-                confidence = "Medium"
-            else:
-                status = "SAFE"
-                confidence = "High"
+            status, confidence = self._status_for(risk_score)
 
             return {
                 "status": status,
@@ -243,7 +459,8 @@ class OCRAnalyzer:
                 },
                 "visualForensics": vf_result,
                 "confidence": confidence,
-                "ocrTextLength": len(text)
+                "ocrTextLength": len(text),
+                "ocrMode": ocr_mode
             }
 
         except Exception as e:
@@ -257,31 +474,33 @@ class OCRAnalyzer:
                 "message": f"Unable to process image: {str(e)}"
             }
 
+    def analyze_images(self, docs: list, vendor_contexts: list = None, check_duplicates: bool = True) -> list:
+        """Analyze many images with one batched OCR pass; results are in input order."""
+        vendor_contexts = vendor_contexts or [None] * len(docs)
+        entries = [feature_cache.get(doc.content_hash) for doc in docs]
+        # Only images missing from the feature cache go through OCR
+        missing = [i for i, entry in enumerate(entries) if entry is None]
+        texts = [(None, None)] * len(docs)
+        visuals = [None] * len(docs)
+        if missing:
+            # Visual forensics for every image overlaps the batched OCR pass; the batch has no timeout
+            stages = [Stage("ocr", lambda: self.extract_text_batch_with_modes([docs[i] for i in missing]), timeout=0)]
+            stages += [Stage(f"visual:{i}", partial(_visual_or_none, docs[i]), default=None) for i in missing]
+            outcome = run_stages(stages)
+            for i, extracted in zip(missing, outcome["ocr"]):
+                texts[i] = extracted
+                visuals[i] = outcome[f"visual:{i}"]
+        return [
+            self.analyze_image(doc, ctx, text=text, check_duplicates=check_duplicates, ocr_mode=mode, cached=entry,
+                               visual=vf)
+            for doc, ctx, (text, mode), entry, vf in zip(docs, vendor_contexts, texts, entries, visuals)
+        ]
+
     def analyze_base64(self, image_base64: str, vendor_context: dict = None, query: str = "") -> dict:
         """Analyze a base64-encoded image."""
         try:
-            # Strip data URI prefix if present
-            if "," in image_base64:
-                image_base64 = image_base64.split(",", 1)[1]
-
-            img_bytes = base64.b64decode(image_base64)
-            temp_path = f"temp/ocr_{datetime.now().strftime('%Y%m%d%H%M%S')}.png"
-            os.makedirs("temp", exist_ok=True)
-
-            if Image:
-                img = Image.open(BytesIO(img_bytes))
-                img.save(temp_path)
-            else:
-                with open(temp_path, "wb") as f:
-                    f.write(img_bytes)
-
-            result = self.analyze_image(temp_path, vendor_context, query)
-
-            # Cleanup
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-
-            return result
+            doc = DocumentImage.from_base64(image_base64)
+            return self.analyze_image(doc, vendor_context, query)
 
         except Exception as e:
             return {
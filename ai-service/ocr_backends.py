@@ -0,0 +1,140 @@
+"""
+Pluggable OCR backends behind OCRAnalyzer.
+Every backend exposes EasyOCR's lower-level detect()/recognize() API, so the
+analyzer's full-page, batched and ROI paths work unchanged:
+
+- "easyocr": the PyTorch reference implementation.
+- "onnx":    the same CRAFT detector and recognition networks exported to
+             ONNX (training/export_ocr_onnx.py), optionally int8-quantized,
+             run by ONNX Runtime. EasyOCR still does the pre/post-processing;
+             only the two networks are swapped out.
+"""
+import os
+
+OCR_BACKEND = os.getenv("OCR_BACKEND", "easyocr").lower()
+OCR_LANGS = ["en"]
+ONNX_MODEL_DIR = os.getenv("OCR_ONNX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "onnx"))
+ONNX_QUANTIZED = os.getenv("OCR_ONNX_QUANTIZED", "true").lower() == "true"
+ONNX_THREADS = int(os.getenv("OCR_ONNX_THREADS", 0))  # 0 lets ONNX Runtime decide
+
+DETECTOR_FILE = "craft"
+RECOGNIZER_FILE = "recognizer"
+
+
+class OCRBackend:
+    """detect()/recognize() with EasyOCR's signatures; subclasses build self.reader."""
+    name = "base"
+
+    def __init__(self):
+        self.reader = None
+
+    def load(self):
+        raise NotImplementedError
+
+    def detect(self, img, **kwargs):
+        return self.reader.detect(img, **kwargs)
+
+    def recognize(self, gray, horizontal_list=None, free_list=None, **kwargs):
+        return self.reader.recognize(gray, horizontal_list, free_list, **kwargs)
+
+
+class EasyOCRBackend(OCRBackend):
+    name = "easyocr"
+
+    def load(self):
+        import easyocr
+        self.reader = easyocr.Reader(OCR_LANGS, gpu=False, verbose=False)
+        return self
+
+
+class _OrtDetector:
+    """Stands in for the CRAFT torch module inside easyocr.detection.test_net."""
+
+    def __init__(self, session):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+
+    def __call__(self, x):
+        import torch
+        y, feature = self.session.run(None, {self.input_name: x.cpu().numpy()})
+        return torch.from_numpy(y), torch.from_numpy(feature)
+
+    def eval(self):
+        return self
+
+
+class _OrtRecognizer:
+    """Stands in for the recognition torch module inside easyocr.recognition.recognizer_predict."""
+
+    def __init__(self, session):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+
+    def __call__(self, image, text=None):
+        # CTC model: the text argument is unused at inference time
+        import torch
+        return torch.from_numpy(self.session.run(None, {self.input_name: image.cpu().numpy()})[0])
+
+    def eval(self):
+        return self
+
+
+def onnx_model_path(base: str, quantized: bool = ONNX_QUANTIZED, model_dir: str = ONNX_MODEL_DIR) -> str:
+    """Prefer <base>.int8.onnx when quantization is on and the file exists."""
+    if quantized:
+        path = os.path.join(model_dir, f"{base}.int8.onnx")
+        if os.path.exists(path):
+            return path
+    return os.path.join(model_dir, f"{base}.onnx")
+
+
+class ONNXBackend(OCRBackend):
+    name = "onnx"
+
+    def __init__(self, model_dir: str = ONNX_MODEL_DIR, quantized: bool = ONNX_QUANTIZED,
+                 threads: int = ONNX_THREADS):
+        super().__init__()
+        self.model_dir = model_dir
+        self.quantized = quantized
+        self.threads = threads
+        self.model_files = {}
+
+    def _session(self, base: str):
+        import onnxruntime as ort
+        path = onnx_model_path(base, self.quantized, self.model_dir)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found; run training/export_ocr_onnx.py")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+        self.model_files[base] = os.path.basename(path)
+        return ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def load(self):
+        import easyocr
+        from easyocr import detection
+        detector = _OrtDetector(self._session(DETECTOR_FILE))
+        recognizer = _OrtRecognizer(self._session(RECOGNIZER_FILE))
+
+        # detector=False skips loading the CRAFT weights; the recognizer is still
+        # built for its converter/charset, then its torch weights are dropped
+        self.reader = easyocr.Reader(OCR_LANGS, gpu=False, verbose=False, detector=False, quantize=False)
+        self.reader.get_textbox = getattr(self.reader, "get_textbox", detection.get_textbox)
+        self.reader.detector = detector
+        self.reader.recognizer = recognizer
+        print(f"[OCR] ONNX Runtime backend using {self.model_files}")
+        return self
+
+
+BACKENDS = {
+    EasyOCRBackend.name: EasyOCRBackend,
+    ONNXBackend.name: ONNXBackend,
+}
+
+
+def create_backend(name: str = OCR_BACKEND) -> OCRBackend:
+    """Instantiate and load a backend by name. Raises on unknown names or load failure."""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown OCR backend '{name}' (expected one of {sorted(BACKENDS)})")
+    return BACKENDS[name]().load()
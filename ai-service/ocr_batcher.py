@@ -0,0 +1,164 @@
+"""
+Cross-request micro-batching for OCR text recognition.
+On CPU, EasyOCR's recognize() runs the recognizer on one text crop at a
+time. The batcher collects crops from concurrent requests for up to
+OCR_BATCH_WINDOW_MS (or until OCR_BATCH_MAX crops are waiting), runs them
+through the recognizer together, and hands each request its own results.
+Crops are grouped by padded width, the same width the per-crop path pads
+to, so the recognized text matches the unbatched path.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from metrics import OCR_BATCH_FILL, OCR_BATCH_QUEUE_DELAY
+
+OCR_BATCH_WINDOW_MS = float(os.getenv("OCR_BATCH_WINDOW_MS", 0))  # 0 disables batching
+OCR_BATCH_MAX = int(os.getenv("OCR_BATCH_MAX", 64))
+
+# easyocr's recognize() defaults
+CONTRAST_THS = 0.1
+ADJUST_CONTRAST = 0.5
+FILTER_THS = 0.003
+
+
+class _Pending:
+    __slots__ = ("crops", "future", "submitted_at")
+
+    def __init__(self, crops):
+        self.crops = crops
+        self.future = Future()
+        self.submitted_at = time.perf_counter()
+
+
+class RecognitionBatcher:
+    def __init__(self, reader, window_ms: float = OCR_BATCH_WINDOW_MS, max_batch: int = OCR_BATCH_MAX):
+        from easyocr import utils
+        self._utils = utils
+        try:
+            from easyocr.config import imgH
+        except ImportError:
+            imgH = 64
+        self.imgH = imgH
+        self.reader = reader  # the underlying easyocr.Reader
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.ignore_char = "".join(set(reader.character) - set(reader.lang_char))
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._stop = False
+        self.stats = {"batches": 0, "crops": 0, "requests": 0, "avgFill": 0.0, "avgQueueDelayMs": 0.0}
+        self._thread = threading.Thread(target=self._loop, name="ocr-batcher", daemon=True)
+        self._thread.start()
+
+    def recognize(self, gray, horizontal_list: list, free_list: list, detail: int = 1) -> list:
+        """Drop-in for reader.recognize(gray, horizontal_list, free_list, detail=...) on CPU."""
+        # (crop, padded width) in the same order as easyocr's one-crop-at-a-time CPU path
+        crops = []
+        for h_list, f_list in [([box], []) for box in horizontal_list] + [([], [box]) for box in free_list]:
+            image_list, max_width = self._utils.get_image_list(h_list, f_list, gray, model_height=self.imgH)
+            crops += [(crop, int(max_width)) for crop in image_list]
+        if not crops:
+            return []
+
+        pending = _Pending(crops)
+        with self._cond:
+            self._queue.append(pending)
+            self._cond.notify()
+        result = pending.future.result()
+        return [item[1] for item in result] if detail == 0 else result
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stop:
+                    self._cond.wait()
+                if self._stop:
+                    while self._queue:
+                        self._queue.popleft().future.set_exception(RuntimeError("OCR batcher stopped"))
+                    return
+                # Hold the window open from the first arrival, unless the batch fills up
+                deadline = self._queue[0].submitted_at + self.window
+                while not self._stop and sum(len(p.crops) for p in self._queue) < self.max_batch:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, size = [], 0
+                while self._queue and (not batch or size + len(self._queue[0].crops) <= self.max_batch):
+                    p = self._queue.popleft()
+                    batch.append(p)
+                    size += len(p.crops)
+            self._flush(batch, size)
+
+    def _flush(self, batch: list, size: int):
+        started = time.perf_counter()
+        delays = [started - p.submitted_at for p in batch]
+        for delay in delays:
+            OCR_BATCH_QUEUE_DELAY.observe(delay)
+        OCR_BATCH_FILL.observe(size / self.max_batch)
+
+        try:
+            # Pad each crop to the width it gets when recognized on its own
+            buckets = {}
+            for i, p in enumerate(batch):
+                for j, (crop, max_width) in enumerate(p.crops):
+                    buckets.setdefault(max_width, []).append((i, j, crop))
+
+            results = [[None] * len(p.crops) for p in batch]
+            for max_width, items in buckets.items():
+                out = self._utils.get_text(
+                    self.reader.character, self.imgH, max_width,
+                    self.reader.recognizer, self.reader.converter, [c for _, _, c in items],
+                    self.ignore_char, "greedy", 5, len(items),
+                    CONTRAST_THS, ADJUST_CONTRAST, FILTER_THS, 0, self.reader.device,
+                )
+                for (i, j, _), item in zip(items, out):
+                    results[i][j] = item
+            for p, result in zip(batch, results):
+                p.future.set_result(result)
+        except Exception as e:
+            for p in batch:
+                p.future.set_exception(e)
+
+        with self._cond:
+            n = self.stats["batches"]
+            self.stats["batches"] = n + 1
+            self.stats["crops"] += size
+            self.stats["requests"] += len(batch)
+            self.stats["avgFill"] = round((self.stats["avgFill"] * n + size / self.max_batch) / (n + 1), 4)
+            self.stats["avgQueueDelayMs"] = round(
+                (self.stats["avgQueueDelayMs"] * n + 1000 * sum(delays) / len(delays)) / (n + 1), 3)
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            queued = sum(len(p.crops) for p in self._queue)
+        return dict(self.stats, queuedCrops=queued, windowMs=self.window * 1000, maxBatch=self.max_batch)
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher(backend):
+    """The process-wide batcher for this OCR backend, or None when batching is off."""
+    global _batcher
+    if OCR_BATCH_WINDOW_MS <= 0 or backend is None:
+        return None
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = RecognitionBatcher(backend.reader)
+    return _batcher
+
+
+def batcher_stats() -> dict:
+    """Stats for the metrics collector; empty until the batcher has been created."""
+    return {"ocr": _batcher.snapshot()} if _batcher is not None else {}
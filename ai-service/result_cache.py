@@ -0,0 +1,139 @@
+"""
+Content-addressed cache of document analysis results.
+Keyed by image content hash + model version + the vendorContext fields
+the analysis reads, with LRU eviction, a TTL and an optional SQLite tier
+that survives restarts.
+"""
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 1024))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", 3600))
+RESULT_CACHE_DISK_PATH = os.getenv("RESULT_CACHE_DISK_PATH", "")  # empty disables the disk tier
+
+# vendorContext fields that change the analysis output
+CONTEXT_FIELDS = ("bidAmount", "projectBudget", "name")
+# Bump when the cached result format or the analysis logic changes
+CACHE_SCHEMA = 1
+
+
+class ResultCache:
+    def __init__(self, max_entries: int = RESULT_CACHE_SIZE, ttl: float = RESULT_CACHE_TTL,
+                 disk_path: str = RESULT_CACHE_DISK_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self._entries = OrderedDict()  # key -> (stored_at, result)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "diskHits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+        if self.disk_path:
+            self._init_disk()
+
+    @staticmethod
+    def make_key(content_hash: str, model_version: str, vendor_context: dict = None) -> str:
+        context = {k: (vendor_context or {}).get(k) for k in CONTEXT_FIELDS}
+        raw = json.dumps([CACHE_SCHEMA, content_hash, model_version, context], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key: str):
+        """Return a private copy of the cached result, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return copy.deepcopy(entry[1])
+                del self._entries[key]
+
+        stored_at, result = self._disk_get(key, now)
+        with self._lock:
+            if result is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["diskHits"] += 1
+            self._store(key, result, stored_at)
+        return copy.deepcopy(result)
+
+    def put(self, key: str, result: dict):
+        result = copy.deepcopy(result)
+        now = time.time()
+        with self._lock:
+            self._store(key, result, now)
+        self._disk_put(key, result, now)
+
+    def _store(self, key, result, stored_at):
+        self._entries[key] = (stored_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self):
+        """Drop every entry, e.g. after a model is hot-swapped."""
+        with self._lock:
+            self._entries.clear()
+            self.stats["invalidations"] += 1
+        if self.disk_path:
+            with self._db() as conn:
+                conn.execute("DELETE FROM results")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+        stats["maxEntries"] = self.max_entries
+        return stats
+
+    # --- Disk tier ---
+
+    def _db(self):
+        return closing(sqlite3.connect(self.disk_path, timeout=10, isolation_level=None))
+
+    def _init_disk(self):
+        directory = os.path.dirname(self.disk_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._db() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, stored_at REAL NOT NULL, result TEXT NOT NULL)"
+            )
+            conn.execute("DELETE FROM results WHERE stored_at < ?", (time.time() - self.ttl,))
+
+    def _disk_get(self, key: str, now: float):
+        if not self.disk_path:
+            return None, None
+        try:
+            with self._db() as conn:
+                row = conn.execute(
+                    "SELECT stored_at, result FROM results WHERE key = ? AND stored_at >= ?", (key, now - self.ttl)
+                ).fetchone()
+            return (row[0], json.loads(row[1])) if row else (None, None)
+        except Exception as e:
+            print(f"[CACHE] Disk read failed: {e}")
+            return None, None
+
+    def _disk_put(self, key: str, result: dict, now: float):
+        if not self.disk_path:
+            return
+        try:
+            with self._db() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO results (key, stored_at, result) VALUES (?, ?, ?)",
+                    (key, now, json.dumps(result, default=str)),
+                )
+        except Exception as e:
+            print(f"[CACHE] Disk write failed: {e}")
+
+
+# Singleton
+result_cache = ResultCache()
@@ -1,15 +1,19 @@
 import pandas as pd
 from sklearn.ensemble import IsolationForest
-import joblib
 import logging
 import os
+import sys
 """
 AI Retraining Pipeline
 Schedule this script to run weekly (e.g. via cron) to update the machine learning model
 based on verified invoice data.
 """
 
-MODEL_PATH = "model.joblib"
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from model_registry import model_registry
+
+REGISTRY_NAME = "amount_anomaly"
 DATA_PATH = "verified_invoices.csv" # Mock: in prod, fetch from DB
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -46,9 +50,11 @@ def retrain_model():
     model = IsolationForest(contamination=0.01, random_state=42)
     model.fit(df[['amount']])
     
-    # Save Model
-    joblib.dump(model, MODEL_PATH)
-    logging.info(f"Model successfully retrained and saved to {MODEL_PATH}")
+    # Publish Model; running workers swap it in on their next registry poll
+    version = model_registry.publish(REGISTRY_NAME, model, {
+        "samples": len(df), "contamination": 0.01, "source": "retrain.py"
+    })
+    logging.info(f"Model successfully retrained and published as {REGISTRY_NAME} {version}")
     logging.info(f"Training Data Size: {len(df)} records")
 
 if __name__ == "__main__":
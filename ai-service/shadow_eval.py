@@ -0,0 +1,231 @@
+"""
+Shadow and canary evaluation of a candidate fraud model against the serving one.
+
+The candidate is the version named by the registry's CANDIDATE pointer
+(published with `training/train_models.py --candidate`). After a document is
+scored, MLFraudEngine hands its feature vector to submit(), which only
+enqueues it; a background thread scores it with the other model and appends
+one compact JSON line per document to SHADOW_LOG_PATH:
+    {"ts", "doc", "arm", "primary", "candidate", "pScore", "cScore",
+     "delta", "agree", "servedMs", "shadowMs"}
+delta is cScore - pScore and agree compares the SAFE/REVIEW/FLAGGED status.
+
+CANARY_PERCENT of documents are served by the candidate instead, with the
+serving model shadowing them (arm "canary"). The split is by content hash,
+so a document always lands on the same arm. Shadow work is dropped, never
+waited for: when the queue is full, when SHADOW_SAMPLE_PERCENT excludes the
+document, or when the pressure check reports the request pools backlogged.
+"""
+import json
+import os
+import queue
+import threading
+import time
+
+SHADOW_QUEUE_SIZE = int(os.getenv("SHADOW_QUEUE_SIZE", 256))
+SHADOW_SAMPLE_PERCENT = float(os.getenv("SHADOW_SAMPLE_PERCENT", 100))
+CANARY_PERCENT = float(os.getenv("CANARY_PERCENT", 0))
+SHADOW_LOG_PATH = os.getenv(
+    "SHADOW_LOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "shadow_eval.jsonl")
+)
+SHADOW_LOG_MAX_BYTES = int(os.getenv("SHADOW_LOG_MAX_BYTES", 64 * 1024 * 1024))  # then rotated to .1
+
+# Items drained per wake-up; the log is flushed once per drain
+DRAIN_MAX = 64
+
+
+def status_for(score: int) -> str:
+    """Same thresholds as MLFraudEngine._apply_prediction."""
+    if score >= 80:
+        return "FLAGGED"
+    if score >= 40:
+        return "REVIEW"
+    return "SAFE"
+
+
+def _bucket(content_hash: str, offset: int) -> float:
+    # Independent 0-100 buckets from different slices of the sha256 hex digest
+    return int(content_hash[offset:offset + 8], 16) % 10000 / 100
+
+
+class ShadowEvaluator:
+    def __init__(self, queue_size: int = SHADOW_QUEUE_SIZE, sample_percent: float = SHADOW_SAMPLE_PERCENT,
+                 canary_percent: float = CANARY_PERCENT, log_path: str = SHADOW_LOG_PATH,
+                 log_max_bytes: int = SHADOW_LOG_MAX_BYTES):
+        self.queue_size = queue_size
+        self.sample_percent = sample_percent
+        self.canary_percent = canary_percent
+        self.log_path = log_path
+        self.log_max_bytes = log_max_bytes
+        self._candidate = None  # (predict_proba, version)
+        self._pressure = None
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.stats = {"submitted": 0, "evaluated": 0, "canary": 0, "agreements": 0, "errors": 0,
+                      "shedQueueFull": 0, "shedSampled": 0, "shedPressure": 0}
+        self._abs_delta = 0
+        self._shadow_seconds = 0.0
+
+    # -- configuration ------------------------------------------------------
+
+    def set_candidate(self, predict_proba, version: str = None):
+        """Start comparing against a candidate (predict_proba(X) -> [[p_safe, p_fraud]]); None stops."""
+        with self._lock:
+            self._candidate = (predict_proba, version) if predict_proba is not None else None
+            self._reset_stats()
+
+    def candidate_version(self):
+        candidate = self._candidate
+        return candidate[1] if candidate else None
+
+    def set_pressure_check(self, check):
+        """check() -> True when the service is under load and shadow work should be shed."""
+        self._pressure = check
+
+    # -- request path -------------------------------------------------------
+
+    def route(self, content_hash: str):
+        """(predict_proba, version) of the candidate when this document is canary traffic, else None."""
+        candidate = self._candidate
+        if candidate is None or self.canary_percent <= 0 or not content_hash:
+            return None
+        return candidate if _bucket(content_hash, 0) < self.canary_percent else None
+
+    def submit(self, features, content_hash: str, served_prob: float, served_ms: float,
+               primary, primary_version: str, canary: bool = False):
+        """
+        Queue one served document for comparison; never blocks.
+        primary is the serving model's predict_proba; for canary documents it
+        is the model that shadows, otherwise the candidate does.
+        """
+        candidate = self._candidate
+        if candidate is None:
+            return
+        self.stats["submitted"] += 1
+        if content_hash and _bucket(content_hash, 8) >= self.sample_percent:
+            self.stats["shedSampled"] += 1
+            return
+        pressure = self._pressure
+        if pressure is not None and pressure():
+            self.stats["shedPressure"] += 1
+            return
+        if canary:
+            item = (primary, features, content_hash, "canary", primary_version, candidate[1], served_prob, served_ms)
+        else:
+            item = (candidate[0], features, content_hash, "shadow", primary_version, candidate[1], served_prob,
+                    served_ms)
+        try:
+            self._ensure_thread().put_nowait(item)
+        except queue.Full:
+            self.stats["shedQueueFull"] += 1
+
+    # -- background scoring -------------------------------------------------
+
+    def _ensure_thread(self) -> queue.Queue:
+        # Started on first use and again after a fork, where the parent's thread does not exist
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self.queue_size)
+                    self._thread = threading.Thread(target=self._loop, name="shadow-eval", daemon=True)
+                    self._thread.start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    def _loop(self):
+        q = self._queue
+        while not self._stop.is_set():
+            try:
+                items = [q.get(timeout=1)]
+            except queue.Empty:
+                continue
+            while len(items) < DRAIN_MAX:
+                try:
+                    items.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            lines = [line for line in map(self._evaluate, items) if line]
+            if lines:
+                self._write(lines)
+
+    def _evaluate(self, item):
+        predict_proba, features, content_hash, arm, primary_version, candidate_version, served_prob, served_ms = item
+        try:
+            start = time.perf_counter()
+            shadow_prob = float(predict_proba(features.reshape(1, -1))[0][1])
+            shadow_seconds = time.perf_counter() - start
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"[SHADOW] Scoring failed: {e}")
+            return None
+
+        # Scores as MLFraudEngine reports them
+        served_score, shadow_score = int(served_prob * 100), int(shadow_prob * 100)
+        if arm == "canary":
+            p_score, c_score = shadow_score, served_score
+        else:
+            p_score, c_score = served_score, shadow_score
+        agree = status_for(p_score) == status_for(c_score)
+
+        with self._lock:
+            if candidate_version != self.candidate_version():
+                return None  # candidate changed while queued; stats were reset
+            self.stats["evaluated"] += 1
+            self.stats["canary"] += arm == "canary"
+            self.stats["agreements"] += agree
+            self._abs_delta += abs(c_score - p_score)
+            self._shadow_seconds += shadow_seconds
+
+        return json.dumps({
+            "ts": round(time.time(), 3),
+            "doc": (content_hash or "")[:16],
+            "arm": arm,
+            "primary": primary_version,
+            "candidate": candidate_version,
+            "pScore": p_score,
+            "cScore": c_score,
+            "delta": c_score - p_score,
+            "agree": agree,
+            "servedMs": round(served_ms, 3),
+            "shadowMs": round(shadow_seconds * 1000, 3),
+        }, separators=(",", ":"))
+
+    def _write(self, lines: list):
+        try:
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+            if self.log_max_bytes > 0 and os.path.exists(self.log_path) \
+                    and os.path.getsize(self.log_path) >= self.log_max_bytes:
+                os.replace(self.log_path, self.log_path + ".1")
+            # One append per drain; O_APPEND keeps lines from several workers whole
+            with open(self.log_path, "a") as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError as e:
+            print(f"[SHADOW] Could not write {self.log_path}: {e}")
+
+    def stop(self):
+        self._stop.set()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            evaluated = stats["evaluated"]
+            return {
+                "candidate": self.candidate_version(),
+                "canaryPercent": self.canary_percent,
+                "samplePercent": self.sample_percent,
+                "queueDepth": self._queue.qsize() if self._queue is not None else 0,
+                **stats,
+                "agreementRate": round(stats["agreements"] / evaluated, 4) if evaluated else None,
+                "meanAbsDelta": round(self._abs_delta / evaluated, 3) if evaluated else None,
+                "shadowMsMean": round(self._shadow_seconds / evaluated * 1000, 3) if evaluated else None,
+            }
+
+
+# Singleton
+shadow_evaluator = ShadowEvaluator()
@@ -0,0 +1,256 @@
+"""
+Concurrent execution of independent analysis stages.
+
+A StageGraph is a small DAG of Stages: each names the earlier stages whose
+results it needs (after=) and receives them as positional arguments. Every
+stage whose inputs are ready is submitted to one shared "stages" thread pool,
+so a request costs roughly its slowest chain of stages rather than the sum.
+OpenCV, PIL, SQLite and EasyOCR release the GIL for their heavy work.
+
+run() returns results keyed by stage name in declaration order, whatever
+order the stages finished in; when stages fail, the error of the earliest
+declared one is raised, as the sequential code would have raised it.
+A stage's timeout counts from when it starts running, not from when it was
+queued. One still running after its timeout is abandoned: its default is
+used when it has one, otherwise StageTimeoutError is raised. Python threads
+cannot be stopped, so an abandoned stage keeps its worker until it returns;
+give stages that are slow by nature (OCR) timeout=0 rather than a default.
+
+run(stop_when=) short-circuits a graph: stop_when(results) is called with
+the results so far before each round of scheduling, and once it returns True
+the graph stops waiting on stoppable stages. Those not yet started are
+skipped; running ones are abandoned ("stopped") as on a timeout. Stages
+declared stoppable=False are still run and awaited.
+
+Graphs run inline, one stage after another, when called from a stage
+thread (so stages can never wait on their own pool), when the pool is
+already saturated, or when there is only one stage. Timeouts are not
+enforced inline.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+STAGE_WORKERS = int(os.getenv("STAGE_WORKERS", min(16, 2 * (os.cpu_count() or 2))))
+STAGE_TIMEOUT = float(os.getenv("STAGE_TIMEOUT", 30))  # seconds; 0 disables
+
+_NO_DEFAULT = object()
+# How often a graph checks whether its queued stages have started (their deadlines start then)
+_START_POLL_SECONDS = 0.05
+
+
+class StageTimeoutError(Exception):
+    """A stage without a default did not finish within its timeout."""
+
+
+class Stage:
+    def __init__(self, name: str, fn, after: tuple = (), timeout: float = None, default=_NO_DEFAULT,
+                 stoppable: bool = True):
+        self.name = name
+        self.fn = fn
+        self.after = tuple(after)
+        self.timeout = STAGE_TIMEOUT if timeout is None else timeout
+        self.default = default
+        self.stoppable = stoppable
+
+
+class _StagePool:
+    """The shared pool, created on first use so forked workers each get their own threads."""
+
+    def __init__(self, workers: int = STAGE_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.stats = {"graphs": 0, "inlineGraphs": 0, "stages": 0, "inFlight": 0, "timedOut": 0, "failed": 0,
+                      "stopped": 0}
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="stage",
+                                                        initializer=self._mark_stage_thread)
+        return self._executor
+
+    def _mark_stage_thread(self):
+        self._local.stage_thread = True
+
+    def in_stage_thread(self) -> bool:
+        return getattr(self._local, "stage_thread", False)
+
+    def saturated(self) -> bool:
+        return self.stats["inFlight"] >= self.workers
+
+    def submit(self, fn, *args):
+        with self._lock:
+            self.stats["inFlight"] += 1
+            self.stats["stages"] += 1
+        future = self._get_executor().submit(fn, *args)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self.stats["inFlight"] -= 1
+
+    def count(self, key: str, n: int = 1):
+        with self._lock:
+            self.stats[key] += n
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.stats, workers=self.workers)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_pool = _StagePool()
+
+
+def stage_stats() -> dict:
+    return _pool.snapshot()
+
+
+def shutdown():
+    _pool.shutdown()
+
+
+def _call(fn, args: tuple, started: dict, name: str):
+    started[name] = time.monotonic()
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+class StageGraph:
+    def __init__(self, stages: list):
+        names = set()
+        for stage in stages:
+            missing = [dep for dep in stage.after if dep not in names]
+            if missing:
+                raise ValueError(f"Stage {stage.name} depends on {missing}, which must be declared before it")
+            if stage.name in names:
+                raise ValueError(f"Duplicate stage {stage.name}")
+            names.add(stage.name)
+        self.stages = list(stages)
+        # name -> "ok" | "timeout" | "error" | "skipped" | "stopped", and seconds spent (None if abandoned)
+        self.status = {}
+        self.timings = {}
+
+    def run(self, stop_when=None) -> dict:
+        if len(self.stages) <= 1 or _pool.in_stage_thread() or _pool.saturated():
+            _pool.count("inlineGraphs")
+            return self._run_inline(stop_when)
+        _pool.count("graphs")
+        return self._run_concurrent(stop_when)
+
+    def _run_inline(self, stop_when) -> dict:
+        results, stopped = {}, False
+        for stage in self.stages:
+            if stage.stoppable and (stopped or (stop_when is not None and stop_when(results))):
+                stopped = True
+                self.status[stage.name] = "skipped"
+                _pool.count("stopped")
+                continue
+            if any(dep not in results for dep in stage.after):
+                # An input was stopped; the stage cannot run
+                self.status[stage.name] = "skipped"
+                continue
+            start = time.perf_counter()
+            try:
+                results[stage.name] = stage.fn(*(results[dep] for dep in stage.after))
+            except Exception:
+                self.status[stage.name] = "error"
+                _pool.count("failed")
+                raise
+            finally:
+                self.timings[stage.name] = time.perf_counter() - start
+            self.status[stage.name] = "ok"
+        return results
+
+    def _stop(self, pending: list, running: dict):
+        """stop_when fired: drop the stoppable stages. Queued ones are cancelled, started ones are abandoned."""
+        for stage in [stage for stage in pending if stage.stoppable]:
+            pending.remove(stage)
+            self.status[stage.name] = "skipped"
+            _pool.count("stopped")
+        for future, stage in list(running.items()):
+            if stage.stoppable:
+                del running[future]
+                self.status[stage.name] = "skipped" if future.cancel() else "stopped"
+                self.timings[stage.name] = None
+                _pool.count("stopped")
+
+    def _run_concurrent(self, stop_when) -> dict:
+        results, errors = {}, {}
+        pending = list(self.stages)
+        running = {}  # future -> stage
+        started = {}  # stage name -> monotonic start time, written by the worker
+        stopped = False
+
+        while pending or running:
+            if not stopped and stop_when is not None and stop_when(results):
+                stopped = True
+                self._stop(pending, running)
+            for stage in list(pending):
+                if any(dep in errors or self.status.get(dep) in ("skipped", "stopped") for dep in stage.after):
+                    # An input failed or was stopped; the stage cannot run
+                    pending.remove(stage)
+                    self.status[stage.name] = "skipped"
+                elif all(dep in results for dep in stage.after):
+                    pending.remove(stage)
+                    args = tuple(results[dep] for dep in stage.after)
+                    running[_pool.submit(_call, stage.fn, args, started, stage.name)] = stage
+            if not running:
+                break
+
+            deadlines, queued = [], False
+            for stage in running.values():
+                if stage.timeout > 0:
+                    if stage.name in started:
+                        deadlines.append(started[stage.name] + stage.timeout)
+                    else:
+                        queued = True
+            timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            if queued:
+                timeout = _START_POLL_SECONDS if timeout is None else min(timeout, _START_POLL_SECONDS)
+            done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    results[stage.name], self.timings[stage.name] = future.result()
+                    self.status[stage.name] = "ok"
+                except Exception as e:
+                    errors[stage.name] = e
+                    self.status[stage.name] = "error"
+                    _pool.count("failed")
+
+            now = time.monotonic()
+            for future, stage in list(running.items()):
+                if stage.timeout <= 0 or stage.name not in started or now < started[stage.name] + stage.timeout:
+                    continue
+                # Abandon it; the worker thread runs it to completion in the background
+                del running[future]
+                self.timings[stage.name] = None
+                self.status[stage.name] = "timeout"
+                _pool.count("timedOut")
+                if stage.default is _NO_DEFAULT:
+                    errors[stage.name] = StageTimeoutError(f"Stage {stage.name} exceeded {stage.timeout:g}s")
+                else:
+                    results[stage.name] = stage.default
+
+        for stage in self.stages:
+            if stage.name in errors:
+                raise errors[stage.name]
+        return {stage.name: results[stage.name] for stage in self.stages if stage.name in results}
+
+
+def run_stages(stages: list, stop_when=None) -> dict:
+    """Run a one-off graph; see StageGraph."""
+    return StageGraph(stages).run(stop_when)
@@ -1,9 +1,10 @@
-from PIL import Image, ImageChops
-import os
-import numpy as np
+from document_image import DocumentImage
+from ela import error_levels
+from metrics import timed
 
 class TamperDetector:
-    def detect_tampering(self, image_path: str, quality: int = 90, threshold: float = 3.5):
+    @timed("tamper_ela")
+    def detect_tampering(self, doc: DocumentImage, quality: int = 90, threshold: float = 3.5):
         """
         Detects potential tampering using Error Level Analysis (ELA).
         
@@ -11,38 +12,11 @@ class TamperDetector:
         2. Calculates difference between original and resaved image.
         3. High difference usually indicates manipulation (or high frequency noise).
         """
-        if not os.path.exists(image_path):
-            return {"tampered": False, "ela_score": 0.0, "error": "File not found"}
-
         try:
-            original = Image.open(image_path).convert('RGB')
-            
-            # Temporary filename
-            directory, filename = os.path.split(image_path)
-            temp_filename = f"temp_ela_{filename}.jpg"
-            temp_path = os.path.join(directory, temp_filename)
-            
-            # Save compressed version
-            original.save(temp_path, 'JPEG', quality=quality)
-            
-            # Open compressed version
-            compressed = Image.open(temp_path).convert('RGB')
-            
-            # Calculate difference
-            diff = ImageChops.difference(original, compressed)
-            
-            # Cleanup
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-            
-            # ELA Score Calculation
-            # Get extrema (min, max) for each channel to see range of diffs
-            extrema = diff.getextrema()
-            max_diff = max([ex[1] for ex in extrema])
-            
-            # Calculate mean pixel difference using numpy for speed
-            diff_np = np.array(diff)
-            mean_diff = np.mean(diff_np)
+            # In-memory resave + diff, shared with VisualForensics
+            ela = error_levels(doc, quality)
+            max_diff = ela.max_channel
+            mean_diff = ela.mean
             
             # Logic: 
             # If the original was a JPEG, saving it again at similar quality 
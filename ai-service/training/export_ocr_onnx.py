@@ -0,0 +1,106 @@
+"""
+Export EasyOCR's CRAFT detector and English recognizer to ONNX for the
+"onnx" OCR backend, and write int8 dynamically quantized copies.
+
+Usage: python training/export_ocr_onnx.py [--out models/onnx] [--quantize-detector]
+
+Writes craft.onnx / recognizer.onnx and, unless --no-quantize is given,
+recognizer.int8.onnx (LSTM/MatMul/Gemm weights) and, with
+--quantize-detector, craft.int8.onnx (Conv weights, often slower on CPU).
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ocr_backends import OCR_LANGS, ONNX_MODEL_DIR, DETECTOR_FILE, RECOGNIZER_FILE
+
+OPSET = 17
+
+
+def export_detector(reader, path):
+    import torch
+    model = reader.detector.module if hasattr(reader.detector, "module") else reader.detector
+    model.eval()
+    dummy = torch.randn(1, 3, 640, 640)
+    torch.onnx.export(
+        model, dummy, path, opset_version=OPSET,
+        input_names=["input"], output_names=["y", "feature"],
+        dynamic_axes={"input": {0: "batch", 2: "height", 3: "width"},
+                      "y": {0: "batch", 1: "out_height", 2: "out_width"},
+                      "feature": {0: "batch", 2: "out_height", 3: "out_width"}},
+    )
+
+
+def export_recognizer(reader, path):
+    import torch
+
+    class MeanOverHeight(torch.nn.Module):
+        # AdaptiveAvgPool2d((None, 1)) does not export with a dynamic width; same result
+        def forward(self, x):
+            return x.mean(dim=3, keepdim=True)
+
+    model = reader.recognizer.module if hasattr(reader.recognizer, "module") else reader.recognizer
+    model.eval()
+    if hasattr(model, "AdaptiveAvgPool"):
+        model.AdaptiveAvgPool = MeanOverHeight()
+
+    class Wrapper(torch.nn.Module):
+        def __init__(self, inner):
+            super().__init__()
+            self.inner = inner
+
+        def forward(self, image):
+            # CTC recognizer ignores the text argument at inference time
+            return self.inner(image, None)
+
+    dummy = torch.randn(1, 1, 64, 256)
+    torch.onnx.export(
+        Wrapper(model), dummy, path, opset_version=OPSET,
+        input_names=["input"], output_names=["preds"],
+        dynamic_axes={"input": {0: "batch", 3: "width"}, "preds": {0: "batch", 1: "steps"}},
+    )
+
+
+def quantize(src, dst, op_types):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantize_dynamic(src, dst, weight_type=QuantType.QInt8, op_types_to_quantize=op_types)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--out", default=ONNX_MODEL_DIR)
+    parser.add_argument("--no-quantize", action="store_true")
+    parser.add_argument("--quantize-detector", action="store_true")
+    args = parser.parse_args()
+
+    import easyocr
+    os.makedirs(args.out, exist_ok=True)
+    # quantize=False: torch's dynamically quantized LSTM/Linear modules do not export
+    reader = easyocr.Reader(OCR_LANGS, gpu=False, verbose=False, quantize=False)
+
+    det_path = os.path.join(args.out, f"{DETECTOR_FILE}.onnx")
+    rec_path = os.path.join(args.out, f"{RECOGNIZER_FILE}.onnx")
+    print(f"Exporting detector -> {det_path}")
+    export_detector(reader, det_path)
+    print(f"Exporting recognizer -> {rec_path}")
+    export_recognizer(reader, rec_path)
+
+    if not args.no_quantize:
+        rec_q = os.path.join(args.out, f"{RECOGNIZER_FILE}.int8.onnx")
+        print(f"Quantizing recognizer -> {rec_q}")
+        quantize(rec_path, rec_q, ["LSTM", "MatMul", "Gemm"])
+        if args.quantize_detector:
+            det_q = os.path.join(args.out, f"{DETECTOR_FILE}.int8.onnx")
+            print(f"Quantizing detector -> {det_q}")
+            quantize(det_path, det_q, ["Conv"])
+
+    for name in sorted(os.listdir(args.out)):
+        size = os.path.getsize(os.path.join(args.out, name)) / 2**20
+        print(f"  {name}: {size:.1f} MiB")
+    print("Done. Set OCR_BACKEND=onnx to use these models.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 import sys
 import os
 import csv
-import joblib
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
 import numpy as np
 from sklearn.ensemble import RandomForestClassifier
@@ -12,22 +16,39 @@ from sklearn.metrics import classification_report, accuracy_score
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from ml.feature_extractor import feature_extractor
-from ocr_analyzer import ocr_analyzer
+from ocr_analyzer import ocr_analyzer, load_reader
 from visual_forensics import visual_forensics
+from document_image import DocumentImage
+from feature_cache import feature_cache
+from model_registry import model_registry, atomic_dump
 
 DATASET_DIR = "dataset"
 METADATA_FILE = os.path.join(DATASET_DIR, "metadata.csv")
 MODEL_DIR = "models"
 MODEL_PATH = os.path.join(MODEL_DIR, "fraud_model.pkl")
+REGISTRY_NAME = "fraud_random_forest"
 FEEDBACK_FILE = os.path.join(DATASET_DIR, "feedback", "feedback.csv")
+CHECKPOINT_PATH = os.path.join(MODEL_DIR, "feature_checkpoint.jsonl")
+FEATURES_X_PATH = os.path.join(MODEL_DIR, "train_X.npy")
+FEATURES_Y_PATH = os.path.join(MODEL_DIR, "train_y.npy")
+PROGRESS_EVERY = 50
 
 def process_image(image_path):
-    # Run Analysis Pipeline
+    # Run Analysis Pipeline (OCR and visual results are reused from the feature cache)
     try:
-        text = ocr_analyzer.extract_text(image_path)
-        fields = ocr_analyzer.extract_fields(text)
-        signals = ocr_analyzer.run_anomaly_checks(fields)
-        vis = visual_forensics.analyze(image_path)
+        doc = DocumentImage.from_path(image_path)
+        cached = feature_cache.get(doc.content_hash)
+        if cached is not None and cached["features"] is not None:
+            return cached["features"]
+
+        if cached is not None:
+            text, ocr_mode, fields, vis = cached["text"], cached["ocrMode"], cached["fields"], cached["visual"]
+        else:
+            text, ocr_mode = ocr_analyzer.extract_text_with_mode(doc)
+            fields = ocr_analyzer.extract_fields(text)
+            vis = visual_forensics.analyze(doc)
+        # Training must not register its invoice numbers as seen
+        signals = ocr_analyzer.run_anomaly_checks(fields, check_duplicates=False)
         
         data = {
             "text": text,
@@ -36,75 +57,157 @@ def process_image(image_path):
             "visual": vis
         }
         
-        return feature_extractor.extract_features(image_path, data)
+        feats = feature_extractor.extract_features(doc, data)
+        feature_cache.put(doc.content_hash, text, ocr_mode, fields, vis, feats)
+        return feats
     except Exception as e:
         print(f"Error processing {image_path}: {e}")
         return None
 
-def train():
-    X = []
-    y = []
-    
-    # 1. Load Synthetic Data
+def _init_worker():
+    """Process-pool initializer: one OCR reader per worker, one BLAS/torch thread each."""
+    os.environ["OMP_NUM_THREADS"] = "1"
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+    load_reader()
+
+
+def _signature(path):
+    st = os.stat(path)
+    return [st.st_size, int(st.st_mtime)]
+
+
+def load_checkpoint(checkpoint_path):
+    """
+    path -> features for images finished by an earlier (possibly interrupted) run.
+    Entries written under another feature version (extractor, analysis or OCR
+    settings) have a different layout or content and are re-extracted.
+    """
+    done = {}
+    if not os.path.exists(checkpoint_path):
+        return done
+    version, stale = feature_cache.version, 0
+    with open(checkpoint_path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # torn last line from an interrupted write
+            if entry.get("version") != version:
+                stale += 1
+                continue
+            path = entry["path"]
+            if os.path.exists(path) and _signature(path) == entry["sig"]:
+                done[path] = np.array(entry["features"], dtype=np.float32)
+    if stale:
+        print(f"Ignoring {stale} checkpoint entries from another feature version")
+    return done
+
+
+def collect_samples(limit=0):
+    """[(image_path, label, weight)] from the synthetic metadata and the feedback log."""
+    samples = []
+
+    # 1. Synthetic Data
     if os.path.exists(METADATA_FILE):
-        print("Loading dataset metadata...")
         df = pd.read_csv(METADATA_FILE)
-        print(f"Extracting features from synthetic images...")
-        
-        limit = 200 # Process up to 200 synthetic images
-        count = 0
-        
-        for i, row in df.iterrows():
-            if count >= limit: break
-            
-            label = row['label']
-            filename = row['filename']
-            subdir = "safe" if label == "safe" else "fraud"
-            image_path = os.path.join(DATASET_DIR, "receipts", subdir, filename)
-            
-            if not os.path.exists(image_path): continue
-            
-            print(f"[{count+1}/{limit}] Processing synthetic: {filename}")
-            feats = process_image(image_path)
-            if feats is not None:
-                X.append(feats)
-                y.append(1 if label == "fraud" else 0)
-                count += 1
-    
-    # 2. Load Feedback Data (Real-world corrections)
+        for _, row in df.iterrows():
+            subdir = "safe" if row['label'] == "safe" else "fraud"
+            image_path = os.path.join(DATASET_DIR, "receipts", subdir, row['filename'])
+            if not os.path.exists(image_path):
+                continue
+            samples.append((image_path, 1 if row['label'] == "fraud" else 0, 1))
+            if limit and len(samples) >= limit:
+                break
+        print(f"Found {len(samples)} synthetic images.")
+
+    # 2. Feedback Data (Real-world corrections)
     if os.path.exists(FEEDBACK_FILE):
-        print("Loading feedback data for continuous learning...")
         try:
             fb_df = pd.read_csv(FEEDBACK_FILE)
             print(f"Found {len(fb_df)} feedback entries.")
-            
             for _, row in fb_df.iterrows():
                 image_path = row['image_path']
-                correct_label = row['correct_status'] # SAFE or FRAUD
-                
                 if not os.path.exists(image_path):
                     print(f"Missing feedback image: {image_path}")
                     continue
-                    
-                print(f"[FEEDBACK] Processing {os.path.basename(image_path)} -> {correct_label}")
-                feats = process_image(image_path)
-                
-                if feats is not None:
-                    # Upsample feedback data (5x weight) to prioritize user corrections
-                    lbl = 1 if correct_label.upper() == "FRAUD" else 0
-                    for _ in range(5):
-                        X.append(feats)
-                        y.append(lbl)
-                        
+                # Upsample feedback data (5x weight) to prioritize user corrections
+                lbl = 1 if row['correct_status'].upper() == "FRAUD" else 0
+                samples.append((image_path, lbl, 5))
         except Exception as e:
             print(f"Error loading feedback: {e}")
 
+    return samples
+
+
+def extract_all(paths, workers, checkpoint_path):
+    """
+    Features for every path, fanned out over a process pool. Each finished
+    image is appended to the checkpoint, so a rerun skips completed work.
+    """
+    done = load_checkpoint(checkpoint_path)
+    todo = [p for p in dict.fromkeys(paths) if p not in done]
+    print(f"Features: {len(done)} from checkpoint, {len(todo)} to extract with {workers} worker(s)")
+    if not todo:
+        return done
+
+    os.makedirs(os.path.dirname(checkpoint_path) or ".", exist_ok=True)
+    start = time.time()
+    failed = 0
+    with open(checkpoint_path, "a") as checkpoint:
+        def record(path, feats, n):
+            nonlocal failed
+            if feats is None:
+                failed += 1
+            else:
+                done[path] = feats
+                checkpoint.write(json.dumps({"path": path, "sig": _signature(path), "version": feature_cache.version,
+                                             "features": feats.tolist()}) + "\n")
+                checkpoint.flush()
+            if n % PROGRESS_EVERY == 0 or n == len(todo):
+                rate = n / max(time.time() - start, 1e-9)
+                print(f"  {n}/{len(todo)} images ({rate:.1f}/s, {failed} failed)")
+
+        if workers <= 1:
+            for n, path in enumerate(todo, 1):
+                record(path, process_image(path), n)
+        else:
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker) as pool:
+                futures = {pool.submit(process_image, path): path for path in todo}
+                for n, future in enumerate(as_completed(futures), 1):
+                    record(futures[future], future.result(), n)
+    return done
+
+
+def train(args=None):
+    args = args or parse_args([])
+    samples = collect_samples(args.limit)
+    features = extract_all([path for path, _, _ in samples], args.workers, args.checkpoint)
+
+    X = []
+    y = []
+    for path, label, weight in samples:
+        if path in features:
+            for _ in range(weight):
+                X.append(features[path])
+                y.append(label)
+
     if len(X) == 0:
         print("No training data found.")
         return
 
-    X = np.array(X)
+    X = np.array(X, dtype=np.float32)
     y = np.array(y)
+
+    # Keep the matrix so the model can be refit or inspected without re-extracting
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    np.save(FEATURES_X_PATH, X)
+    np.save(FEATURES_Y_PATH, y)
+    print(f"Feature matrix saved to {FEATURES_X_PATH} / {FEATURES_Y_PATH}")
     
     print(f"Training on {len(X)} samples (including oversampling). Shape: {X.shape}")
     
@@ -116,19 +219,42 @@ def train():
         X_test, y_test = X, y # Not enough data for split
     
     # Model: Random Forest
-    clf = RandomForestClassifier(n_estimators=100, random_state=42)
+    clf = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=-1)
     clf.fit(X_train, y_train)
     
     # Evaluate
+    accuracy = None
     if len(X_test) > 0:
         y_pred = clf.predict(X_test)
+        accuracy = accuracy_score(y_test, y_pred)
         print("\nModel Evaluation:")
-        print(f"Accuracy: {accuracy_score(y_test, y_pred):.2f}")
+        print(f"Accuracy: {accuracy:.2f}")
     
-    # Save
-    os.makedirs(MODEL_DIR, exist_ok=True)
-    joblib.dump(clf, MODEL_PATH)
+    # Publish; running workers swap it in (or start shadowing it) on their next registry poll
+    version = model_registry.publish(REGISTRY_NAME, clf, {
+        "samples": len(X), "features": int(X.shape[1]), "accuracy": accuracy,
+        "featureVersion": feature_extractor.VERSION, "source": "training/train_models.py",
+    }, candidate=args.candidate)
+    if args.candidate:
+        print(f"Model published as {REGISTRY_NAME} candidate {version}; "
+              f"promote with: python model_registry.py promote {REGISTRY_NAME}")
+        return
+    print(f"Model published as {REGISTRY_NAME} {version}")
+    # Offline tools still read the plain file; write it without ever leaving a partial one
+    atomic_dump(clf, MODEL_PATH)
     print(f"Model saved to {MODEL_PATH}")
 
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Train the document fraud RandomForest.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="feature-extraction processes (1 = serial)")
+    parser.add_argument("--limit", type=int, default=0, help="max synthetic images (0 = all)")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH,
+                        help="JSONL of finished images; delete it to force re-extraction")
+    parser.add_argument("--candidate", action="store_true",
+                        help="publish as a shadow/canary candidate instead of the serving model")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
-    train()
+    train(parse_args())
@@ -0,0 +1,174 @@
+"""
+Streaming readers for binary uploads (multipart or application/octet-stream).
+Bodies are read in chunks with the size cap enforced as they arrive and the
+content hash computed on the fly, so no base64 round trip is needed.
+Multipart bodies go through python-multipart's incremental parser directly
+from the request stream (not request.form(), which spools the whole body
+first), so chunked uploads without a Content-Length are capped too.
+"""
+import hashlib
+import json
+import os
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+# Room for the other form fields and part headers on top of the file itself
+MAX_FORM_OVERHEAD_BYTES = 1024 * 1024
+
+
+class UploadTooLargeError(Exception):
+    """Raised as soon as an upload is known to exceed MAX_UPLOAD_BYTES."""
+
+
+class UploadFormatError(Exception):
+    """Raised for an unsupported content type or a missing image part."""
+
+
+def check_content_length(headers, max_bytes: int = MAX_UPLOAD_BYTES):
+    """Reject early when the declared body size is already over the cap."""
+    declared = headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_bytes:
+        raise UploadTooLargeError(f"Upload exceeds {max_bytes} bytes")
+
+
+async def _collect(chunks, max_bytes: int):
+    hasher = hashlib.sha256()
+    buffer = bytearray()
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        if len(buffer) + len(chunk) > max_bytes:
+            raise UploadTooLargeError(f"Upload exceeds {max_bytes} bytes")
+        hasher.update(chunk)
+        buffer.extend(chunk)
+    if not buffer:
+        raise UploadFormatError("Empty upload")
+    return bytes(buffer), hasher.hexdigest()
+
+
+class _MultipartCollector:
+    """python-multipart callbacks: hash and cap the file part, keep the small text fields."""
+
+    def __init__(self, file_field: str, max_bytes: int):
+        self.file_field = file_field
+        self.max_bytes = max_bytes
+        self.hasher = hashlib.sha256()
+        self.data = None
+        self.filename = None
+        self.fields = {}
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._part = None  # (name, is_file)
+        self._value = bytearray()
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self._part_begin,
+            "on_header_field": self._header_field_data,
+            "on_header_value": self._header_value_data,
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+        }
+
+    def _part_begin(self):
+        self._headers, self._part, self._value = {}, None, bytearray()
+
+    def _header_field_data(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def _header_value_data(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def _header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field, self._header_value = b"", b""
+
+    def _headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        is_file = b"filename" in options
+        if is_file and name == self.file_field and self.data is None:
+            self.data = bytearray()
+            self.filename = options[b"filename"].decode("utf-8", "replace")
+        self._part = (name, is_file)
+
+    def _part_data(self, data, start, end):
+        name, is_file = self._part
+        chunk = data[start:end]
+        if is_file and name == self.file_field and isinstance(self.data, bytearray):
+            if len(self.data) + len(chunk) > self.max_bytes:
+                raise UploadTooLargeError(f"Upload exceeds {self.max_bytes} bytes")
+            self.hasher.update(chunk)
+            self.data.extend(chunk)
+        elif not is_file:
+            self._value.extend(chunk)
+        # Other file parts are dropped
+
+    def _part_end(self):
+        name, is_file = self._part
+        if is_file and name == self.file_field and isinstance(self.data, bytearray):
+            self.data = bytes(self.data)  # later parts with the same name are ignored
+        elif not is_file and name != self.file_field:
+            self.fields[name] = self._value.decode("utf-8", "replace")
+
+
+async def _read_multipart(request, content_type: str, file_field: str, max_bytes: int):
+    _, options = parse_options_header(content_type)
+    boundary = options.get(b"boundary")
+    if not boundary:
+        raise UploadFormatError("Multipart body has no boundary")
+    collector = _MultipartCollector(file_field, max_bytes)
+    parser = MultipartParser(boundary, collector.callbacks())
+    body_limit, received = max_bytes + MAX_FORM_OVERHEAD_BYTES, 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > body_limit:
+                raise UploadTooLargeError(f"Upload exceeds {max_bytes} bytes")
+            parser.write(chunk)
+        parser.finalize()
+    except (UploadTooLargeError, UploadFormatError):
+        raise
+    except Exception as e:
+        raise UploadFormatError(f"Malformed multipart body: {e}")
+    if collector.data is None:
+        raise UploadFormatError(f"Multipart body has no '{file_field}' file part")
+    if not collector.data:
+        raise UploadFormatError("Empty upload")
+    return collector.data, collector.hasher.hexdigest(), collector.filename or "upload.png", collector.fields
+
+
+async def read_upload(request, file_field: str = "image", max_bytes: int = MAX_UPLOAD_BYTES):
+    """
+    Read an image from a multipart form (file_field part) or a raw
+    application/octet-stream body. Returns (bytes, sha256 hex, name, fields)
+    where fields holds the remaining form fields or the query parameters.
+    """
+    check_content_length(request.headers, max_bytes)
+    content_type = request.headers.get("content-type", "")
+
+    if content_type.startswith("multipart/form-data"):
+        return await _read_multipart(request, content_type, file_field, max_bytes)
+
+    if content_type.startswith("application/octet-stream") or content_type.startswith("image/"):
+        data, content_hash = await _collect(request.stream(), max_bytes)
+        return data, content_hash, request.query_params.get("filename", "upload.png"), dict(request.query_params)
+
+    raise UploadFormatError("Expected multipart/form-data or application/octet-stream")
+
+
+def parse_json_field(value, default=None):
+    """Decode a JSON-encoded form/query field such as vendorContext."""
+    if not value:
+        return default
+    try:
+        return json.loads(value)
+    except ValueError:
+        raise UploadFormatError("Field is not valid JSON")
@@ -4,7 +4,9 @@ Analyzes signatures, QR codes, and visual tamper patterns.
 """
 import cv2
 import numpy as np
-import os
+from document_image import DocumentImage
+from ela import error_levels
+from metrics import timed
 
 
 class VisualForensics:
@@ -12,26 +14,23 @@ class VisualForensics:
         self.min_signature_area = 500  # Minimum contour area
         self.blur_threshold = 100      # Laplacian variance threshold
 
-    def analyze(self, image_path: str) -> dict:
+    def analyze(self, doc: DocumentImage) -> dict:
         """Run full battery of visual forensic checks."""
-        if not os.path.exists(image_path):
-            return {"error": "Image file not found"}
-
-        # Read image
-        img = cv2.imread(image_path)
+        img = doc.bgr
         if img is None:
             return {"error": "Failed to load image"}
 
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        gray = doc.gray
         
         results = {
             "signature": self.analyze_signature(img, gray),
             "qr": self.validate_qr(img),
-            "tampering": self.detect_tampering(img, gray)
+            "tampering": self.detect_tampering(doc)
         }
         
         return results
 
+    @timed("visual_signature")
     def analyze_signature(self, img, gray) -> dict:
         """
         Detect signature presence, quality, and potential forgery.
@@ -105,6 +104,7 @@ class VisualForensics:
 
         return result
 
+    @timed("visual_qr")
     def validate_qr(self, img) -> dict:
         """Validate QR codes using OpenCV (Dependency-free)."""
         try:
@@ -134,55 +134,35 @@ class VisualForensics:
             return {"valid": False, "found": False, "message": "QR detection error"}
 
 
-    def detect_tampering(self, img, gray) -> dict:
+    @timed("visual_tampering")
+    def detect_tampering(self, doc: DocumentImage) -> dict:
         """
         Visual tampering detection.
         Checks for:
         1. Inconsistent noise levels (ELA-like heuristic)
         2. "Ghost" edges from copy-paste
         """
-        # Error Level Analysis (ELA) - Simplified
-        # Save at 95% quality and diff
-        import tempfile
-        
         has_tampering = False
         notes = []
 
         try:
-            with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as tmp:
-                temp_filename = tmp.name
-            
-            cv2.imwrite(temp_filename, img, [cv2.IMWRITE_JPEG_QUALITY, 90])
-            resaved = cv2.imread(temp_filename)
-            
-            # Calculate difference
-            diff = cv2.absdiff(img, resaved)
-            gray_diff = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
-            
-            # Check maximum difference pixel (if > threshold, might be manipulated)
-            _, max_val, _, _ = cv2.minMaxLoc(gray_diff)
-            
+            # Error Level Analysis at 90% quality, shared with TamperDetector
+            ela = error_levels(doc, quality=90)
+
             # If high frequency noise is very uniform everywhere except one spot
             # This is a complex check, simplifying to a basic noise consistency check
             # For this MVP, we will assume tampering if we detect significant blocky artifacts
             # in critical regions (Total Amount area - usually middle right)
             
             # Check Total Amount Region (Approximate: Middle Right)
-            h, w = gray.shape
-            roi_total = gray_diff[int(h*0.4):int(h*0.8), int(w*0.6):w]
+            roi_mean = ela.region_mean(0.4, 0.8, 0.6, 1.0)
             
-            if roi_total.size > 0:
-                roi_mean = np.mean(roi_total)
-                global_mean = np.mean(gray_diff)
-                
-                if roi_mean > global_mean * 1.5:
-                    has_tampering = True
-                    notes.append("Inconsistent noise pattern in 'Total Amount' region")
-
-            os.remove(temp_filename)
+            if roi_mean is not None and roi_mean > ela.gray_mean * 1.5:
+                has_tampering = True
+                notes.append("Inconsistent noise pattern in 'Total Amount' region")
             
         except Exception:
-            pass # Fail gracefully on filesystem issues
+            pass # Fail gracefully on encode/decode errors
 
         return {
             "isTampered": has_tampering,